@@ -0,0 +1,25 @@
+from fastapi import Depends, Request
+
+from app.core.jobs import IngestionJobQueue
+from app.core.rag_chain import RAGChain
+from app.core.registry import ServiceRegistry
+from app.core.vector_store import VectorStoreService
+
+
+def get_registry(request:Request)->ServiceRegistry:
+
+    """Service registry created in the application lifespan"""
+
+    return request.app.state.registry
+
+async def get_vector_store(registry:ServiceRegistry=Depends(get_registry))->VectorStoreService:
+    return await registry.aget_vector_store()
+
+async def get_rag_chain(registry:ServiceRegistry=Depends(get_registry))->RAGChain:
+    return await registry.aget_rag_chain()
+
+def get_job_queue(request:Request)->IngestionJobQueue:
+
+    """Ingestion job queue started in the application lifespan"""
+
+    return request.app.state.job_queue
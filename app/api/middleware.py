@@ -0,0 +1,65 @@
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import get_settings
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+#Boundaries and part headers a multipart body carries on top of the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+
+    """Answers 413 to uploads over MAX_UPLOAD_MB before their body is spooled.
+
+    Starlette parses a multipart body to disk before the route runs, so the route can only
+    check the size afterwards. The declared Content-Length is checked first, a body sent
+    without one is counted as it arrives and cut off once it is over the limit"""
+
+    def __init__(self, app:ASGIApp, paths:tuple[str,...]=("/documents/upload",)):
+
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send)->None:
+
+        if scope['type'] != 'http' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        max_upload_mb = get_settings().max_upload_mb
+        limit = max_upload_mb * 1_000_000 + MULTIPART_OVERHEAD_BYTES
+        response = JSONResponse(status_code=413,
+                                content={'detail':f"Upload is larger than the maximum of {max_upload_mb} MB"})
+
+        content_length = Headers(scope=scope).get('content-length', '')
+        if content_length.isdigit() and int(content_length) > limit:
+            logger.error(f"Rejected an upload of {content_length} bytes")
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        too_large = False
+
+        async def limited_receive()->Message:
+            nonlocal received, too_large
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    too_large = True
+                    raise ValueError(f"Upload is larger than the maximum of {max_upload_mb} MB")
+            return message
+
+        async def limited_send(message:Message)->None:
+            #The body parser turns the error above into a 400, it is answered as a 413 instead
+            if not too_large:
+                await send(message)
+            elif message['type'] == 'http.response.start':
+                logger.error(f"Rejected an upload of more than {limit} bytes")
+                await response(scope, receive, send)
+
+        await self.app(scope, limited_receive, limited_send)
@@ -1,8 +1,16 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from typing import Literal
 
-from app.api.schema import DocumentUploadResponse, DocumentListResponse, ErrorResponse
+from fastapi import APIRouter, Depends, File, Query, UploadFile, HTTPException
 
-from app.core.document_processor import DocumentProcessor
+from app.api.dependencies import get_job_queue, get_registry, get_vector_store
+from app.api.schema import DocumentListResponse, ErrorResponse, JobStatusResponse, JobSubmittedResponse
+
+from app.core.document_processor import DocumentProcessor, UploadTooLargeError
+from app.core.jobs import IngestionJobQueue
+from app.core.registry import ServiceRegistry
 from app.core.vector_store import VectorStoreService
 
 from app.utils.logger import get_logger
@@ -10,15 +18,22 @@ logger = get_logger(__name__)
 router=APIRouter(prefix="/documents", tags=["Documents"])
 
 @router.post("/upload",
-        response_model=DocumentUploadResponse,
+        status_code=202,
+        response_model=JobSubmittedResponse,
         responses={
             400:{"model":ErrorResponse,"description":"Invalid file type"},
+            413:{"model":ErrorResponse,"description":"File too large"},
             500:{"model":ErrorResponse,"description":"Processin Error"}
         },
         summary="Upload and digest a document",
-        description="Upload a document  to be processed and added to the vector store",
+        description="Upload a document to be processed and added to the vector store in the background. "
+                    "Poll the returned status url for the progress of the ingestion job",
         )
-async def upload_document(file:UploadFile=File(...,description="File to be processed"))->DocumentUploadResponse:
+async def upload_document(file:UploadFile=File(...,description="File to be processed"),
+                          skip_existing:bool|None=Query(None,description="Skip chunks that are already stored, defaults to INGESTION_SKIP_EXISTING"),
+                          mode:Literal['append','reindex']=Query('append',description="reindex replaces the stored chunks of a document with the same "
+                                                                 "filename, embedding only the chunks that changed and deleting the removed ones"),
+                          job_queue:IngestionJobQueue=Depends(get_job_queue))->JobSubmittedResponse:
 
     logger.info(f"Received a file to be processed {file.filename}")
 
@@ -28,53 +43,96 @@ async def upload_document(file:UploadFile=File(...,description="File to be proce
             status_code=400,
             detail="File name is required"
         )
+
+    file_extension = Path(file.filename).suffix.lower()
+    if file_extension not in DocumentProcessor.SUPPORTED_EXTENSIONS:
+        logger.error(f"Invalid file upload")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Error processing the file unsupported file extension {file_extension}"
+        )
     
+    document_processor = DocumentProcessor()
+
+    if file.size is not None and file.size > document_processor.max_upload_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload is larger than the maximum of {document_processor.max_upload_bytes // 1_000_000} MB"
+        )
+
+    spool_path = None
+
     try:
-        document_processor = DocumentProcessor()
-        chunks = document_processor.procee_upload_file(file=file.file, filename=file.filename)
-
-        if not chunks:
-            logger.error(f"Error: No chunks can be exracted ")
-            raise HTTPException(
-                status_code=400,
-                detail="No chunks could be extracted from the file"
-            )
-        
-        vector_store = VectorStoreService()
-        document_ids = vector_store.add_documents(chunks)
-
-        logger.info(f"Successfully processed the file {file.filename}"
-                    f"{len(chunks)} were extracted from the file")
-        
-        return DocumentUploadResponse(
-            message="Document upload is processed successfully",
+        job_id, spool_path = job_queue.new_spool_path(file.filename)
+
+        await document_processor.aspool_upload(file=file, destination=spool_path)
+
+        job = await asyncio.to_thread(job_queue.submit, job_id, file.filename, spool_path,
+                                      {'skip_existing':skip_existing, 'mode':mode})
+
+        logger.info(f"Queued the file {file.filename} as the ingestion job {job_id}")
+
+        return JobSubmittedResponse(
+            job_id=job_id,
             filename=file.filename,
-            chunks_created=len(chunks),
-            document_ids=document_ids
+            status=job['status'],
+            status_url=f"{router.prefix}/jobs/{job_id}"
         )
-    except ValueError as e:
-        logger.error(f"Invalid file upload")
+    except UploadTooLargeError as e:
+        logger.error(f"Upload is too large: {file.filename}")
         raise HTTPException(
-            status_code=400,
-            detail=f"Error processing the file {str(e)}"
+            status_code=413,
+            detail=str(e)
         )
     except Exception as e:
         logger.error(f"Error in processing the file: {str(e)}")
+        if spool_path is not None:
+            Path(spool_path).unlink(missing_ok=True)
         raise HTTPException(
             status_code=500,
             detail=f"Error in processing the file {str(e)}"
         )
 
+@router.get("/jobs/{job_id}",
+            response_model=JobStatusResponse,
+            responses={
+                404:{"model":ErrorResponse,"description":"Job not found"}
+            },
+            summary="Get ingestion job status",
+            description="Stage, progress, timings and errors of an ingestion job")
+async def get_job_status(job_id:str,
+                         job_queue:IngestionJobQueue=Depends(get_job_queue))->JobStatusResponse:
+
+    job = await asyncio.to_thread(job_queue.get, job_id)
+
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Job {job_id} not found"
+        )
+
+    return JobStatusResponse(
+        job_id=job['id'],
+        filename=job['filename'],
+        status=job['status'],
+        stage=job['stage'],
+        progress=job['progress'] or {},
+        timings=job['timings'] or {},
+        error=job['error'],
+        result=job['result'],
+        created_at=datetime.fromtimestamp(job['created_at']),
+        updated_at=datetime.fromtimestamp(job['updated_at'])
+    )
+
 @router.get("/info",
             response_model=DocumentListResponse,
             summary="Get Collection Information",
             description="Get the Information about the collection")
-async def get_collection_info()->DocumentListResponse:
+async def get_collection_info(vector_store:VectorStoreService=Depends(get_vector_store))->DocumentListResponse:
     logger.info(f"Collection info is requested")
 
     try:
-        vector_store=VectorStoreService()
-        info=vector_store.get_collection_info()
+        info=await vector_store.aget_collection_info()
 
         return DocumentListResponse(collection_name=info["Collection_Name"],
                                     total_documents=info["points_count"],
@@ -94,13 +152,14 @@ async def get_collection_info()->DocumentListResponse:
                    500:{"model":ErrorResponse,"decription":"Deletion Error"}
                }
                )
-async def delete_collection()->dict:
+async def delete_collection(vector_store:VectorStoreService=Depends(get_vector_store),
+                            registry:ServiceRegistry=Depends(get_registry))->dict:
 
     logger.warning(f"Collection deletion is requsted")
 
     try:
-        vector_store = VectorStoreService()
-        vector_store.delete_collection()
+        await vector_store.adelete_collection()
+        registry.invalidate(vector_store.collection_name)
 
         return {"message":"The collection is deleted successfully"}
     except Exception as e:
@@ -2,7 +2,7 @@ from fastapi import APIRouter, File, UploadFile, HTTPException
 
 from app.api.schema import DocumentUploadResponse, DocumentListResponse, ErrorResponse
 from app.core.document_processor import DocumentProcessor
-from app.core.vector_store import VectorStoreService
+from app.core.vector_store import create_vector_store
 
 from app.utils.logger import get_logger
 
@@ -41,7 +41,7 @@ async def upload_document(file:UploadFile=File(...,description="Document to uplo
                 detail="No content coube be extracted from the uploaded file"
             )
         
-        vector_store=VectorStoreService()
+        vector_store=create_vector_store()
         document_ids = vector_store.add_documents(documents=chunks)
 
         logger.info(f" Document successfully processed"
@@ -76,7 +76,7 @@ async def get_collection_info()->DocumentListResponse:
     logger.info(f"Collection information is requested")
 
     try:
-        vector_store=VectorStoreService()
+        vector_store=create_vector_store()
         info = vector_store.get_collection_info()
 
         return DocumentListResponse(
@@ -105,7 +105,7 @@ async def delete_collection()->dict:
     logger.warning("Collection deletion is requested")
 
     try:
-        vector_store = VectorStoreService()
+        vector_store = create_vector_store()
         vector_store.delete_collection()
 
         return {"message":"Deletion of the collection is successfull"}
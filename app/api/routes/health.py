@@ -1,9 +1,14 @@
 from datetime import datetime
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 
-from app.core.vector_store import VectorStoreService
-from app.api.schema import HealthResponse, ReadinessResponse
+from app.api.dependencies import get_registry
+from app.core.registry import ServiceRegistry
+from app.api.schema import HealthResponse, MetricsResponse, ReadinessResponse
+from app.config import get_settings
+from app.core.answer_cache import get_answer_cache
+from app.core.embedding_cache import get_embedding_cache, get_query_embedding_cache
+from app.core.micro_batching import micro_batch_stats
 from app import __version__
 from app.utils.logger import get_logger
 
@@ -26,18 +31,18 @@ async def health_check()->HealthResponse:
 @router.get("/ready",response_model = ReadinessResponse,
             summary="Cloud readiness check",
             description="Check if the service is ready to handle the requests")
-async def readiness_check()->ReadinessResponse:
+async def readiness_check(registry:ServiceRegistry=Depends(get_registry))->ReadinessResponse:
     logger.info(f"Readiness Check has been requested")
 
     try:
-        vector_store=VectorStoreService()
-        is_ready = vector_store.health_check()
+        vector_store = await registry.aget_vector_store()
+        is_ready = await vector_store.ahealth_check()
 
         if not is_ready:
             raise HTTPException(status_code=503,
                                 detail="Vector store is not ready")
         
-        collection_info=vector_store.get_collection_info()
+        collection_info=await vector_store.aget_collection_info()
         return ReadinessResponse(
             status="ready",
             qdrant_connected=True,
@@ -50,5 +55,17 @@ async def readiness_check()->ReadinessResponse:
         raise HTTPException(status_code=503,
                             detail=str(e)
                             )
-    
 
+@router.get("/metrics", response_model=MetricsResponse,
+            summary="Cache and batching metrics",
+            description="Hit and miss counters of the caches used by the service and batch fill of the micro-batching")
+async def metrics()->MetricsResponse:
+
+    settings = get_settings()
+
+    return MetricsResponse(
+        embedding_cache=get_embedding_cache().stats() if settings.embedding_cache_enabled else None,
+        query_embedding_cache=get_query_embedding_cache().stats() if settings.query_cache_enabled else None,
+        answer_cache=get_answer_cache().stats() if settings.answer_cache_enabled else None,
+        micro_batching=micro_batch_stats() if settings.micro_batch_enabled else None
+    )
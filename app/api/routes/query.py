@@ -1,10 +1,16 @@
 from datetime import datetime
+from typing import Any
+import json
 import time
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 
+from app.api.dependencies import get_rag_chain, get_vector_store
 from app.api.schema import (
+    BatchQueryRequest,
+    BatchQueryResponse,
+    BatchQueryResult,
     QueryRequest,
     QueryResponse,
     SourceDocument,
@@ -13,12 +19,31 @@ from app.api.schema import (
 )
 
 from app.core.rag_chain import RAGChain
+from app.core.vector_store import SearchFilter, SearchOptions, VectorStoreService
 from app.utils.logger import get_logger
 
 logger=get_logger(__name__)
 
 router=APIRouter(prefix="/query", tags=["Query"])
 
+def format_sse(event:str, data:Any)->str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def search_options(request:QueryRequest)->SearchOptions:
+
+    search_filter = None
+
+    if request.filter is not None:
+        search_filter = SearchFilter(
+            sources=request.filter.sources,
+            uploaded_after=request.filter.uploaded_after.timestamp() if request.filter.uploaded_after else None,
+            uploaded_before=request.filter.uploaded_before.timestamp() if request.filter.uploaded_before else None,
+            metadata=request.filter.metadata
+        )
+
+    return SearchOptions(hnsw_ef=request.hnsw_ef, oversampling=request.oversampling, filter=search_filter,
+                         mode=request.mode)
+
 @router.post(
     "",
     response_model=QueryResponse,
@@ -29,7 +54,8 @@ router=APIRouter(prefix="/query", tags=["Query"])
     summary="Ask a query",
     description="Submit a question to get the AI Generated answer from the document uploaded"
 )
-async def query(request:QueryRequest)->QueryResponse:
+async def query(request:QueryRequest,
+                rag_chain:RAGChain=Depends(get_rag_chain))->QueryResponse:
     
     logger.info(f"Query Received {request.question}"
                 f"Source_include: {request.include_source} and Enable Evaluation : {request.enable_evaluation}"
@@ -39,11 +65,13 @@ async def query(request:QueryRequest)->QueryResponse:
     
     try:
 
-        rag_chain = RAGChain()
+        cached = False
+        options = search_options(request)
 
         if request.enable_evaluation:
             
-            result = await rag_chain.aquery_with_evaluator(question=request.question, include_source=request.include_source)
+            result = await rag_chain.aquery_with_evaluator(question=request.question, include_source=request.include_source,
+                                                          options=options)
 
             sources = ([SourceDocument(content=source["content"],
                                        metadata=source["metadata"]) 
@@ -55,9 +83,22 @@ async def query(request:QueryRequest)->QueryResponse:
 
             evaluation=EvaluationScores(**result["evaluation"])
 
+        elif rag_chain.answer_cache is not None:
+
+            result = await rag_chain.aquery_cached(question=request.question, options=options)
+
+            sources = ([SourceDocument(content=source["content"],
+                                       metadata=source["metadata"])
+                        for source in result["sources"]]
+                        if request.include_source
+                        else None)
+            answer = result["answer"]
+            cached = result["cached"]
+            evaluation=None
+
         elif request.include_source:
 
-            result = await rag_chain.aquery_with_source(question=request.question)
+            result = await rag_chain.aquery_with_source(question=request.question, options=options)
 
             sources = [SourceDocument(content=source["content"],
                                       metadata=source["metadata"]) 
@@ -66,7 +107,7 @@ async def query(request:QueryRequest)->QueryResponse:
             answer = result["answer"]
             evaluation=None
         else:
-            result = await rag_chain.aquery(question=request.question)
+            answer = await rag_chain.aquery(question=request.question, options=options)
             sources=None
             evaluation=None
 
@@ -81,7 +122,8 @@ async def query(request:QueryRequest)->QueryResponse:
             answer=answer,
             sources=sources,
             processing_time=processing_time,
-            evaluation=evaluation
+            evaluation=evaluation,
+            cached=cached
         )
     except Exception as e:
         logger.error(f"Query can not be processed")
@@ -90,32 +132,133 @@ async def query(request:QueryRequest)->QueryResponse:
             detail=f"Error processing query : {str(e)}"
         )
 
+@router.post(
+    "/batch",
+    response_model=BatchQueryResponse,
+    responses={
+        400:{"model":ErrorResponse,"description":"Invalid Request"},
+        500:{"model":ErrorResponse,"description":"Query Process Error"}
+    },
+    summary="Ask many questions",
+    description="Answer many questions with one embedding request and one vector search batch, "
+                "results come back in order and a failing question only fails its own result"
+)
+async def query_batch(request:BatchQueryRequest,
+                      rag_chain:RAGChain=Depends(get_rag_chain))->BatchQueryResponse:
+
+    logger.info(f"Batch query received with {len(request.questions)} questions")
+
+    if len(request.questions) > rag_chain.settings.batch_max_questions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can have at most {rag_chain.settings.batch_max_questions} questions"
+        )
+
+    start_time = time.time()
+
+    try:
+        #Evaluation runs several LLM calls per answer, it is only available on POST /query
+        items = [item for item in request.questions if not item.enable_evaluation]
+
+        answered = iter(await rag_chain.abatch_query(questions=[item.question for item in items],
+                                                     options=[search_options(item) for item in items]))
+
+        results = []
+        for item in request.questions:
+            if item.enable_evaluation:
+                results.append(BatchQueryResult(question=item.question,
+                                                error="Evaluation is not available in a batch, use POST /query"))
+                continue
+
+            result = next(answered)
+            if isinstance(result, Exception):
+                results.append(BatchQueryResult(question=item.question, error=f"Error processing query : {str(result)}"))
+                continue
+
+            results.append(BatchQueryResult(question=item.question,
+                                            answer=result["answer"],
+                                            sources=([SourceDocument(content=source["content"],
+                                                                     metadata=source["metadata"])
+                                                      for source in result["sources"]]
+                                                     if item.include_source
+                                                     else None)))
+
+        failed = sum(result.error is not None for result in results)
+        processing_time = time.time()-start_time
+
+        logger.info(f"Batch query processed in {processing_time} s, {failed} of {len(results)} questions failed")
+
+        return BatchQueryResponse(
+            results=results,
+            succeeded=len(results)-failed,
+            failed=failed,
+            processing_time=processing_time
+        )
+    except Exception as e:
+        logger.error(f"Batch query can not be processed")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing batch query : {str(e)}"
+        )
+
 @router.post("/stream",
              responses={
                  400:{"model":ErrorResponse,"description":"Invalid Query Request"},
                  500:{"model":ErrorResponse,"description":"Query Processing Error"}
                  },
                  summary="Ask a question",
-                 description="Submit a question for AI to generate and stream the response"
+                 description="Submit a question for AI to generate and stream the response as Server-Sent Events: "
+                             "a `sources` event, then `token` events, then a final `done` event with timings "
+                             "(or an `error` event)"
                  )
-async def query_stream(request:QueryRequest)->StreamingResponse:
+async def query_stream(request:QueryRequest,
+                       http_request:Request,
+                       rag_chain:RAGChain=Depends(get_rag_chain))->StreamingResponse:
     
     logger.info(f"Streaming query received {request.question}")
 
     try:
-        rag_chain = RAGChain()
-
         async def generate():
+            start_time = time.time()
+            first_token_time = None
+            token_count = 0
+            source_count = 0
+
+            stream = rag_chain.astream(question=request.question, options=search_options(request))
             try:
-                for chunk in rag_chain.stream(question=request.question):
-                    yield chunk
+                async for event in stream:
+                    if await http_request.is_disconnected():
+                        logger.info(f"Client disconnected, stopping the stream")
+                        return
+
+                    if 'sources' in event:
+                        source_count = len(event['sources'])
+                        yield format_sse("sources", event['sources'] if request.include_source else [])
+                        continue
+
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                    token_count += 1
+                    yield format_sse("token", {"text":event['token']})
+
+                yield format_sse("done", {
+                    "processing_time":time.time()-start_time,
+                    "time_to_first_token":(first_token_time-start_time) if first_token_time else None,
+                    "tokens":token_count,
+                    "sources":source_count
+                })
             except Exception as e:
-                logger.error(f"Error in stream ")
-                yield f"\n\nError : str(e)"
+                logger.error(f"Error in stream {e}")
+                yield format_sse("error", {"message":str(e)})
+            finally:
+                #Closing the chain stream cancels the upstream LLM call
+                await stream.aclose()
             
         return StreamingResponse(
             generate(),
-            media_type="text/plain"
+            media_type="text/event-stream",
+            headers={"Cache-Control":"no-cache",
+                     "X-Accel-Buffering":"no"}
         )
     except Exception as e:
         logger.error(f"Error in setting up stream")
@@ -130,16 +273,13 @@ async def query_stream(request:QueryRequest)->StreamingResponse:
              summary="Search query",
              description="search for relevant document without getting actual answer"
              )
-async def query_search(request:QueryRequest)->dict:
+async def query_search(request:QueryRequest,
+                       vector_store:VectorStoreService=Depends(get_vector_store))->dict:
 
     logger.info(f"Query to retrieve the relevant document is requested")
 
     try:
-        from app.core.vector_store import VectorStoreService
-
-        vector_store = VectorStoreService()
-
-        result=vector_store.search_with_score(query=request.queston, k=5)
+        result=await vector_store.asearch_with_score(query=request.question, k=5, options=search_options(request))
 
         documents = [{
             "content": doc.page_content,
@@ -1,8 +1,10 @@
 from datetime import datetime
-from typing import Any
+from typing import Annotated, Any, Literal
 
 from pydantic import BaseModel, Field
 
+from app.core.vector_store import METADATA_KEY_PATTERN
+
 #Health Schemas
 
 class HealthResponse(BaseModel):
@@ -15,13 +17,55 @@ class ReadinessResponse(BaseModel):
     qdrant_connected:bool = Field(...,description="Vector store connection status")
     collection_info:dict = Field(...,description="Collection Information")
 
+class MetricsResponse(BaseModel):
+    embedding_cache:dict|None=Field(None,description="Persistent document embedding cache counters")
+    query_embedding_cache:dict|None=Field(None,description="In-memory query embedding cache counters")
+    answer_cache:dict|None=Field(None,description="Semantic answer cache counters")
+    micro_batching:dict|None=Field(None,description="Batch counters of the query embeddings and searches, by kind")
+
 #Document Response Schemas
 
+class IngestionStatsResponse(BaseModel):
+    created:int=Field(0,description="Chunks read from the document")
+    chunks:int=Field(...,description="Chunks embedded and upserted")
+    embedded:int=Field(0,description="Chunks embedded")
+    skipped:int=Field(0,description="Chunks skipped because they were already stored")
+    reused:int=Field(0,description="Chunks upserted with the stored vector of the same content, without embedding")
+    deleted:int=Field(0,description="Stored chunks of the source deleted by a re-index")
+    tokens:int=Field(...,description="Tokens embedded")
+    batches:int=Field(...,description="Embedding/upsert batches")
+    read_seconds:float=Field(0.0,description="Time spent parsing and splitting, summed over batches")
+    embed_seconds:float=Field(...,description="Time spent embedding, summed over batches")
+    upsert_seconds:float=Field(...,description="Time spent upserting, summed over batches")
+    total_seconds:float=Field(...,description="Wall time of the ingestion")
+    chunks_per_second:float=Field(...,description="Chunk throughput")
+    tokens_per_second:float=Field(...,description="Token throughput")
+
 class DocumentUploadResponse(BaseModel):
     message:str=Field(...,description="Document upload status")
     filename:str=Field(...,description="File name for uploaded document")
     chunks_created:int=Field(...,description="Chunks created from the uploaded document")
-    document_ids:list[str]=Field(...,description="Ids of the stored documents")
+    document_ids:list[str]=Field(...,description="Ids of the stored documents, the first 100 for an ingestion job")
+    document_count:int|None=Field(None,description="Number of stored documents")
+    ingestion_stats:IngestionStatsResponse|None=Field(None,description="Embedding and upsert throughput")
+
+class JobSubmittedResponse(BaseModel):
+    job_id:str=Field(...,description="Id of the ingestion job")
+    filename:str=Field(...,description="File name for uploaded document")
+    status:str=Field(...,description="Job status")
+    status_url:str=Field(...,description="Url to poll for the job status")
+
+class JobStatusResponse(BaseModel):
+    job_id:str=Field(...,description="Id of the ingestion job")
+    filename:str=Field(...,description="File name for uploaded document")
+    status:str=Field(...,description="Job status: queued, running, completed or failed")
+    stage:str=Field(...,description="Current stage: queued, ingesting (parsing, chunking and embedding pages as they stream), completed or failed")
+    progress:dict[str,int]=Field(default_factory=dict,description="Pages parsed, chunks created, embedded, upserted, skipped and reused, tokens embedded")
+    timings:dict[str,float]=Field(default_factory=dict,description="Timestamps and durations of the stages in seconds")
+    error:str|None=Field(None,description="Error message if the job failed")
+    result:DocumentUploadResponse|None=Field(None,description="Upload result once the job is completed")
+    created_at:datetime=Field(...,description="Job creation time")
+    updated_at:datetime=Field(...,description="Last job update time")
 
 class DocumentInfo(BaseModel):
     source:str=Field(...,description="Source of the Document/Filename")
@@ -34,6 +78,23 @@ class DocumentListResponse(BaseModel):
  
 #Query Schemas
 
+MetadataKey = Annotated[str, Field(pattern=f"^{METADATA_KEY_PATTERN.pattern}$")]
+MetadataValue = str|int|float|bool
+
+class QueryFilter(BaseModel):
+
+    sources:list[str]|None=Field(default=None, min_length=1,
+    description="Only search the chunks of these sources (uploaded file names)")
+
+    uploaded_after:datetime|None=Field(default=None,
+    description="Only search chunks uploaded at or after this time")
+
+    uploaded_before:datetime|None=Field(default=None,
+    description="Only search chunks uploaded at or before this time")
+
+    metadata:dict[MetadataKey,MetadataValue|list[MetadataValue]]|None=Field(default=None,
+    description="Metadata key to the value it must have, or to a list of accepted values")
+
 class QueryRequest(BaseModel):
     question:str=Field(...,
                        description="Question to search ",
@@ -46,6 +107,18 @@ class QueryRequest(BaseModel):
     enable_evaluation:bool=Field(default=False,
     description="Enable evaluation for the answer")
 
+    filter:QueryFilter|None=Field(default=None,
+    description="Scope the search to a source, an upload time range or metadata values")
+
+    mode:Literal['dense','sparse','hybrid']|None=Field(default=None,
+    description="Retrieval mode: dense vectors, sparse BM25 terms, or both fused by rank. Defaults to RETRIEVAL_MODE")
+
+    hnsw_ef:int|None=Field(default=None, ge=1, le=4096,
+    description="HNSW search width, defaults to the collection profile")
+
+    oversampling:float|None=Field(default=None, ge=1.0, le=16.0,
+    description="Candidates fetched per result with quantized vectors before rescoring")
+
     model_config = {
         'json_schema_extra':{
             'examples':[
@@ -53,6 +126,14 @@ class QueryRequest(BaseModel):
                     "question":"What is RAG",
                     "include_source":True,
                     "enable_evaluation":False
+                },
+                {
+                    "question":"What is RAG",
+                    "filter":{"sources":["rag_paper.pdf"], "metadata":{"page":[0, 1]}}
+                },
+                {
+                    "question":"What does error ERR-4021 mean",
+                    "mode":"hybrid"
                 }
             ]
         }
@@ -88,6 +169,36 @@ class QueryResponse(BaseModel):
     sources:list[SourceDocument]|None=Field(None,description="List of source documents")
     processing_time:float=Field(...,description="Time taken by the process to answer the question")
     evaluation:EvaluationScores|None=Field(None, description="Evaluation metrics such as Faithfulness and answer_relevancy")
+    cached:bool=Field(False, description="Answer was served from the semantic answer cache")
+
+class BatchQueryRequest(BaseModel):
+    questions:list[QueryRequest]=Field(..., min_length=1,
+    description="Questions to answer, each with its own options. Evaluation is not available in a batch")
+
+    model_config = {
+        'json_schema_extra':{
+            'examples':[
+                {
+                    "questions":[
+                        {"question":"What is RAG", "include_source":False},
+                        {"question":"What does error ERR-4021 mean", "mode":"hybrid"}
+                    ]
+                }
+            ]
+        }
+    }
+
+class BatchQueryResult(BaseModel):
+    question:str=Field(...,description="Question asked")
+    answer:str|None=Field(None,description="Answer for the question, None if it failed")
+    sources:list[SourceDocument]|None=Field(None,description="List of source documents")
+    error:str|None=Field(None,description="Why the question failed, the other questions are not affected")
+
+class BatchQueryResponse(BaseModel):
+    results:list[BatchQueryResult]=Field(...,description="One result per question, in the order of the request")
+    succeeded:int=Field(...,description="Questions answered")
+    failed:int=Field(...,description="Questions that failed")
+    processing_time:float=Field(...,description="Time taken by the process to answer all the questions")
 
 #Error Response Schemas
 
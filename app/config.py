@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -13,16 +14,77 @@ class Settings(BaseSettings):
     #Document Processing Setting
     chunk_size:int=1500
     chunk_overlap:int=300
+    text_splitter:Literal['recursive','offset']="offset"
+
+    #Token Chunking (chunk budgets in tokens of the embedding model instead of characters)
+    chunking_unit:Literal['characters','tokens']="characters"
+    chunk_size_tokens:int=400
+    chunk_overlap_tokens:int=40
+
+    #Ingestion (batched embedding and upserts)
+    ingestion_batch_size:int=64
+    ingestion_embedding_concurrency:int=4
+    ingestion_upsert_concurrency:int=2
+    ingestion_skip_existing:bool=True
+
+    #Parsing (process pool, 0 workers uses every core)
+    parser_workers:int=0
+    pdf_pages_per_task:int=16
+
+    #Uploads
+    max_upload_mb:int=200
+
+    #Ingestion Jobs (background uploads)
+    ingestion_workers:int=2
+    job_store_path:str=".cache/jobs.sqlite3"
+    job_spool_dir:str=".cache/uploads"
+    #Running jobs without a heartbeat for job_stale_seconds are taken as interrupted and queued again
+    job_heartbeat_seconds:float=10.0
+    job_stale_seconds:float=60.0
 
     #Collection Name
     collection_name:str="rag_documents"
 
     #Embedding Setting:
     embedding_model:str="text-embedding-3-small"
+    #Shorter vectors of a text-embedding-3 model (e.g. 256 or 512), empty keeps the full size
+    embedding_dimensions:int|None=None
+
+    #Embedding Cache (persistent, for document chunks)
+    embedding_cache_enabled:bool=True
+    embedding_cache_path:str=".cache/embeddings.sqlite3"
+    embedding_cache_max_mb:int=2048
+
+    #Query Embedding Cache (in memory)
+    query_cache_enabled:bool=True
+    query_cache_max_entries:int=10000
+    query_cache_ttl_seconds:float=3600.0
+
+    #Semantic Answer Cache (near duplicate questions skip the LLM)
+    answer_cache_enabled:bool=False
+    answer_cache_similarity_threshold:float=0.95
+    answer_cache_max_entries:int=1000
+    answer_cache_ttl_seconds:float=86400.0
 
     #Vector Store Setting
-    qdrant_api_key:str
-    qdrant_url:str
+    vector_backend:Literal['qdrant','local']="qdrant"
+    qdrant_api_key:str|None=None
+    qdrant_url:str|None=None
+
+    #Collection Profile (storage of new Qdrant collections: default, scalar, binary, on_disk or high_recall)
+    collection_profile:Literal['default','scalar','binary','on_disk','high_recall']="default"
+    hnsw_m:int|None=None
+    hnsw_ef_construct:int|None=None
+    #Metadata keys that get a keyword payload index when the collection is set up, filters on other keys scan the points
+    payload_index_fields:list[str]=[]
+    #Search defaults on top of the profile, a query can override them
+    search_hnsw_ef:int|None=None
+    search_oversampling:float|None=None
+
+    #Local Vector Store (in process, memory mapped, HNSW from this many points when hnswlib is installed, 0 disables)
+    local_vector_store_path:str=".cache/vectors"
+    local_ann_threshold:int=50000
+    local_ann_ef:int=64
 
     #Query and Retrieval
     openai_api_key:str
@@ -30,6 +92,36 @@ class Settings(BaseSettings):
     llm_temp:float =0.0
     retieval_k:int=4
 
+    #Hybrid Retrieval (BM25 sparse vectors next to the dense ones, fused by reciprocal rank)
+    retrieval_mode:Literal['dense','sparse','hybrid']="hybrid"
+    #New collections store sparse vectors, existing ones without them are searched dense only
+    sparse_vectors_enabled:bool=True
+    hybrid_candidates:int=50
+    rrf_k:int=60
+    bm25_k1:float=1.2
+    bm25_b:float=0.75
+    bm25_avg_doc_length:float=256.0
+
+    #Context Selection (candidates -> MMR -> merged adjacent chunks -> token budget, between retrieval and the prompt)
+    context_selection_enabled:bool=True
+    context_candidates:int=20
+    #1 ranks by relevance only, lower values favour chunks that differ from the ones already picked
+    context_mmr_lambda:float=0.7
+    context_merge_adjacent:bool=True
+    #Tokens of the LLM model for the whole context, 0 disables the budget
+    context_max_tokens:int=2000
+
+    #Batch Queries (POST /query/batch)
+    batch_max_questions:int=500
+    #Answers generated at the same time, bounded by the LLM rate limits
+    batch_max_concurrency:int=8
+
+    #Micro-batching (queries of concurrent requests embedded and searched together, opt in)
+    micro_batch_enabled:bool=False
+    micro_batch_max_size:int=32
+    #How long the first query of a batch waits for others, added to its latency at low traffic
+    micro_batch_max_wait_ms:float=5.0
+
 
     #log setting
     log_level:str = "INFO"
@@ -0,0 +1,172 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import numpy as np
+
+from app.config import get_settings
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    answer:str
+    sources:list[dict]
+    created_at:float=field(default_factory=time.monotonic)
+
+
+class _CollectionEntries:
+
+    def __init__(self):
+        self.vectors:np.ndarray|None = None
+        self.answers:list[CachedAnswer] = []
+        #Filter key of every answer, an answer is only served to searches with the same filter
+        self.scopes:list[str] = []
+        self.generation = 0
+        #Content version of the collection the answers were computed on
+        self.version:str|None = None
+
+
+class SemanticAnswerCache:
+
+    """Answers of earlier questions looked up by cosine similarity of the query embedding.
+
+    Entries are scoped per collection and search settings and dropped by invalidate() whenever
+    the collection changes, so an answer is never served from stale or out of scope documents.
+    Changes made by other processes are seen through the content version of the collection,
+    check_version() drops the answers once it differs from the one they were computed on."""
+
+    def __init__(self, similarity_threshold:float, max_entries:int, ttl_seconds:float):
+
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._collections:dict[str,_CollectionEntries] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector:list[float])->np.ndarray:
+
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+
+        return vector / norm if norm else vector
+
+    def generation(self, collection_name:str)->int:
+
+        """Changes every time the collection is invalidated, store() uses it to drop answers computed before a change"""
+
+        with self._lock:
+            entries = self._collections.get(collection_name)
+            return entries.generation if entries else 0
+
+    def check_version(self, collection_name:str, version:str|None)->None:
+
+        with self._lock:
+            entries = self._collections.setdefault(collection_name, _CollectionEntries())
+            if entries.version == version:
+                return
+            stale = bool(entries.answers)
+            entries.vectors = None
+            entries.answers = []
+            entries.scopes = []
+            entries.generation += 1
+            entries.version = version
+
+        if stale:
+            logger.info(f"Answer cache is invalidated for the collection {collection_name}, its content version changed")
+
+    def lookup(self, collection_name:str, query_vector:list[float], scope:str="")->CachedAnswer|None:
+
+        query = self._normalize(query_vector)
+
+        with self._lock:
+            entries = self._collections.get(collection_name)
+
+            if entries is None or entries.vectors is None:
+                self.misses += 1
+                return None
+
+            similarities = entries.vectors @ query
+            similarities[np.asarray(entries.scopes) != scope] = -np.inf
+            best = int(np.argmax(similarities))
+            cached = entries.answers[best]
+
+            if (similarities[best] < self.similarity_threshold
+                    or time.monotonic() - cached.created_at > self.ttl_seconds):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        logger.info(f"Answer cache hit in {collection_name} with similarity {similarities[best]:.4f}")
+
+        return cached
+
+    def store(self, collection_name:str, query_vector:list[float], answer:str, sources:list[dict],
+              generation:int|None=None, scope:str="")->None:
+
+        query = self._normalize(query_vector)
+
+        with self._lock:
+            entries = self._collections.setdefault(collection_name, _CollectionEntries())
+
+            if generation is not None and generation != entries.generation:
+                #The collection changed while the answer was generated
+                return
+
+            #Drop expired answers and the oldest ones beyond max_entries
+            now = time.monotonic()
+            keep = [i for i, cached in enumerate(entries.answers)
+                    if now - cached.created_at <= self.ttl_seconds]
+            keep = keep[max(0, len(keep) - self.max_entries + 1):]
+
+            if keep:
+                entries.vectors = np.vstack([entries.vectors[keep], query[None, :]])
+            else:
+                entries.vectors = query[None, :]
+            entries.answers = [entries.answers[i] for i in keep] + [CachedAnswer(answer=answer, sources=sources)]
+            entries.scopes = [entries.scopes[i] for i in keep] + [scope]
+
+    def invalidate(self, collection_name:str)->None:
+
+        with self._lock:
+            entries = self._collections.setdefault(collection_name, _CollectionEntries())
+            entries.vectors = None
+            entries.answers = []
+            entries.scopes = []
+            entries.generation += 1
+            self.invalidations += 1
+
+        logger.info(f"Answer cache is invalidated for the collection {collection_name}")
+
+    def stats(self)->dict:
+
+        lookups = self.hits + self.misses
+
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'hit_rate':round(self.hits/lookups, 4) if lookups else None,
+            'invalidations':self.invalidations,
+            'entries':sum(len(entries.answers) for entries in self._collections.values()),
+            'similarity_threshold':self.similarity_threshold,
+        }
+
+
+@lru_cache
+def get_answer_cache()->SemanticAnswerCache:
+
+    settings = get_settings()
+
+    return SemanticAnswerCache(similarity_threshold=settings.answer_cache_similarity_threshold,
+                               max_entries=settings.answer_cache_max_entries,
+                               ttl_seconds=settings.answer_cache_ttl_seconds)
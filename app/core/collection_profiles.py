@@ -0,0 +1,130 @@
+from dataclasses import dataclass, replace
+from typing import Literal
+
+from qdrant_client.http.models import (BinaryQuantization, BinaryQuantizationConfig, Distance, HnswConfigDiff,
+                                       QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig,
+                                       ScalarType, SearchParams, VectorParams)
+
+from app.config import get_settings
+
+
+@dataclass(frozen=True)
+class CollectionProfile:
+
+    """How a Qdrant collection stores its vectors and how it is searched by default.
+
+    Quantized profiles keep the compressed vectors in RAM and the original ones on disk,
+    searches fetch limit*oversampling candidates with the compressed vectors and rescore
+    them with the original ones"""
+
+    name:str
+    quantization:Literal['scalar','binary']|None=None
+    on_disk_vectors:bool=False
+    on_disk_payload:bool=False
+    hnsw_on_disk:bool=False
+    hnsw_m:int|None=None
+    hnsw_ef_construct:int|None=None
+    #Search defaults, a query can override them
+    hnsw_ef:int|None=None
+    oversampling:float|None=None
+    rescore:bool=True
+
+    def vectors_config(self, size:int)->VectorParams:
+
+        return VectorParams(size=size,
+                            distance=Distance.COSINE,
+                            on_disk=self.on_disk_vectors or None)
+
+    def hnsw_config(self)->HnswConfigDiff|None:
+
+        if self.hnsw_m is None and self.hnsw_ef_construct is None and not self.hnsw_on_disk:
+            return None
+
+        return HnswConfigDiff(m=self.hnsw_m,
+                              ef_construct=self.hnsw_ef_construct,
+                              on_disk=self.hnsw_on_disk or None)
+
+    def quantization_config(self)->ScalarQuantization|BinaryQuantization|None:
+
+        if self.quantization == 'scalar':
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+        if self.quantization == 'binary':
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+
+        return None
+
+    def create_options(self, size:int)->dict:
+
+        """Keyword arguments of create_collection"""
+
+        return {
+            'vectors_config':self.vectors_config(size),
+            'hnsw_config':self.hnsw_config(),
+            'quantization_config':self.quantization_config(),
+            'on_disk_payload':self.on_disk_payload or None,
+        }
+
+    def search_params(self, hnsw_ef:int|None=None, oversampling:float|None=None)->SearchParams|None:
+
+        hnsw_ef = hnsw_ef or self.hnsw_ef
+        oversampling = oversampling or self.oversampling
+
+        quantization = None
+        if self.quantization is not None:
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=oversampling)
+
+        if hnsw_ef is None and quantization is None:
+            return None
+
+        return SearchParams(hnsw_ef=hnsw_ef, quantization=quantization)
+
+    def ram_bytes(self, points:int, dimension:int)->int:
+
+        """Rough RAM needed by the vectors and the HNSW graph, payloads excluded"""
+
+        total = 0 if self.on_disk_vectors else points * dimension * 4
+
+        if self.quantization == 'scalar':
+            total += points * dimension
+        elif self.quantization == 'binary':
+            total += points * dimension // 8
+
+        if not self.hnsw_on_disk:
+            #Level 0 keeps 2*m links of 4 bytes per point
+            total += points * 2 * (self.hnsw_m or 16) * 4
+
+        return total
+
+
+COLLECTION_PROFILES:dict[str,CollectionProfile] = {profile.name:profile for profile in [
+    #Full float32 vectors in RAM with the Qdrant defaults, what collections were created with so far
+    CollectionProfile(name='default'),
+    #4x smaller vectors in RAM, near lossless after rescoring
+    CollectionProfile(name='scalar', quantization='scalar', on_disk_vectors=True, oversampling=2.0),
+    #32x smaller vectors in RAM, needs more oversampling, works best with 1024+ dimensional embeddings
+    CollectionProfile(name='binary', quantization='binary', on_disk_vectors=True, oversampling=3.0),
+    #Everything served from disk through the page cache, for collections larger than RAM
+    CollectionProfile(name='on_disk', on_disk_vectors=True, on_disk_payload=True, hnsw_on_disk=True),
+    #Denser graph and wider search for better recall at some latency
+    CollectionProfile(name='high_recall', hnsw_m=32, hnsw_ef_construct=256, hnsw_ef=128),
+]}
+
+
+def get_collection_profile(name:str|None=None)->CollectionProfile:
+
+    """The named profile (COLLECTION_PROFILE by default) with the HNSW_* and SEARCH_* settings applied on top"""
+
+    settings = get_settings()
+    name = name or settings.collection_profile
+
+    if name not in COLLECTION_PROFILES:
+        raise ValueError(f"Unknown collection profile {name}, expected one of {', '.join(COLLECTION_PROFILES)}")
+
+    overrides = {
+        'hnsw_m':settings.hnsw_m,
+        'hnsw_ef_construct':settings.hnsw_ef_construct,
+        'hnsw_ef':settings.search_hnsw_ef,
+        'oversampling':settings.search_oversampling,
+    }
+
+    return replace(COLLECTION_PROFILES[name], **{key:value for key, value in overrides.items() if value is not None})
@@ -0,0 +1,192 @@
+from dataclasses import replace
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config import get_settings
+from app.core.tokenizer import token_length
+from app.core.vector_store import SearchOptions
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+#Separator format_documents puts between two documents of the context
+DOCUMENT_SEPARATOR = "\n\n---\n\n"
+#Shorter common text of two adjacent chunks is taken as a coincidence, not the splitter overlap
+MIN_OVERLAP = 20
+
+
+def mmr(relevance:np.ndarray, vectors:np.ndarray, k:int, lambda_mult:float=0.7)->list[int]:
+
+    """Maximal marginal relevance: indices of k candidates, each picked for
+    lambda*relevance - (1-lambda)*(highest similarity to the ones picked before)"""
+
+    k = min(k, len(relevance))
+    if k == 0:
+        return []
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    unit = vectors / norms
+    similarity = unit @ unit.T
+
+    #Every step updates the redundancy of all candidates with one row of the similarity matrix
+    redundancy = np.zeros(len(relevance))
+    available = np.ones(len(relevance), dtype=bool)
+    selected = []
+
+    for _ in range(k):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+
+    return selected
+
+def overlap_length(previous:str, following:str)->int:
+
+    """Length of the longest end of previous that following starts with, 0 below MIN_OVERLAP"""
+
+    if len(following) < MIN_OVERLAP:
+        return 0
+
+    #The earliest place previous contains the start of following gives the longest overlap
+    probe = following[:MIN_OVERLAP]
+    position = previous.find(probe, max(0, len(previous) - len(following)))
+
+    while position != -1:
+        if following.startswith(previous[position:]):
+            return len(previous) - position
+        position = previous.find(probe, position + 1)
+
+    return 0
+
+def merge_adjacent(documents:list[Document])->list[Document]:
+
+    """Joins chunks of one source with consecutive chunk_index into one document, the
+    overlap the splitter repeats at the start of a chunk is kept once. A merged document
+    takes the place of its best ranked chunk and the metadata of its first one, with the
+    merged positions in merged_chunks"""
+
+    keys = [(str(doc.metadata.get('source', '')), doc.metadata['chunk_index'])
+            if isinstance(doc.metadata.get('chunk_index'), int) else None
+            for doc in documents]
+    positions = {key:position for position, key in enumerate(keys) if key is not None}
+
+    merged = []
+    used:set[int] = set()
+
+    for position, (doc, key) in enumerate(zip(documents, keys)):
+        if position in used:
+            continue
+
+        if key is None:
+            merged.append(doc)
+            continue
+
+        source, index = key
+        first = index
+        while (source, first - 1) in positions:
+            first -= 1
+        last = index
+        while (source, last + 1) in positions:
+            last += 1
+
+        run = [positions[(source, chunk)] for chunk in range(first, last + 1)]
+        used.update(run)
+
+        if len(run) == 1:
+            merged.append(doc)
+            continue
+
+        content = documents[run[0]].page_content
+        for chunk in run[1:]:
+            following = documents[chunk].page_content
+            overlap = overlap_length(content, following)
+            content += following[overlap:] if overlap else "\n" + following
+
+        metadata = {**documents[run[0]].metadata, 'merged_chunks':list(range(first, last + 1))}
+        merged.append(Document(page_content=content, metadata=metadata))
+
+    return merged
+
+
+class ContextSelector:
+
+    """Picks the context of a question out of a larger candidate set.
+
+    The candidates come with their vectors, MMR keeps k of them that are relevant and
+    different from each other, chunks adjacent in their source are merged so their overlap
+    is sent once, and documents are kept in rank order while they fit the token budget.
+    The best document is always kept, even when it alone is over the budget"""
+
+    def __init__(self, candidates:int=20, lambda_mult:float=0.7, merge:bool=True,
+                 max_tokens:int=2000, model_name:str="gpt-4o-mini"):
+
+        self.candidates = candidates
+        self.lambda_mult = lambda_mult
+        self.merge = merge
+        self.max_tokens = max_tokens
+        self._length = token_length(model_name)
+        self._separator_tokens = self._length(DOCUMENT_SEPARATOR)
+
+    def search_options(self, options:SearchOptions|None)->SearchOptions:
+        return replace(options or SearchOptions(), with_vectors=True)
+
+    def select(self, results:list[tuple[Document,float]], k:int)->list[Document]:
+
+        if not results:
+            return []
+
+        documents = [doc for doc, _ in results]
+        vectors = [doc.metadata.pop('_vector', None) for doc in documents]
+
+        #Scores of dense, sparse and hybrid searches have different ranges, relevance is rescaled to [0, 1]
+        scores = np.array([score for _, score in results], dtype=np.float64)
+        spread = np.ptp(scores)
+        relevance = (scores - scores.min()) / spread if spread > 0 else np.ones(len(scores))
+
+        if any(vector is None for vector in vectors):
+            order = list(np.argsort(-relevance, kind="stable")[:k])
+        else:
+            order = mmr(relevance, np.asarray(vectors, dtype=np.float32), k, self.lambda_mult)
+
+        selected = [documents[i] for i in order]
+        if self.merge:
+            selected = merge_adjacent(selected)
+        if self.max_tokens:
+            selected = self.pack(selected)
+
+        logger.info(f"Selected {len(selected)} context documents out of {len(results)} candidates")
+
+        return selected
+
+    def pack(self, documents:list[Document])->list[Document]:
+
+        """Documents in order that fit max_tokens together, separators included"""
+
+        packed = []
+        used = 0
+
+        for doc in documents:
+            tokens = self._length(doc.page_content) + (self._separator_tokens if packed else 0)
+            if packed and used + tokens > self.max_tokens:
+                continue
+            packed.append(doc)
+            used += tokens
+
+        return packed
+
+
+@lru_cache
+def get_context_selector()->ContextSelector:
+
+    settings = get_settings()
+
+    return ContextSelector(candidates=settings.context_candidates,
+                           lambda_mult=settings.context_mmr_lambda,
+                           merge=settings.context_merge_adjacent,
+                           max_tokens=settings.context_max_tokens,
+                           model_name=settings.llm_model)
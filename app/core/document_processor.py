@@ -1,9 +1,10 @@
+import asyncio
 import tempfile
+from collections.abc import Iterable, Iterator
 from pathlib import Path
-from typing import BinaryIO
+from typing import Any, BinaryIO
 
 from langchain_community.document_loaders import (
-    PyPDFLoader,
     TextLoader,
     CSVLoader
 )
@@ -11,10 +12,21 @@ from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from app.config import get_settings
+from app.core.parsing import iter_pdf_pages, parse_pdf, run_in_order
+from app.core.text_splitter import DEFAULT_SEPARATORS, OffsetTextSplitter
+from app.core.tokenizer import token_length
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+#Uploads are copied to disk in pieces of this size, never as a whole
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    pass
+
+
 class DocumentProcessor:
 
     SUPPORTED_EXTENSIONS= {'.pdf','.txt','.csv'}
@@ -24,23 +36,43 @@ class DocumentProcessor:
         
         settings= get_settings()
 
-        self.chunk_size = chunk_size or settings.chunk_size
-        self.chunk_overlap = chunk_overlap or settings.chunk_overlap
-
-        self.text_splitter = RecursiveCharacterTextSplitter(separators=['\n\n','\n','.',' ',''],
-                                                            chunk_size= self.chunk_size,
-                                                            chunk_overlap=self.chunk_overlap,
-                                                            length_function=len,)
+        self.max_upload_bytes = settings.max_upload_mb * 1_000_000
+
+        self.chunking_unit = settings.chunking_unit
+
+        if self.chunking_unit == 'tokens':
+            #Budgets in tokens of the embedding model, pieces are measured with its local tokenizer
+            self.chunk_size = chunk_size or settings.chunk_size_tokens
+            self.chunk_overlap = chunk_overlap or settings.chunk_overlap_tokens
+
+            self.text_splitter = RecursiveCharacterTextSplitter(separators=DEFAULT_SEPARATORS,
+                                                                chunk_size=self.chunk_size,
+                                                                chunk_overlap=self.chunk_overlap,
+                                                                length_function=token_length(settings.embedding_model),)
+        else:
+            self.chunk_size = chunk_size or settings.chunk_size
+            self.chunk_overlap = chunk_overlap or settings.chunk_overlap
+
+            #Both splitters yield the same chunks, offset avoids the intermediate string copies
+            splitters = {
+                'recursive':RecursiveCharacterTextSplitter,
+                'offset':OffsetTextSplitter,
+            }
+
+            self.text_splitter = splitters[settings.text_splitter](separators=DEFAULT_SEPARATORS,
+                                                                   chunk_size= self.chunk_size,
+                                                                   chunk_overlap=self.chunk_overlap,
+                                                                   length_function=len,)
         logger.info(f"Document Processor is initiated with chunk size = {self.chunk_size}"
-                    f"chunk overlap {self.chunk_overlap}")
+                    f"chunk overlap {self.chunk_overlap} {self.chunking_unit}")
         
     def load_pdf(self, file_path:str|Path)->list[Document]:
 
         file_path = Path(file_path)
         logger.info(f"Loading the pdf {file_path}")
 
-        loader = PyPDFLoader(file_path=file_path)
-        documents = loader.load()
+        #Page ranges of large files are parsed in parallel in the parser process pool
+        documents = parse_pdf(file_path)
 
         logger.info(f"The file {file_path} is processed with {len(documents)}")
 
@@ -74,12 +106,66 @@ class DocumentProcessor:
 
         return documents
     
-    def load_file(self,file_path:str|Path)->list[Document]:
+    def load_file(self,file_path:str|Path, source:str|None=None)->list[Document]:
+
+        """Loads a file, source overrides the 'source' metadata (e.g. the original upload filename)"""
 
         file_path=Path(file_path)
 
         logger.info(f"Loading the file {file_path}")
 
+        file_extension = self._check_extension(file_path)
+
+        loader = {
+            '.pdf':self.load_pdf,
+            '.txt':self.load_text,
+            '.csv':self.load_csv
+        }
+
+        documents = loader[file_extension](file_path=file_path)
+
+        if source is not None:
+            for doc in documents:
+                doc.metadata['source'] = source
+
+        return documents
+
+    def lazy_load_file(self,file_path:str|Path, source:str|None=None)->Iterator[Document]:
+
+        """Like load_file but yields one page (or csv row) at a time from the loader's lazy_load"""
+
+        file_path=Path(file_path)
+
+        logger.info(f"Lazily loading the file {file_path}")
+
+        file_extension = self._check_extension(file_path)
+
+        loader = {
+            '.pdf':lambda: iter_pdf_pages(file_path),
+            '.txt':lambda: TextLoader(file_path=file_path, encoding='utf-8').lazy_load(),
+            '.csv':lambda: CSVLoader(file_path=file_path).lazy_load()
+        }
+
+        for doc in loader[file_extension]():
+            if source is not None:
+                doc.metadata['source'] = source
+            yield doc
+
+    def iter_load_files(self,file_paths:Iterable[str|Path])->Iterator[tuple[Path,list[Document]]]:
+
+        """Loads many files in parallel in the parser process pool, yields (path, documents) in input order"""
+
+        file_paths = [Path(file_path) for file_path in file_paths]
+
+        for file_path in file_paths:
+            self._check_extension(file_path)
+
+        results = run_in_order(_load_file, [(str(file_path),) for file_path in file_paths])
+
+        yield from zip(file_paths, results)
+
+    def _check_extension(self, file_path:Path)->str:
+
         file_extension = file_path.suffix.lower()
 
         if file_extension not in self.SUPPORTED_EXTENSIONS:
@@ -87,14 +173,8 @@ class DocumentProcessor:
                 f"Unsupported file extensions {file_extension}"
                 f"Supported file extensions are {self.SUPPORTED_EXTENSIONS}"
             )
-        
-        loader = {
-            '.pdf':self.load_pdf,
-            '.txt':self.load_text,
-            '.csv':self.load_csv
-        }
 
-        return loader[file_extension](file_path=file_path)
+        return file_extension
     
     def load_upload(self,
                     file:BinaryIO,
@@ -110,45 +190,104 @@ class DocumentProcessor:
         
         with tempfile.NamedTemporaryFile(delete=False,
                                          suffix=file_extension) as tmp_file:
-            tmp_file.write(file.read())
             tmp_path = tmp_file.name
-            tmp_file.close()
 
-            try:
-                documents = self.load_file(file_path=tmp_path)
+        try:
+            self.spool_upload(file=file, destination=tmp_path)
+
+            return self.load_file(file_path=tmp_path, source=str(filename))
+
+        finally:
+            Path(tmp_path).unlink(missing_ok=True)
+
+    def spool_upload(self, file:BinaryIO, destination:str|Path)->int:
+
+        """Copies an upload to disk in UPLOAD_CHUNK_SIZE pieces, enforcing max_upload_mb.
+        Returns the number of bytes written"""
+
+        written = 0
+
+        try:
+            with open(destination, "wb") as out:
+                while chunk := file.read(UPLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    self._check_upload_size(written)
+                    out.write(chunk)
+        except UploadTooLargeError:
+            Path(destination).unlink(missing_ok=True)
+            raise
+
+        return written
+
+    async def aspool_upload(self, file:Any, destination:str|Path)->int:
+
+        """spool_upload for an object with an awaitable read(size), like fastapi's UploadFile.
+        Disk writes run in a thread so the event loop is not blocked"""
 
-                for doc in documents:
-                    doc.metadata['source'] = filename
+        written = 0
 
-                return documents
-            
-            finally:
-                Path(tmp_path).unlink(missing_ok=True)
+        try:
+            with open(destination, "wb") as out:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    self._check_upload_size(written)
+                    await asyncio.to_thread(out.write, chunk)
+        except UploadTooLargeError:
+            Path(destination).unlink(missing_ok=True)
+            raise
+
+        logger.info(f"Spooled {written} bytes to {destination}")
+
+        return written
+
+    def _check_upload_size(self, size:int)->None:
+
+        if size > self.max_upload_bytes:
+            raise UploadTooLargeError(
+                f"Upload is larger than the maximum of {self.max_upload_bytes // 1_000_000} MB"
+            )
 
     def split_documents(self,documents:list[Document])->list[Document]:
         logger.info(f"Starting the document split with chunk size{self.chunk_size}"
                     f"chunking overlap {self.chunk_overlap}")
         
-        chunks=self.text_splitter.split_documents(documents=documents)
+        chunks=list(self.iter_chunks(documents))
 
         logger.info(f"chunking is completed with {len(chunks)}")
 
         return chunks
 
+    def iter_chunks(self,documents:Iterable[Document])->Iterator[Document]:
+
+        """Splits the documents one at a time as they are pulled, so a lazily loaded file
+        is never held in memory as a whole. Yields the same chunks as split_documents"""
+
+        #Position of the chunk within its source, part of the deterministic point id
+        positions:dict[str,int] = {}
+
+        for document in documents:
+            for chunk in self.text_splitter.split_documents([document]):
+                source = str(chunk.metadata.get('source', ''))
+                chunk.metadata['chunk_index'] = positions.get(source, 0)
+                positions[source] = chunk.metadata['chunk_index'] + 1
+                yield chunk
+
     def process_file(self,file_path:str|Path)->list[Document]:
 
         documents = self.load_file(file_path=file_path)
         return self.split_documents(documents=documents)
+
+    def iter_file_chunks(self,file_path:str|Path, source:str|None=None)->Iterator[Document]:
+
+        return self.iter_chunks(self.lazy_load_file(file_path=file_path, source=source))
     
     def procee_upload_file(self,file:BinaryIO,filename:str|Path)->list[Document]:
 
         documents = self.load_upload(file=file,filename=filename)
         return self.split_documents(documents=documents)
-    
-    
-
 
 
+def _load_file(file_path:str)->list[Document]:
 
-    
-
+    #Runs in a parser pool process
+    return DocumentProcessor().load_file(file_path)
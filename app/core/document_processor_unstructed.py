@@ -1,5 +1,6 @@
 from pathlib import Path
 from typing import BinaryIO
+import shutil
 import tempfile
 
 
@@ -13,14 +14,41 @@ from unstructured.partition.text import partition_text
 
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader, PdfWriter
 
 
 from app.utils.logger import get_logger
 from app.config import get_settings
+from app.core.parsing import pdf_page_ranges, run_in_order
 
 #Initialize the logging
 logger = get_logger(__name__)
 
+PDF_PARTITION_OPTIONS = dict(infer_table_structure=True,
+                             strategy="hi_res",
+                             extract_images_in_pdf=True,
+                             ocr_languages=['eng'],
+                             )
+
+
+def partition_pdf_pages(file_path:str, start:int, stop:int):
+
+       #Runs in a parser pool process, the pages [start, stop) are written to their own file
+       #and starting_page_number keeps the page numbers of the elements those of the original file
+       reader = PdfReader(file_path)
+       writer = PdfWriter()
+       for page in range(start, stop):
+              writer.add_page(reader.pages[page])
+
+       with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+              writer.write(tmp_file)
+              tmp_path = tmp_file.name
+
+       try:
+              return partition_pdf(tmp_path, starting_page_number=start + 1, **PDF_PARTITION_OPTIONS)
+       finally:
+              Path(tmp_path).unlink(missing_ok=True)
+
 
 class DocumentProcessor:
     
@@ -59,12 +87,16 @@ class DocumentProcessor:
 
             file_path = Path(file_path)
 
-            elements = partition_pdf(file_path,
-                                     infer_table_structure=True,
-                                     strategy="hi_res",
-                                     extract_images_in_pdf=True,
-                                     ocr_languages=['eng'],
-                                     )
+            ranges = pdf_page_ranges(file_path)
+
+            if len(ranges) <= 1:
+                   elements = partition_pdf(file_path, **PDF_PARTITION_OPTIONS)
+            else:
+                   #Page ranges are partitioned in parallel in the parser process pool, in page order
+                   elements = []
+                   for range_elements in run_in_order(partition_pdf_pages,
+                                                      [(str(file_path), start, stop) for start, stop in ranges]):
+                          elements.extend(range_elements)
             
             logger.info(f" Loaded the text content from the file {file_path}")
 
@@ -166,7 +198,7 @@ class DocumentProcessor:
                     )
            
            with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp_file:
-                  tmp_file.write(file.read())
+                  shutil.copyfileobj(file, tmp_file, 1024 * 1024)
                   tmp_path=tmp_file.name
 
            try:
@@ -0,0 +1,234 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from app.config import get_settings
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+#SQLite limits the number of bound variables per statement
+SQLITE_BATCH_SIZE = 500
+
+
+def hash_text(text:str)->str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def normalize_query(text:str)->str:
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+
+    """Persistent, content addressed store of document embeddings.
+
+    Vectors are kept as float32 blobs in SQLite keyed by (model, sha256 of the text).
+    When the stored vectors grow past max_bytes the least recently used ones are evicted."""
+
+    def __init__(self, path:str|Path, max_bytes:int):
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+        self._size_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+        logger.info(f"Embedding cache is opened at {self.path} with {self._size_bytes/1e6:.1f} MB of vectors")
+
+    def get_many(self, model:str, texts:list[str])->list[list[float]|None]:
+
+        """Cached vectors in the order of texts, None for a miss"""
+
+        hashes = [hash_text(text) for text in texts]
+        found:dict[str,list[float]] = {}
+
+        with self._lock:
+            unique_hashes = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique_hashes), SQLITE_BATCH_SIZE):
+                batch = unique_hashes[start:start+SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                       [(now, model, text_hash) for text_hash in found])
+                self._conn.commit()
+
+            vectors = [found.get(text_hash) for text_hash in hashes]
+            hit_count = sum(vector is not None for vector in vectors)
+            self.hits += hit_count
+            self.misses += len(vectors) - hit_count
+
+        return vectors
+
+    def put_many(self, model:str, texts:list[str], vectors:list[list[float]])->None:
+
+        now = time.time()
+        #One row per text, a text repeated in the batch is replaced by its last vector
+        blobs = {hash_text(text):np.asarray(vector, dtype=np.float32).tobytes() for text, vector in zip(texts, vectors)}
+
+        with self._lock:
+            #Rows that INSERT OR REPLACE overwrites are already counted in the size
+            replaced_bytes = 0
+            hashes = list(blobs)
+            for start in range(0, len(hashes), SQLITE_BATCH_SIZE):
+                batch = hashes[start:start+SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                replaced_bytes += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchone()[0]
+
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                                   [(model, text_hash, blob, now) for text_hash, blob in blobs.items()])
+            self._conn.commit()
+            self._size_bytes += sum(len(blob) for blob in blobs.values()) - replaced_bytes
+
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self)->None:
+
+        #Evict down to 90% of the budget so we do not evict on every insert
+        target = int(self.max_bytes * 0.9)
+        row_bytes = self._conn.execute("SELECT COALESCE(AVG(LENGTH(vector)), 0) FROM embeddings").fetchone()[0] or 1
+        evict_count = max(1, int((self._size_bytes - target) / row_bytes))
+
+        self._conn.execute("DELETE FROM embeddings WHERE rowid IN "
+                           "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (evict_count,))
+        self._conn.commit()
+
+        self.evictions += evict_count
+        self._size_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+        logger.info(f"Evicted {evict_count} embeddings from the cache, {self._size_bytes/1e6:.1f} MB left")
+
+    def stats(self)->dict:
+
+        lookups = self.hits + self.misses
+
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'hit_rate':round(self.hits/lookups, 4) if lookups else None,
+            'evictions':self.evictions,
+            'size_mb':round(self._size_bytes/1e6, 2),
+            'max_size_mb':round(self.max_bytes/1e6, 2),
+        }
+
+    def close(self)->None:
+        with self._lock:
+            self._conn.close()
+
+
+class QueryEmbeddingCache:
+
+    """Bounded in-memory LRU cache of query embeddings with a time to live.
+
+    Keys are (model, normalized question), so repeated and retried questions
+    skip the embedding round trip."""
+
+    def __init__(self, max_entries:int, ttl_seconds:float):
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+        self._entries:OrderedDict[tuple[str,str],tuple[float,list[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model:str, text:str)->list[float]|None:
+
+        key = (model, normalize_query(text))
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model:str, text:str, vector:list[float])->None:
+
+        key = (model, normalize_query(text))
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self)->dict:
+
+        lookups = self.hits + self.misses
+
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'hit_rate':round(self.hits/lookups, 4) if lookups else None,
+            'expired':self.expired,
+            'entries':len(self._entries),
+            'max_entries':self.max_entries,
+        }
+
+
+@lru_cache
+def get_embedding_cache()->EmbeddingCache:
+
+    settings = get_settings()
+
+    return EmbeddingCache(path=settings.embedding_cache_path,
+                          max_bytes=settings.embedding_cache_max_mb * 1_000_000)
+
+@lru_cache
+def get_query_embedding_cache()->QueryEmbeddingCache:
+
+    settings = get_settings()
+
+    return QueryEmbeddingCache(max_entries=settings.query_cache_max_entries,
+                               ttl_seconds=settings.query_cache_ttl_seconds)
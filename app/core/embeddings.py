@@ -1,26 +1,205 @@
+import asyncio
 from functools import lru_cache
 
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 
 from app.config import get_settings
+from app.core.embedding_cache import (
+    EmbeddingCache,
+    QueryEmbeddingCache,
+    get_embedding_cache,
+    get_query_embedding_cache,
+    hash_text
+)
 from app.utils.logger import get_logger
 logger=get_logger(__name__)
 
+#Output size of the known models at full dimension, any other model is measured with one query
+MODEL_DIMENSIONS = {
+    'text-embedding-3-small':1536,
+    'text-embedding-3-large':3072,
+    'text-embedding-ada-002':1536,
+}
+
+
+def embedding_cache_key(model_name:str, dimensions:int|None=None)->str:
+
+    """Cache key of a model at a given output size, vectors shortened to other sizes never mix"""
+
+    return f"{model_name}@{dimensions}" if dimensions else model_name
+
+
+class CachedEmbeddings(Embeddings):
+
+    """Embeddings wrapper that serves document vectors from the persistent
+    EmbeddingCache and query vectors from the in-memory QueryEmbeddingCache,
+    only sending the cache misses to the wrapped model. Either cache may be None."""
+
+    def __init__(self, embeddings:Embeddings, model_name:str,
+                 cache:EmbeddingCache|None=None,
+                 query_cache:QueryEmbeddingCache|None=None):
+
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+        self.query_cache = query_cache
+
+    def _missing(self, texts:list[str], cached:list[list[float]|None])->dict[str,str]:
+        #Unique texts to embed, chunks repeated across documents are embedded once
+        return {hash_text(text):text for text, vector in zip(texts, cached) if vector is None}
+
+    def _merge(self, texts:list[str], cached:list[list[float]|None], missing:dict[str,str], vectors:list[list[float]])->list[list[float]]:
+
+        embedded = dict(zip(missing.keys(), vectors))
+
+        return [vector if vector is not None else embedded[hash_text(text)]
+                for text, vector in zip(texts, cached)]
+
+    def embed_documents(self, texts:list[str])->list[list[float]]:
+
+        if self.cache is None:
+            return self.embeddings.embed_documents(texts)
+
+        cached = self.cache.get_many(self.model_name, texts)
+        missing = self._missing(texts, cached)
+
+        vectors = []
+        if missing:
+            logger.info(f"Embedding cache has {len(texts)-len(missing)} hits, embedding {len(missing)} texts")
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put_many(self.model_name, list(missing.values()), vectors)
+
+        return self._merge(texts, cached, missing, vectors)
+
+    async def aembed_documents(self, texts:list[str])->list[list[float]]:
+
+        vectors, _ = await self.aembed_documents_sent(texts)
+
+        return vectors
+
+    async def aembed_documents_sent(self, texts:list[str])->tuple[list[list[float]],list[str]]:
+
+        """aembed_documents and the texts sent to the model, the cache misses once each"""
+
+        if self.cache is None:
+            return await self.embeddings.aembed_documents(texts), texts
+
+        cached = await asyncio.to_thread(self.cache.get_many, self.model_name, texts)
+        missing = self._missing(texts, cached)
+
+        vectors = []
+        if missing:
+            logger.info(f"Embedding cache has {len(texts)-len(missing)} hits, embedding {len(missing)} texts")
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            await asyncio.to_thread(self.cache.put_many, self.model_name, list(missing.values()), vectors)
+
+        return self._merge(texts, cached, missing, vectors), list(missing.values())
+
+    def embed_query(self, text:str)->list[float]:
+
+        if self.query_cache is None:
+            return self.embeddings.embed_query(text)
+
+        vector = self.query_cache.get(self.model_name, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.query_cache.put(self.model_name, text, vector)
+
+        return vector
+
+    async def aembed_query(self, text:str)->list[float]:
+
+        if self.query_cache is None:
+            return await self.embeddings.aembed_query(text)
+
+        vector = self.query_cache.get(self.model_name, text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.query_cache.put(self.model_name, text, vector)
+
+        return vector
+
+    async def aembed_queries(self, texts:list[str])->list[list[float]]:
+
+        """aembed_query of many texts, the query cache misses are embedded in one request"""
+
+        if self.query_cache is None:
+            return await self.embeddings.aembed_documents(texts)
+
+        cached = [self.query_cache.get(self.model_name, text) for text in texts]
+        missing = self._missing(texts, cached)
+
+        vectors = []
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            for text, vector in zip(missing.values(), vectors):
+                self.query_cache.put(self.model_name, text, vector)
+
+        return self._merge(texts, cached, missing, vectors)
+
+
+async def aembed_queries(embeddings:Embeddings, texts:list[str])->list[list[float]]:
+
+    """Query vectors of many questions with one embedding request. OpenAI embeds a query
+    like a document, so a batch of queries is sent as one embed_documents call"""
+
+    if isinstance(embeddings, CachedEmbeddings):
+        return await embeddings.aembed_queries(texts)
+
+    return await embeddings.aembed_documents(texts)
+
+async def aembed_documents_sent(embeddings:Embeddings, texts:list[str])->tuple[list[list[float]],list[str]]:
+
+    """Document vectors and the texts sent to the model for them, texts served by the embedding cache are not sent"""
+
+    if isinstance(embeddings, CachedEmbeddings):
+        return await embeddings.aembed_documents_sent(texts)
+
+    return await embeddings.aembed_documents(texts), texts
+
 @lru_cache
-def get_embeddings()->OpenAIEmbeddings:
+def get_embeddings()->Embeddings:
 
     settings = get_settings()
 
     logger.info(f"Initializing the Embedding process using {settings.embedding_model}")
 
 
+    #text-embedding-3 models are Matryoshka trained, dimensions shortens their vectors server side
     embeddings=OpenAIEmbeddings(model=settings.embedding_model,
+                                dimensions=settings.embedding_dimensions,
                                 openai_api_key=settings.openai_api_key)
+
+    if settings.embedding_cache_enabled or settings.query_cache_enabled:
+        embeddings = CachedEmbeddings(embeddings=embeddings,
+                                      model_name=embedding_cache_key(settings.embedding_model, settings.embedding_dimensions),
+                                      cache=get_embedding_cache() if settings.embedding_cache_enabled else None,
+                                      query_cache=get_query_embedding_cache() if settings.query_cache_enabled else None)
     
     logger.info(f"Initializing the embedding is completed")
 
     return embeddings
 
+@lru_cache
+def get_embedding_dimension()->int:
+
+    """Size of the vectors get_embeddings() returns, collections are created with it"""
+
+    settings = get_settings()
+
+    if settings.embedding_dimensions:
+        return settings.embedding_dimensions
+
+    if settings.embedding_model in MODEL_DIMENSIONS:
+        return MODEL_DIMENSIONS[settings.embedding_model]
+
+    dimension = len(get_embeddings().embed_query("dimension"))
+
+    logger.info(f"Measured the embedding dimension of {settings.embedding_model}: {dimension}")
+
+    return dimension
+
 
 class EmbeddingSerrvice:
 
@@ -42,4 +221,3 @@ class EmbeddingSerrvice:
 
         return self.embeddings.embed_documents(texts) #Here embed_documents() is from openai not the local function
 
-
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import asdict, dataclass, fields
+from itertools import islice
+from typing import TYPE_CHECKING
+from uuid import UUID, uuid5
+
+from langchain_core.documents import Document
+
+from app.config import get_settings
+from app.core.embedding_cache import hash_text
+from app.core.embeddings import aembed_documents_sent
+from app.core.tokenizer import count_tokens
+from app.utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from app.core.vector_store import VectorStoreService
+
+logger = get_logger(__name__)
+
+#Namespace of the deterministic point ids, changing it changes every id
+POINT_ID_NAMESPACE = UUID("6f1c2a7e-3d4b-5e8f-9a0b-1c2d3e4f5a6b")
+#Metadata key of the unix time a chunk was first written, searches can filter on it
+UPLOADED_AT_KEY = "uploaded_at"
+
+
+def point_id(document:Document, position:int)->str:
+
+    """Deterministic id from the source, the chunk position and the content hash,
+    so uploading the same file again overwrites its points instead of duplicating them"""
+
+    source = document.metadata.get('source', '')
+    chunk_index = document.metadata.get('chunk_index', position)
+
+    return str(uuid5(POINT_ID_NAMESPACE, f"{source}:{chunk_index}:{hash_text(document.page_content)}"))
+
+
+@dataclass
+class IngestionStats:
+    created:int=0
+    chunks:int=0
+    embedded:int=0
+    skipped:int=0
+    reused:int=0
+    deleted:int=0
+    tokens:int=0
+    batches:int=0
+    read_seconds:float=0.0
+    embed_seconds:float=0.0
+    upsert_seconds:float=0.0
+    total_seconds:float=0.0
+
+    @property
+    def chunks_per_second(self)->float:
+        return self.chunks / self.total_seconds if self.total_seconds else 0.0
+
+    @property
+    def tokens_per_second(self)->float:
+        return self.tokens / self.total_seconds if self.total_seconds else 0.0
+
+    def merge(self, other:"IngestionStats")->None:
+
+        for field in fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+    def to_dict(self)->dict:
+        return {
+            **asdict(self),
+            'chunks_per_second':round(self.chunks_per_second, 2),
+            'tokens_per_second':round(self.tokens_per_second, 2),
+        }
+
+
+class IngestionPipeline:
+
+    """Embeds chunks in batches with bounded concurrency and upserts every batch
+    as soon as it is embedded, so Qdrant writes overlap with the embedding of later batches.
+
+    Chunks are pulled from any iterable one batch at a time in a worker thread, a lazy
+    generator over the pages of a file is parsed and split while earlier batches are
+    embedded, and the first chunks are searchable before the whole file is read.
+
+    created counts the chunks read from the iterable, chunks the ones upserted.
+    Chunks whose content hash is in known_vectors are upserted with that vector
+    instead of being embedded again (reused).
+    read_seconds, embed_seconds and upsert_seconds add up the time of every batch, with
+    concurrent batches they can exceed total_seconds."""
+
+    def __init__(self, vector_store:"VectorStoreService",
+                 batch_size:int|None=None,
+                 embedding_concurrency:int|None=None,
+                 upsert_concurrency:int|None=None,
+                 skip_existing:bool=False,
+                 known_vectors:dict[str,list[float]]|None=None,
+                 on_progress:Callable[[IngestionStats],Awaitable[None]]|None=None):
+
+        settings = get_settings()
+
+        self.vector_store = vector_store
+        self.model_name = settings.embedding_model
+        self.batch_size = batch_size or settings.ingestion_batch_size
+        self.embedding_concurrency = embedding_concurrency or settings.ingestion_embedding_concurrency
+        self.upsert_concurrency = upsert_concurrency or settings.ingestion_upsert_concurrency
+        self.skip_existing = skip_existing
+        self.known_vectors = known_vectors or {}
+        self.on_progress = on_progress
+
+    async def arun(self, documents:Iterable[Document])->tuple[list[str],IngestionStats]:
+
+        stats = IngestionStats()
+        ids:list[str] = []
+        start_time = time.perf_counter()
+        uploaded_at = time.time()
+        chunks = iter(documents)
+
+        #Bounded queue keeps at most a few batches waiting for a free embedding worker
+        queue:asyncio.Queue = asyncio.Queue(maxsize=self.embedding_concurrency)
+        upsert_limit = asyncio.Semaphore(self.upsert_concurrency)
+
+        async def produce():
+            while True:
+                read_start = time.perf_counter()
+                batch = await asyncio.to_thread(list, islice(chunks, self.batch_size))
+                stats.read_seconds += time.perf_counter() - read_start
+
+                if not batch:
+                    break
+
+                batch_ids = [point_id(doc, len(ids) + position) for position, doc in enumerate(batch)]
+                for doc in batch:
+                    doc.metadata.setdefault(UPLOADED_AT_KEY, uploaded_at)
+                ids.extend(batch_ids)
+                stats.created += len(batch)
+
+                await queue.put((batch, batch_ids))
+
+            for _ in range(self.embedding_concurrency):
+                await queue.put(None)
+
+        async def work():
+            while (item := await queue.get()) is not None:
+                batch, batch_ids = item
+
+                if self.skip_existing:
+                    existing = await self.vector_store.aexisting_ids(batch_ids)
+                    if existing:
+                        stats.skipped += len(existing)
+                        batch = [doc for doc, doc_id in zip(batch, batch_ids) if doc_id not in existing]
+                        batch_ids = [doc_id for doc_id in batch_ids if doc_id not in existing]
+                    if not batch:
+                        if self.on_progress is not None:
+                            await self.on_progress(stats)
+                        continue
+
+                texts = [doc.page_content for doc in batch]
+                vectors:list[list[float]|None] = [None] * len(texts)
+                if self.known_vectors:
+                    vectors = [self.known_vectors.get(hash_text(text)) for text in texts]
+                missing = [i for i, vector in enumerate(vectors) if vector is None]
+                stats.reused += len(texts) - len(missing)
+
+                if missing:
+                    embed_start = time.perf_counter()
+                    embedded, sent = await aembed_documents_sent(self.vector_store.embeddings, [texts[i] for i in missing])
+                    stats.embed_seconds += time.perf_counter() - embed_start
+                    stats.embedded += len(missing)
+                    #Tokens billed by the model, chunks served by the embedding cache cost none
+                    stats.tokens += await asyncio.to_thread(count_tokens, sent, self.model_name)
+
+                    for i, vector in zip(missing, embedded):
+                        vectors[i] = vector
+
+                async with upsert_limit:
+                    upsert_start = time.perf_counter()
+                    await self.vector_store.aupsert_embedded(batch, vectors, batch_ids)
+                    stats.upsert_seconds += time.perf_counter() - upsert_start
+
+                stats.chunks += len(batch)
+                stats.batches += 1
+
+                if self.on_progress is not None:
+                    await self.on_progress(stats)
+
+        async with asyncio.TaskGroup() as task_group:
+            task_group.create_task(produce())
+            for _ in range(self.embedding_concurrency):
+                task_group.create_task(work())
+
+        stats.total_seconds = time.perf_counter() - start_time
+
+        logger.info(f"Ingested {stats.chunks} chunks ({stats.skipped} already stored) in {stats.batches} batches in {stats.total_seconds:.2f}s "
+                    f"({stats.chunks_per_second:.1f} chunks/s, {stats.tokens_per_second:.1f} tokens/s)")
+
+        return ids, stats
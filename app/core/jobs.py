@@ -0,0 +1,358 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+from uuid import uuid4
+
+from app.config import get_settings
+from app.core.document_processor import DocumentProcessor
+from app.core.ingestion import IngestionStats
+from app.utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from app.core.registry import ServiceRegistry
+
+logger = get_logger(__name__)
+
+#Job status
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+#Ids kept in the result of a job, the count covers every stored document
+RESULT_MAX_DOCUMENT_IDS = 100
+
+
+def new_owner()->str:
+
+    """Id of this job queue: host, pid and a random part, pids are reused across restarts"""
+
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+def owner_alive(owner:str)->bool:
+
+    """False when the owner ran on this host and its process is gone, other hosts are judged by their heartbeat"""
+
+    host, _, rest = owner.partition(":")
+    pid = rest.partition(":")[0]
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+class JobStore:
+
+    """SQLite table of ingestion jobs, so queued and interrupted jobs survive a restart"""
+
+    def __init__(self, path:str|Path):
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                options TEXT NOT NULL DEFAULT '{}',
+                progress TEXT NOT NULL DEFAULT '{}',
+                timings TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner TEXT,
+                heartbeat_at REAL
+            )""")
+        #Stores created before jobs had owners
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (('owner', 'TEXT'), ('heartbeat_at', 'REAL')):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.commit()
+
+    def create(self, job_id:str, filename:str, file_path:str|Path, options:dict)->dict:
+
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, filename, file_path, status, stage, options, timings, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, str(file_path), QUEUED, QUEUED, json.dumps(options),
+                 json.dumps({'queued_at':now}), now, now)
+            )
+            self._conn.commit()
+
+        return self.get(job_id)
+
+    def get(self, job_id:str)->dict|None:
+
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        for key in ('options', 'progress', 'timings', 'result'):
+            job[key] = json.loads(job[key]) if job[key] else None
+
+        return job
+
+    def update(self, job_id:str, **fields)->None:
+
+        for key in ('options', 'progress', 'timings', 'result'):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def claim(self, job_id:str, owner:str)->bool:
+
+        """Marks a queued job as running for owner, False when another queue claimed it first"""
+
+        now = time.time()
+
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ?, updated_at = ? "
+                                        "WHERE id = ? AND status = ?", (RUNNING, owner, now, now, job_id, QUEUED))
+            self._conn.commit()
+
+        return cursor.rowcount == 1
+
+    def heartbeat(self, owner:str)->None:
+
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+                               (time.time(), owner, RUNNING))
+            self._conn.commit()
+
+    def requeue_orphaned(self, stale_seconds:float)->list[str]:
+
+        """Queues again the running jobs whose owner stopped, by its process or by a heartbeat older than stale_seconds"""
+
+        with self._lock:
+            rows = self._conn.execute("SELECT id, owner, heartbeat_at FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+
+        stale = time.time() - stale_seconds
+        orphaned = [row for row in rows
+                    if not row['owner'] or (row['heartbeat_at'] or 0) < stale or not owner_alive(row['owner'])]
+
+        requeued = []
+        with self._lock:
+            for row in orphaned:
+                #Unchanged owner, a job claimed again in the meantime is left alone
+                cursor = self._conn.execute("UPDATE jobs SET status = ?, stage = ?, owner = NULL, updated_at = ? "
+                                            "WHERE id = ? AND status = ? AND owner IS ?",
+                                            (QUEUED, QUEUED, time.time(), row['id'], RUNNING, row['owner']))
+                if cursor.rowcount:
+                    requeued.append(row['id'])
+            self._conn.commit()
+
+        return requeued
+
+    def queued(self)->list[str]:
+
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)).fetchall()
+
+        return [row['id'] for row in rows]
+
+    def close(self)->None:
+        with self._lock:
+            self._conn.close()
+
+
+class IngestionJobQueue:
+
+    """Bounded pool of asyncio workers that parse, chunk, embed and upsert uploaded files.
+    Files are streamed page by page through the IngestionPipeline.
+
+    Uploads are spooled to disk and recorded in the JobStore before they are queued. A worker
+    claims a job before it runs it, so a job runs once even when several processes share the
+    store. Running jobs carry a heartbeat of their owner, jobs of an owner that stopped are
+    queued again, on start() and by every heartbeat."""
+
+    def __init__(self, registry:"ServiceRegistry"):
+
+        self.settings = get_settings()
+        self.registry = registry
+        self.store = JobStore(self.settings.job_store_path)
+        self.spool_dir = Path(self.settings.job_spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+
+        self.owner = new_owner()
+
+        self._queue:asyncio.Queue[str] = asyncio.Queue()
+        self._workers:list[asyncio.Task] = []
+
+    async def start(self)->None:
+
+        for job_id in await asyncio.to_thread(self.store.requeue_orphaned, self.settings.job_stale_seconds):
+            logger.info(f"Resuming the interrupted ingestion job {job_id}")
+
+        for job_id in await asyncio.to_thread(self.store.queued):
+            self._queue.put_nowait(job_id)
+
+        self._workers = [asyncio.create_task(self._work(), name=f"ingestion-worker-{i}")
+                         for i in range(self.settings.ingestion_workers)]
+        self._workers.append(asyncio.create_task(self._heartbeat(), name="ingestion-heartbeat"))
+
+        logger.info(f"Ingestion job queue started with {len(self._workers)} workers")
+
+    async def stop(self)->None:
+
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self.store.close()
+
+        logger.info(f"Ingestion job queue stopped")
+
+    def new_spool_path(self, filename:str)->tuple[str,Path]:
+
+        job_id = str(uuid4())
+        return job_id, self.spool_dir / f"{job_id}{Path(filename).suffix.lower()}"
+
+    def submit(self, job_id:str, filename:str, file_path:Path, options:dict|None=None)->dict:
+
+        job = self.store.create(job_id, filename=filename, file_path=file_path, options=options or {})
+        self._queue.put_nowait(job_id)
+
+        logger.info(f"Queued the ingestion job {job_id} for {filename}")
+
+        return job
+
+    def get(self, job_id:str)->dict|None:
+        return self.store.get(job_id)
+
+    async def _heartbeat(self)->None:
+
+        while True:
+            await asyncio.sleep(self.settings.job_heartbeat_seconds)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, self.owner)
+                for job_id in await asyncio.to_thread(self.store.requeue_orphaned, self.settings.job_stale_seconds):
+                    logger.info(f"Resuming the ingestion job {job_id} of a stopped owner")
+                    self._queue.put_nowait(job_id)
+            except Exception as e:
+                logger.error(f"Ingestion job heartbeat failed: {e}")
+
+    async def _work(self)->None:
+
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id:str)->None:
+
+        if not await asyncio.to_thread(self.store.claim, job_id, self.owner):
+            #Finished, or run by another worker or process
+            return
+
+        job = await asyncio.to_thread(self.store.get, job_id)
+
+        file_path = Path(job['file_path'])
+        timings = job['timings'] or {}
+        timings['started_at'] = time.time()
+        progress = {'pages':0, 'chunks_total':0, 'chunks_embedded':0, 'chunks_upserted':0, 'chunks_skipped':0, 'chunks_reused':0, 'tokens_embedded':0}
+
+        async def update(**fields):
+            await asyncio.to_thread(self.store.update, job_id, **fields)
+
+        try:
+            await update(stage="ingesting", progress=progress, timings=timings, error=None)
+
+            processor = DocumentProcessor()
+
+            def pages():
+                #Pages are parsed lazily as the pipeline pulls chunks
+                for page in processor.lazy_load_file(file_path, source=job['filename']):
+                    progress['pages'] += 1
+                    yield page
+
+            async def on_progress(stats:IngestionStats):
+                progress['chunks_total'] = stats.created
+                progress['chunks_embedded'] = stats.embedded
+                progress['chunks_upserted'] = stats.chunks
+                progress['chunks_skipped'] = stats.skipped
+                progress['chunks_reused'] = stats.reused
+                progress['tokens_embedded'] = stats.tokens
+                await update(progress=progress)
+
+            vector_store = await self.registry.aget_vector_store()
+            chunks = processor.iter_chunks(pages())
+
+            if job['options'].get('mode') == 'reindex':
+                document_ids, stats = await vector_store.areindex_source(job['filename'], chunks, on_progress=on_progress)
+            else:
+                document_ids, stats = await vector_store.aingest_documents(chunks,
+                                                                           skip_existing=job['options'].get('skip_existing'),
+                                                                           on_progress=on_progress)
+            progress['chunks_total'] = stats.created
+
+            if not stats.created:
+                raise ValueError("No chunks could be extracted from the file")
+
+            timings['parse_seconds'] = round(stats.read_seconds, 3)
+            timings['ingest_seconds'] = round(stats.total_seconds, 3)
+            timings['finished_at'] = time.time()
+            timings['total_seconds'] = round(timings['finished_at'] - timings['started_at'], 3)
+
+            await update(status=COMPLETED, stage=COMPLETED, progress=progress, timings=timings,
+                         result={
+                             'message':"Document upload is processed successfully",
+                             'filename':job['filename'],
+                             'chunks_created':stats.created,
+                             'document_ids':document_ids[:RESULT_MAX_DOCUMENT_IDS],
+                             'document_count':len(document_ids),
+                             'ingestion_stats':stats.to_dict()
+                         })
+
+            logger.info(f"Ingestion job {job_id} completed with {stats.created} chunks")
+
+        except asyncio.CancelledError:
+            #Left as running, its heartbeat stops and it is queued again once the owner is found gone
+            raise
+        except Exception as e:
+            timings['finished_at'] = time.time()
+            await update(status=FAILED, stage=FAILED, progress=progress, timings=timings, error=str(e))
+            file_path.unlink(missing_ok=True)
+            raise
+
+        file_path.unlink(missing_ok=True)
@@ -0,0 +1,552 @@
+import asyncio
+import json
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config import get_settings
+from app.core.ingestion import UPLOADED_AT_KEY
+from app.core.sparse import SparseEmbedding, get_bm25_encoder, idf, reciprocal_rank_fusion
+from app.core.vector_store import CONTENT_VERSION_KEY, METADATA_KEY_PATTERN, SearchFilter, SearchOptions, StoredPoint, VectorStoreService
+from app.utils.logger import get_logger
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = get_logger(__name__)
+
+#Rows of the vector file allocated up front, the file doubles when it is full
+INITIAL_CAPACITY = 1024
+#SQLite limits the number of bound variables per statement
+SQLITE_BATCH_SIZE = 500
+
+
+def _normalize(vectors:np.ndarray)->np.ndarray:
+
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    return vectors / norms
+
+
+class LocalCollection:
+
+    """One collection stored in-process: vectors in a memory mapped float32 file, payloads in SQLite.
+
+    Vectors are L2 normalized on write, so cosine similarity is a single matrix-vector product
+    over the mapped rows. Deleted rows are masked out and reused by later upserts. With hnswlib
+    installed, collections of at least ann_threshold points are searched through an HNSW graph
+    that is built in memory on first use. BM25 term weights are kept in an inverted index table.
+
+    A collection belongs to one process, do not write to it from several processes at once."""
+
+    def __init__(self, path:Path, ann_threshold:int, ann_ef:int, index_fields:list[str]|None=None):
+
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ann_threshold = ann_threshold
+        self.ann_ef = ann_ef
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.path / "points.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS points (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                source TEXT,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_points_source ON points(source)")
+        #Filters on other metadata keys scan the rows, only configured keys get an index
+        self._index_metadata_key(UPLOADED_AT_KEY)
+        for key in index_fields or []:
+            if METADATA_KEY_PATTERN.fullmatch(key):
+                self._index_metadata_key(key)
+            else:
+                logger.warning(f"Skipping the index of the invalid metadata key {key!r}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        #Inverted index, the postings of a term are one range of the primary key
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sparse (
+                term INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                weight REAL NOT NULL,
+                PRIMARY KEY (term, row)
+            ) WITHOUT ROWID""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sparse_row ON sparse(row)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'dimension'").fetchone()
+        self.dimension:int|None = int(row[0]) if row else None
+        #Set when every point has BM25 postings, collections written before them or without them have none
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'sparse'").fetchone()
+        self.has_sparse = row is not None and row[0] == '1'
+
+        self._vectors:np.memmap|None = None
+        self._alive = np.zeros(0, dtype=bool)
+        self._rows:dict[str,int] = {}
+        self._free_rows:list[int] = []
+        self._size = 0
+        self._index = None
+
+        if self.dimension is not None:
+            self._open_vectors()
+            for row, point_id in self._conn.execute("SELECT row, id FROM points"):
+                self._rows[point_id] = row
+            self._size = max(self._rows.values(), default=-1) + 1
+            self._alive[list(self._rows.values())] = True
+            self._free_rows = np.flatnonzero(~self._alive[:self._size]).tolist()
+
+        logger.info(f"Local collection is opened at {self.path} with {len(self._rows)} points")
+
+    @property
+    def count(self)->int:
+        return len(self._rows)
+
+    def _open_vectors(self, capacity:int|None=None)->None:
+
+        vector_path = self.path / "vectors.f32"
+        row_bytes = self.dimension * 4
+
+        if capacity is not None:
+            with open(vector_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+
+        capacity = vector_path.stat().st_size // row_bytes
+
+        self._vectors = np.memmap(vector_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive[:capacity]
+        self._alive = alive
+
+    def _allocate(self)->int:
+
+        if self._free_rows:
+            return self._free_rows.pop()
+
+        self._size += 1
+        return self._size - 1
+
+    def _delete_sparse(self, rows:list[int])->None:
+
+        for start in range(0, len(rows), SQLITE_BATCH_SIZE):
+            batch = rows[start:start+SQLITE_BATCH_SIZE]
+            self._conn.execute(f"DELETE FROM sparse WHERE row IN ({','.join('?' * len(batch))})", batch)
+
+    def upsert(self, ids:list[str], vectors:list[list[float]], documents:list[Document],
+               sparse:list[SparseEmbedding]|None=None)->None:
+
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = matrix.shape[1]
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dimension', ?)", (str(self.dimension),))
+                self._open_vectors(INITIAL_CAPACITY)
+            elif matrix.shape[1] != self.dimension:
+                raise ValueError(f"Vectors of dimension {matrix.shape[1]} do not fit the collection of dimension {self.dimension}")
+
+            rows = [self._rows[point_id] if point_id in self._rows else self._allocate() for point_id in ids]
+
+            if self._size > len(self._vectors):
+                capacity = len(self._vectors)
+                while capacity < self._size:
+                    capacity *= 2
+                self._vectors.flush()
+                self._open_vectors(capacity)
+
+            self._vectors[rows] = matrix
+            self._vectors.flush()
+
+            self._conn.executemany("INSERT OR REPLACE INTO points (row, id, source, content, metadata) VALUES (?, ?, ?, ?, ?)",
+                                   [(row, point_id, str(doc.metadata.get('source', '')), doc.page_content, json.dumps(doc.metadata))
+                                    for row, point_id, doc in zip(rows, ids, documents)])
+            if sparse is not None:
+                self._delete_sparse(rows)
+                self._conn.executemany("INSERT OR REPLACE INTO sparse (term, row, weight) VALUES (?, ?, ?)",
+                                       [(term, row, weight) for row, encoded in zip(rows, sparse)
+                                        for term, weight in zip(encoded.indices, encoded.values)])
+
+            #Postings of only some points would rank the others out of sparse and hybrid searches
+            has_sparse = sparse is not None and (self.has_sparse or not self._rows)
+            if has_sparse != self.has_sparse:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sparse', ?)", ('1' if has_sparse else '0',))
+                self.has_sparse = has_sparse
+            self._conn.commit()
+
+            self._rows.update(zip(ids, rows))
+            self._alive[rows] = True
+
+            if self._index is not None:
+                if self._size > self._index.get_max_elements():
+                    self._index.resize_index(len(self._vectors))
+                self._index.add_items(matrix, rows)
+
+    def delete(self, ids:list[str])->None:
+
+        with self._lock:
+            rows = [self._rows.pop(point_id) for point_id in ids if point_id in self._rows]
+            if not rows:
+                return
+
+            for start in range(0, len(rows), SQLITE_BATCH_SIZE):
+                batch = rows[start:start+SQLITE_BATCH_SIZE]
+                self._conn.execute(f"DELETE FROM points WHERE row IN ({','.join('?' * len(batch))})", batch)
+            self._delete_sparse(rows)
+            self._conn.commit()
+
+            self._alive[rows] = False
+            self._free_rows.extend(rows)
+            #Rebuilt on the next search, deletes are rare next to searches
+            self._index = None
+
+    def existing(self, ids:list[str])->set[str]:
+
+        with self._lock:
+            return {point_id for point_id in ids if point_id in self._rows}
+
+    def source_points(self, source:str, with_vectors:bool=False)->list[StoredPoint]:
+
+        with self._lock:
+            rows = self._conn.execute("SELECT row, id, content FROM points WHERE source = ?", (source,)).fetchall()
+
+            return [StoredPoint(id=point_id,
+                                content=content,
+                                vector=self._vectors[row].tolist() if with_vectors else None)
+                    for row, point_id, content in rows]
+
+    def get_meta(self, key:str)->str|None:
+
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+        return row[0] if row else None
+
+    def set_meta(self, key:str, value:str)->None:
+
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def _index_metadata_key(self, key:str)->None:
+
+        #Expression index, filters on the key read a slice of the index instead of every row
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_points_meta_{key.replace('.', '__')} "
+                           f"ON points(json_extract(metadata, '$.{key}'))")
+        self._conn.commit()
+
+    def filter_rows(self, search_filter:SearchFilter)->np.ndarray:
+
+        """Rows of the points that match the filter, metadata keys are validated by SearchFilter"""
+
+        conditions = []
+        parameters:list = []
+
+        for key, values in search_filter.matches().items():
+            column = "source" if key == 'source' else f"json_extract(metadata, '$.{key}')"
+            conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+            parameters.extend(values)
+
+        uploaded_at = f"json_extract(metadata, '$.{UPLOADED_AT_KEY}')"
+        if search_filter.uploaded_after is not None:
+            conditions.append(f"{uploaded_at} >= ?")
+            parameters.append(search_filter.uploaded_after)
+        if search_filter.uploaded_before is not None:
+            conditions.append(f"{uploaded_at} <= ?")
+            parameters.append(search_filter.uploaded_before)
+
+        with self._lock:
+            rows = self._conn.execute(f"SELECT row FROM points WHERE {' AND '.join(conditions) or '1'}",
+                                      parameters).fetchall()
+
+        return np.fromiter((row for row, in rows), dtype=np.int64, count=len(rows))
+
+    def search(self, vector:list[float], k:int, ef:int|None=None,
+               rows:np.ndarray|None=None)->list[tuple[int,float]]:
+
+        """(row, cosine similarity) of the k closest points, only among rows when it is given"""
+
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+
+        with self._lock:
+            if rows is not None:
+                #A filtered slice is scored exactly, its cost grows with the slice and not the collection
+                k = min(k, len(rows))
+                if k == 0:
+                    return []
+                scores = self._vectors[rows] @ query
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+                return [(int(rows[i]), float(scores[i])) for i in top]
+
+            k = min(k, self.count)
+            if k == 0:
+                return []
+
+            if hnswlib is not None and self.ann_threshold and self.count >= self.ann_threshold:
+                index = self._index or self._build_index()
+                index.set_ef(max(ef or self.ann_ef, k))
+                labels, distances = index.knn_query(query, k=k)
+                return [(int(row), 1.0 - float(distance)) for row, distance in zip(labels[0], distances[0])]
+
+            scores = self._vectors[:self._size] @ query
+            scores[~self._alive[:self._size]] = -np.inf
+
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            return [(int(row), float(scores[row])) for row in top]
+
+    def sparse_search(self, query:SparseEmbedding, k:int, rows:np.ndarray|None=None)->list[tuple[int,float]]:
+
+        """(row, BM25 score) of the k best lexical matches, only among rows when it is given"""
+
+        with self._lock:
+            if not self._size:
+                return []
+
+            scores = np.zeros(self._size, dtype=np.float32)
+
+            for term in set(query.indices):
+                postings = self._conn.execute("SELECT row, weight FROM sparse WHERE term = ?", (term,)).fetchall()
+                if not postings:
+                    continue
+                term_rows, weights = np.asarray(postings, dtype=np.float64).T
+                #Every row appears once per term, a plain fancy index add is enough
+                scores[term_rows.astype(np.int64)] += idf(self.count, len(postings)) * weights
+
+        if rows is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[rows] = True
+            scores[~mask] = 0.0
+
+        matched = np.flatnonzero(scores > 0)
+        k = min(k, len(matched))
+        if k == 0:
+            return []
+
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+
+        return [(int(row), float(scores[row])) for row in top]
+
+    def _build_index(self):
+
+        logger.info(f"Building the HNSW index of {self.path} with {self.count} points")
+
+        rows = np.flatnonzero(self._alive[:self._size])
+
+        index = hnswlib.Index(space="cosine", dim=self.dimension)
+        index.init_index(max_elements=len(self._vectors), ef_construction=200, M=16)
+        index.add_items(self._vectors[rows], rows)
+
+        self._index = index
+        return index
+
+    def payloads(self, rows:list[int])->dict[int,tuple[str,str,dict]]:
+
+        """row -> (id, content, metadata)"""
+
+        with self._lock:
+            found = self._conn.execute(f"SELECT row, id, content, metadata FROM points WHERE row IN ({','.join('?' * len(rows))})",
+                                       rows).fetchall()
+
+        return {row:(point_id, content, json.loads(metadata)) for row, point_id, content, metadata in found}
+
+    def vectors(self, rows:list[int])->np.ndarray:
+
+        """Stored (normalized) vectors of rows, copied out of the mapped file"""
+
+        with self._lock:
+            return np.array(self._vectors[rows])
+
+    def close(self)->None:
+
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._conn.close()
+
+
+_collections:dict[Path,LocalCollection] = {}
+_collections_lock = threading.Lock()
+
+
+def get_local_collection(path:Path)->LocalCollection:
+
+    """One LocalCollection per path and process, shared by every service of the collection"""
+
+    with _collections_lock:
+        if path not in _collections:
+            settings = get_settings()
+            _collections[path] = LocalCollection(path, ann_threshold=settings.local_ann_threshold,
+                                                 ann_ef=settings.local_ann_ef,
+                                                 index_fields=settings.payload_index_fields)
+        return _collections[path]
+
+def drop_local_collection(path:Path)->None:
+
+    with _collections_lock:
+        collection = _collections.pop(path, None)
+        if collection is not None:
+            collection.close()
+        shutil.rmtree(path, ignore_errors=True)
+
+def close_local_collections()->None:
+
+    with _collections_lock:
+        for collection in _collections.values():
+            collection.close()
+        _collections.clear()
+
+
+class LocalVectorStoreService(VectorStoreService):
+
+    """In-process backend on LocalCollection, no network round trip per query.
+    The async methods run the NumPy work in a thread so the event loop stays free"""
+
+    def __init__(self, collection_name:str|None=None):
+
+        super().__init__(collection_name)
+        self.path = Path(self.settings.local_vector_store_path).resolve() / self.collection_name
+
+        logger.info(f"Initialised the local Vector Store at {self.path}")
+
+    @property
+    def collection(self)->LocalCollection:
+        #Looked up on every use, so a deleted and recreated collection is picked up
+        return get_local_collection(self.path)
+
+    def health_check(self)->bool:
+        return True
+
+    def get_collection_info(self)->dict:
+
+        collection = self.collection
+
+        return {
+            'Collection_Name':self.collection_name,
+            'points_count':collection.count,
+            'Indexed Points Count':collection.count,
+            'status':'green'
+        }
+
+    def delete_collection(self)->None:
+
+        logger.warning(f"Deleting the collection {self.collection_name}")
+        drop_local_collection(self.path)
+        self._invalidate_answers(shared=False)
+        logger.info(f"The collection {self.collection_name} is deleted")
+
+    def existing_ids(self, ids:list[str])->set[str]:
+        return self.collection.existing(ids)
+
+    @property
+    def supports_sparse(self)->bool:
+        return self.settings.sparse_vectors_enabled and self.collection.has_sparse
+
+    def upsert_embedded(self, documents:list[Document], vectors:list[list[float]], ids:list[str])->None:
+
+        sparse = None
+        if self.settings.sparse_vectors_enabled:
+            sparse = get_bm25_encoder().encode_documents([doc.page_content for doc in documents])
+
+        self.collection.upsert(ids, vectors, documents, sparse)
+
+    def search_by_vector(self, vector:list[float]|None, k:int, options:SearchOptions|None=None,
+                         text:str|None=None)->list[tuple[Document,float]]:
+
+        #Vectors are never quantized here, only hnsw_ef applies
+        mode = self.search_mode(options, text)
+        options = options or SearchOptions()
+        collection = self.collection
+        rows = collection.filter_rows(options.filter) if options.filter is not None else None
+
+        if mode == 'dense':
+            hits = collection.search(vector, k, ef=options.hnsw_ef, rows=rows)
+        elif mode == 'sparse':
+            hits = collection.sparse_search(get_bm25_encoder().encode_query(text), k, rows=rows)
+        else:
+            candidates = max(k, self.settings.hybrid_candidates)
+            dense = collection.search(vector, candidates, ef=options.hnsw_ef, rows=rows)
+            sparse = collection.sparse_search(get_bm25_encoder().encode_query(text), candidates, rows=rows)
+            hits = reciprocal_rank_fusion([[row for row, _ in dense], [row for row, _ in sparse]],
+                                          k=self.settings.rrf_k)[:k]
+
+        if not hits:
+            return []
+
+        rows = [row for row, _ in hits]
+        payloads = collection.payloads(rows)
+        vectors = dict(zip(rows, collection.vectors(rows))) if options.with_vectors else {}
+        result = []
+
+        for row, score in hits:
+            if row not in payloads:
+                continue
+            point_id, content, metadata = payloads[row]
+            metadata['_id'] = point_id
+            metadata['_collection_name'] = self.collection_name
+            if row in vectors:
+                metadata['_vector'] = vectors[row]
+            result.append((Document(page_content=content, metadata=metadata), score))
+
+        return result
+
+    async def ahealth_check(self)->bool:
+        return self.health_check()
+
+    async def aget_collection_info(self)->dict:
+        return await asyncio.to_thread(self.get_collection_info)
+
+    async def adelete_collection(self)->None:
+        await asyncio.to_thread(self.delete_collection)
+
+    async def aexisting_ids(self, ids:list[str])->set[str]:
+        return self.existing_ids(ids)
+
+    async def aupsert_embedded(self, documents:list[Document], vectors:list[list[float]], ids:list[str])->None:
+        await asyncio.to_thread(self.upsert_embedded, documents, vectors, ids)
+
+    async def adelete_points(self, ids:list[str])->None:
+
+        if not ids:
+            return
+
+        await asyncio.to_thread(self.collection.delete, ids)
+        await self._ainvalidate_answers()
+
+        logger.info(f"Deleted {len(ids)} points from the collection {self.collection_name}")
+
+    async def asource_points(self, source:str, with_vectors:bool=False)->list[StoredPoint]:
+        return await asyncio.to_thread(self.collection.source_points, source, with_vectors)
+
+    def _write_content_version(self, version:str)->None:
+        self.collection.set_meta(CONTENT_VERSION_KEY, version)
+
+    async def _awrite_content_version(self, version:str)->None:
+        await asyncio.to_thread(self._write_content_version, version)
+
+    async def acontent_version(self)->str|None:
+        return await asyncio.to_thread(lambda: self.collection.get_meta(CONTENT_VERSION_KEY))
+
+    async def asearch_by_vector(self, vector:list[float]|None, k:int, options:SearchOptions|None=None,
+                                text:str|None=None)->list[tuple[Document,float]]:
+        return await asyncio.to_thread(self.search_by_vector, vector, k, options, text)
+
+    async def asearch_batch_by_vector(self, vectors:list[list[float]|None], k:int,
+                                      options:list[SearchOptions|None], texts:list[str])->list[list[tuple[Document,float]]]:
+
+        #Searches of a collection hold its lock, one thread runs the whole batch
+        return await asyncio.to_thread(lambda: [self.search_by_vector(vector, k, query_options, text)
+                                                for vector, query_options, text in zip(vectors, options, texts)])
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+from collections.abc import Awaitable, Callable
+from typing import Any, Generic, TypeVar
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+#Kinds of micro-batches of the RAG chain, each has its own counters
+QUERY_EMBEDDING_BATCHES = "query_embeddings"
+SEARCH_BATCHES = "searches"
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatchStats:
+
+    """Counters of the batches of one kind, shared by the batchers of every collection"""
+
+    def __init__(self):
+
+        self.batches = 0
+        self.items = 0
+        self.fill = 0.0
+        self.flushed_full = 0
+        self.flushed_wait = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, size:int, max_size:int, full:bool)->None:
+
+        with self._lock:
+            self.batches += 1
+            self.items += size
+            self.fill += size / max_size
+            if full:
+                self.flushed_full += 1
+            else:
+                self.flushed_wait += 1
+
+    def record_error(self)->None:
+
+        with self._lock:
+            self.errors += 1
+
+    def stats(self)->dict:
+
+        return {
+            'batches':self.batches,
+            'items':self.items,
+            'average_batch_size':round(self.items/self.batches, 2) if self.batches else None,
+            'fill_ratio':round(self.fill/self.batches, 4) if self.batches else None,
+            'flushed_full':self.flushed_full,
+            'flushed_wait':self.flushed_wait,
+            #Upstream calls the batching avoided
+            'calls_saved':self.items - self.batches,
+            'errors':self.errors,
+        }
+
+
+class MicroBatcher(Generic[T, R]):
+
+    """Groups the items submitted by concurrent requests into one call of handler.
+
+    The first item of a batch starts a max_wait_ms timer, the batch is sent when the timer
+    fires or when it holds max_size items, whichever comes first, and every caller gets the
+    result at its own position. handler takes a list of items and returns one result per item.
+    When a batch of several items fails, its items are retried one by one, so a failure only
+    reaches the request that caused it.
+
+    A batcher belongs to the event loop of its first submit, like the requests it serves"""
+
+    def __init__(self, handler:Callable[[list[T]],Awaitable[list[R]]], max_size:int=32, max_wait_ms:float=5.0,
+                 stats:MicroBatchStats|None=None):
+
+        self.handler = handler
+        self.max_size = max(1, max_size)
+        self.max_wait_ms = max_wait_ms
+        self.stats = stats or MicroBatchStats()
+
+        self._pending:list[tuple[T,asyncio.Future]] = []
+        self._timer:asyncio.TimerHandle|None = None
+        #Running batches, referenced so they are not garbage collected midway
+        self._tasks:set[asyncio.Task] = set()
+
+    async def submit(self, item:T)->R:
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush(full=True)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush, False)
+
+        return await future
+
+    def _flush(self, full:bool)->None:
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        self.stats.record(len(batch), self.max_size, full)
+
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch:list[tuple[T,asyncio.Future]])->None:
+
+        items = [item for item, _ in batch]
+
+        try:
+            results:list[Any] = await self.handler(items)
+            if len(results) != len(items):
+                raise ValueError(f"Micro-batch handler returned {len(results)} results for {len(items)} items")
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            self.stats.record_error()
+            if len(batch) == 1:
+                results = [e]
+            else:
+                logger.warning(f"Micro-batch of {len(batch)} items failed, retrying them one by one: {e}")
+                results = [result[0] if isinstance(result, list) else result
+                           for result in await asyncio.gather(*(self.handler([item]) for item in items),
+                                                              return_exceptions=True)]
+
+        for (_, future), result in zip(batch, results):
+            #A caller that gave up (client disconnected) has a cancelled future
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+_stats:dict[str,MicroBatchStats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_micro_batch_stats(name:str)->MicroBatchStats:
+
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = MicroBatchStats()
+        return _stats[name]
+
+def micro_batch_stats()->dict[str,dict]:
+
+    """Counters of every kind of micro-batch, for /health/metrics"""
+
+    with _stats_lock:
+        return {name:stats.stats() for name, stats in _stats.items()}
+
+def reset_micro_batch_stats()->None:
+
+    with _stats_lock:
+        _stats.clear()
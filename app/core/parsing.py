@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+from app.config import get_settings
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+#Set in the pool processes, parsing inside a worker never fans out to another pool
+_in_worker = False
+
+
+def _mark_worker()->None:
+
+    global _in_worker
+    _in_worker = True
+
+def parser_workers()->int:
+
+    return get_settings().parser_workers or os.cpu_count() or 1
+
+@lru_cache
+def get_parser_pool()->ProcessPoolExecutor:
+
+    """Process pool shared by every upload, text extraction is CPU bound and would hold the GIL in a thread"""
+
+    workers = parser_workers()
+
+    logger.info(f"Starting the parser process pool with {workers} workers")
+
+    #spawn, the server process runs threads and forking it is not safe
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_mark_worker)
+
+def shutdown_parser_pool(wait:bool=True)->None:
+
+    """wait=False lets the parses already submitted finish in the background, the next upload starts a new pool"""
+
+    if get_parser_pool.cache_info().currsize:
+        get_parser_pool().shutdown(wait=wait, cancel_futures=wait)
+        logger.info(f"Parser process pool is shut down")
+
+    get_parser_pool.cache_clear()
+
+def run_in_order(function:Callable[...,Any], tasks:Iterable[tuple], window:int|None=None)->Iterator[Any]:
+
+    """Runs function(*task) in the parser pool and yields the results in task order.
+    At most window tasks are in flight, so results never pile up faster than they are consumed"""
+
+    pool = get_parser_pool()
+    window = window or parser_workers() * 2
+    pending:deque[Future] = deque()
+
+    try:
+        for task in tasks:
+            pending.append(pool.submit(function, *task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def pdf_page_ranges(file_path:str|Path, pages_per_task:int|None=None)->list[tuple[int,int]]:
+
+    """[start, stop) page ranges of a PDF, one per parsing task"""
+
+    pages_per_task = pages_per_task or get_settings().pdf_pages_per_task
+    total_pages = len(PdfReader(file_path).pages)
+
+    return [(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)]
+
+def pdf_metadata(reader:PdfReader, source:str)->dict[str,Any]:
+
+    """Document information of the PDF (producer, creator, dates, title...) normalized like PyPDFLoader does:
+    lower case keys without the leading slash, ISO dates, other values as stripped strings"""
+
+    metadata:dict[str,Any] = {}
+    info = {'producer':"PyPDF", 'creator':"PyPDF", 'creationdate':""} | dict(reader.metadata or {})
+
+    for key, value in info.items():
+        key = key.lstrip("/").lower()
+        value = value if type(value) in (str, int) else str(value)
+        if key in ('creationdate', 'moddate'):
+            try:
+                value = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        metadata[key] = value.strip() if isinstance(value, str) else value
+
+    return metadata | {'source':source, 'total_pages':len(reader.pages)}
+
+def parse_pdf_pages(file_path:str, start:int, stop:int, source:str|None=None)->list[Document]:
+
+    """Text of the pages [start, stop) with the metadata of PyPDFLoader, runs in a pool process"""
+
+    reader = PdfReader(file_path)
+    metadata = pdf_metadata(reader, source or file_path)
+
+    return [Document(page_content=reader.pages[page].extract_text(extraction_mode="plain").strip(),
+                     metadata=metadata | {'page':page, 'page_label':reader.page_labels[page]})
+            for page in range(start, min(stop, metadata['total_pages']))]
+
+def iter_pdf_pages(file_path:str|Path, source:str|None=None, pages_per_task:int|None=None)->Iterator[Document]:
+
+    """Pages of a PDF in page order, page ranges are parsed in parallel in the parser pool.
+    Small files and calls from inside a pool process are parsed in the current process"""
+
+    file_path = str(file_path)
+    ranges = pdf_page_ranges(file_path, pages_per_task)
+
+    if _in_worker or len(ranges) <= 1:
+        for start, stop in ranges:
+            yield from parse_pdf_pages(file_path, start, stop, source)
+        return
+
+    logger.info(f"Parsing {file_path} in {len(ranges)} page ranges in the parser pool")
+
+    for documents in run_in_order(parse_pdf_pages, [(file_path, start, stop, source) for start, stop in ranges]):
+        yield from documents
+
+def parse_pdf(file_path:str|Path, source:str|None=None, pages_per_task:int|None=None)->list[Document]:
+
+    return list(iter_pdf_pages(file_path, source=source, pages_per_task=pages_per_task))
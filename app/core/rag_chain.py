@@ -1,17 +1,22 @@
-
+import json
+from operator import itemgetter
+from typing import Any
 
 from langchain_core.documents import Document
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
 
 from app.config import get_settings
-from app.core.vector_store import VectorStoreService
+from app.core.answer_cache import get_answer_cache
+from app.core.context_selection import DOCUMENT_SEPARATOR, get_context_selector
+from app.core.embeddings import aembed_queries
+from app.core.micro_batching import QUERY_EMBEDDING_BATCHES, SEARCH_BATCHES, MicroBatcher, get_micro_batch_stats
+from app.core.vector_store import SearchOptions, VectorStoreService, create_vector_store
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
-settings = get_settings()
 
 
 RAG_PROMPT_TEMPLATE = """You are an assistant. Answer the question based on the provided context.
@@ -27,39 +32,76 @@ Answer:
 
 def format_documents(docs:list[Document])->str:
 
-    return "\n\n---\n\n".join(doc.page_content for doc in docs)
+    return DOCUMENT_SEPARATOR.join(doc.page_content for doc in docs)
+
+def format_sources(docs:list[Document])->list[dict]:
+
+    return [
+        {
+            'content':doc.page_content,
+            'metadata':doc.metadata
+        }
+        for doc in docs
+    ]
 
 class RAGChain:
 
     def __init__(self, vector_store:VectorStoreService|None=None):
 
-        """context|prmpt|llm|str"""
+        """{question, options} | {documents, question} | assign(answer = context|prompt|llm|str)
 
-        self.vector_store = vector_store or VectorStoreService()
-        self.retriever = self.vector_store.get_retriever()
+        Retrieval runs once per question and its documents feed both the
+        prompt and the returned sources, options scope the retrieval"""
+
+        self.settings = get_settings()
+        self.vector_store = vector_store or create_vector_store()
 
         self.prompt = PromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
 
         self.llm = ChatOpenAI(
-            model=settings.llm_model,
-            temperature=settings.llm_temp,
-            api_key=settings.openai_api_key
+            model=self.settings.llm_model,
+            temperature=self.settings.llm_temp,
+            api_key=self.settings.openai_api_key
         )
 
-        self.chain = (
-            {"context":self.retriever|format_documents,
-             "question":RunnablePassthrough(),}
+        self.retrieval = RunnableLambda(self._retrieve, afunc=self._aretrieve)
+
+        self.answer_chain = (
+            {"context":itemgetter("documents")|RunnableLambda(format_documents),
+             "question":itemgetter("question"),}
              |self.prompt
              |self.llm
              |StrOutputParser()
              
              )
+
+        self.chain = (
+            RunnableParallel(documents=self.retrieval,
+                             question=itemgetter("question"))
+            |RunnablePassthrough.assign(answer=self.answer_chain)
+        )
         
         #To Initialize the evaluator
         self._evaluator=None
 
-        logger.info(f"RAG chain initialized with LLM Model {settings.llm_model} "
-                    f"with the top {settings.retieval_k}")
+        self.answer_cache = get_answer_cache() if self.settings.answer_cache_enabled else None
+        self.context_selector = get_context_selector() if self.settings.context_selection_enabled else None
+
+        self.search_batcher = None
+        self.embedding_batcher = None
+        if self.settings.micro_batch_enabled:
+            #Queries of concurrent requests share one embedding request and one batch search
+            self.search_batcher = MicroBatcher(self._asearch_batch,
+                                               max_size=self.settings.micro_batch_max_size,
+                                               max_wait_ms=self.settings.micro_batch_max_wait_ms,
+                                               stats=get_micro_batch_stats(SEARCH_BATCHES))
+            self.embedding_batcher = MicroBatcher(lambda texts: aembed_queries(self.vector_store.embeddings, texts),
+                                                  max_size=self.settings.micro_batch_max_size,
+                                                  max_wait_ms=self.settings.micro_batch_max_wait_ms,
+                                                  stats=get_micro_batch_stats(QUERY_EMBEDDING_BATCHES))
+
+        logger.info(f"RAG chain initialized with LLM Model {self.settings.llm_model} "
+                    f"with the top {self.settings.retieval_k}")
         
     
     @property
@@ -71,80 +113,121 @@ class RAGChain:
             self._evaluator=RAGASEvaluator()
 
         return self._evaluator
+
+    @staticmethod
+    def _inputs(question:str, options:SearchOptions|None=None)->dict:
+        return {'question':question, 'options':options}
+
+    def _retrieve(self, inputs:dict)->list[Document]:
+
+        if self.context_selector is None:
+            return self.vector_store.search(query=inputs['question'], k=self.settings.retieval_k, options=inputs.get('options'))
+
+        #The retieval_k chunks of the context are picked out of a larger candidate set
+        results = self.vector_store.search_with_score(query=inputs['question'],
+                                                      k=max(self.context_selector.candidates, self.settings.retieval_k),
+                                                      options=self.context_selector.search_options(inputs.get('options')))
+
+        return self.context_selector.select(results, k=self.settings.retieval_k)
+
+    async def _aretrieve(self, inputs:dict)->list[Document]:
+
+        if self.context_selector is None:
+            results = await self._asearch_with_score(inputs['question'], k=self.settings.retieval_k,
+                                                     options=inputs.get('options'))
+            return [doc for doc, _ in results]
+
+        results = await self._asearch_with_score(inputs['question'],
+                                                 k=max(self.context_selector.candidates, self.settings.retieval_k),
+                                                 options=self.context_selector.search_options(inputs.get('options')))
+
+        return self.context_selector.select(results, k=self.settings.retieval_k)
+
+    async def _asearch_with_score(self, question:str, k:int, options:SearchOptions|None)->list[tuple[Document,float]]:
+
+        if self.search_batcher is None:
+            return await self.vector_store.asearch_with_score(query=question, k=k, options=options)
+
+        return await self.search_batcher.submit((question, k, options))
+
+    async def _asearch_batch(self, items:list[tuple[str,int,SearchOptions|None]])->list[list[tuple[Document,float]]]:
+
+        results:list[Any] = [None] * len(items)
+
+        #A batch search has one k, searches of one chain almost always share it
+        for k in {k for _, k, _ in items}:
+            positions = [i for i, item in enumerate(items) if item[1] == k]
+            found = await self.vector_store.asearch_batch_with_score([items[i][0] for i in positions], k=k,
+                                                                     options=[items[i][2] for i in positions])
+            for i, result in zip(positions, found):
+                results[i] = result
+
+        return results
+
+    async def _aembed_query(self, question:str)->list[float]:
+
+        if self.embedding_batcher is None:
+            return await self.vector_store.embeddings.aembed_query(question)
+
+        return await self.embedding_batcher.submit(question)
     
-    def query(self,question:str)->str:
+    def query(self,question:str, options:SearchOptions|None=None)->str:
 
         logger.info(f"Processing the question {question[:70]}...")
 
         try:
-            answer = self.chain.invoke(question)
+            result = self.chain.invoke(self._inputs(question, options))
             logger.info(f"Query is processed")
-            return answer
+            return result['answer']
         except Exception as e:
             logger.error("Can not process the query due to {e}")
             raise
 
-    def query_with_source(self,question:str)->dict:
+    def query_with_source(self,question:str, options:SearchOptions|None=None)->dict:
 
         logger.info(f"Processing the query {question[:70]}...")
 
         try:
-            answer = self.chain.invoke(question)
-
-            source_docs = self.retriever.invoke(question)
+            result = self.chain.invoke(self._inputs(question, options))
 
-            sources= [
-                {
-                    'content':doc.page_content,
-                    'metadata':doc.metadata
-                }
-                for doc in source_docs
-            ]
+            sources = format_sources(result['documents'])
             logger.info(f"Processed the query with {len(sources)} sources")
 
             return {
-                'answer':answer,
+                'answer':result['answer'],
                 'sources':sources
             }
         except Exception as e:
             logger.error(f"Can not process the query due to {e}")
             raise
 
-    async def aquery(self, question:str)->str:
+    async def aquery(self, question:str, options:SearchOptions|None=None)->str:
         logger.info(f"Processing the query {question[:70]}...")
 
         try:
-            answer = await self.chain.ainvoke(question)
+            result = await self.chain.ainvoke(self._inputs(question, options))
 
             logger.info(f"Processed is completed")
 
-            return answer
+            return result['answer']
         
         except Exception as e:
             logger.error(f"Can not process the query due to str{e}")
             raise
 
-    async def aquery_with_source(self, question:str)->dict:
+    async def aquery_with_source(self, question:str, options:SearchOptions|None=None)->dict:
 
         logger.info(f"Processing the query {question[:70]}...")
 
         try:
-            answer = await self.chain.ainvoke(question)
-
-            source_docs = self.retriever.invoke(question)
+            result = await self.chain.ainvoke(self._inputs(question, options))
 
-            sources = [ 
-                {
-                    'content':doc.page_content,
-                    'metadata':doc.metadata
-                } 
-                for doc in source_docs
-            ]
+            sources = format_sources(result['documents'])
 
             logger.info(f"Process is completed with {len(sources)} context sources")
 
             return {
-                'answer':answer,
+                'answer':result['answer'],
                 'sources':sources
             }
 
@@ -153,12 +236,107 @@ class RAGChain:
             logger.error(f"Can not process the query due to {e}")
             raise
     
-    async def aquery_with_evaluator(self, question:str, include_source:bool=True)->dict:
+    async def aquery_cached(self, question:str, options:SearchOptions|None=None)->dict:
+
+        """aquery_with_source, served from the semantic answer cache when a
+        similar question was already answered on this collection with the same search settings"""
+
+        if self.answer_cache is None:
+            return {**await self.aquery_with_source(question, options), 'cached':False}
+
+        collection_name = self.vector_store.collection_name
+        scope = self._answer_scope(question, options)
+        #Catches changes made by other processes, ours invalidate the cache directly
+        self.answer_cache.check_version(collection_name, await self.vector_store.acontent_version())
+        generation = self.answer_cache.generation(collection_name)
+
+        #Goes through the query embedding cache, so the retrieval below reuses it
+        query_vector = await self._aembed_query(question)
+
+        cached = self.answer_cache.lookup(collection_name, query_vector, scope=scope)
+        if cached is not None:
+            return {
+                'answer':cached.answer,
+                'sources':cached.sources,
+                'cached':True
+            }
+
+        result = await self.aquery_with_source(question, options)
+
+        self.answer_cache.store(collection_name, query_vector,
+                                answer=result['answer'],
+                                sources=result['sources'],
+                                generation=generation,
+                                scope=scope)
+
+        return {**result, 'cached':False}
+
+    def _answer_scope(self, question:str, options:SearchOptions|None)->str:
+
+        """Search settings that change the retrieved context, answers are shared only between equal ones"""
+
+        options = options or SearchOptions()
+
+        return json.dumps({
+            'mode':self.vector_store.search_mode(options, question),
+            'hnsw_ef':options.hnsw_ef,
+            'oversampling':options.oversampling,
+            'filter':options.filter.key() if options.filter is not None else None,
+        }, sort_keys=True)
+
+    async def _abatch_retrieve(self, questions:list[str], options:list[SearchOptions|None])->list[list[Document]]:
+
+        if self.context_selector is None:
+            results = await self.vector_store.asearch_batch_with_score(questions, k=self.settings.retieval_k, options=options)
+            return [[doc for doc, _ in result] for result in results]
+
+        results = await self.vector_store.asearch_batch_with_score(questions,
+                                                                   k=max(self.context_selector.candidates, self.settings.retieval_k),
+                                                                   options=[self.context_selector.search_options(query_options)
+                                                                            for query_options in options])
+
+        return [self.context_selector.select(result, k=self.settings.retieval_k) for result in results]
+
+    async def abatch_query(self, questions:list[str], options:list[SearchOptions|None]|None=None)->list[dict|Exception]:
+
+        """aquery_with_source of many questions, in order. The retrieval is one batch search and
+        BATCH_MAX_CONCURRENCY answers are generated at a time, a question that fails gets its
+        exception in place of the result"""
+
+        options = options or [None] * len(questions)
+        config = {'max_concurrency':self.settings.batch_max_concurrency}
+
+        logger.info(f"Processing a batch of {len(questions)} questions")
+
+        try:
+            documents:list[Any] = await self._abatch_retrieve(questions, options)
+        except Exception as e:
+            #One failing search fails the whole batch request, one by one the failure stays with its question
+            logger.warning(f"Batch retrieval failed, retrieving the questions one by one: {e}")
+            documents = await self.retrieval.abatch([self._inputs(question, query_options)
+                                                     for question, query_options in zip(questions, options)],
+                                                    config=config, return_exceptions=True)
+
+        retrieved = [i for i, docs in enumerate(documents) if not isinstance(docs, Exception)]
+        answers = await self.answer_chain.abatch([{'documents':documents[i], 'question':questions[i]} for i in retrieved],
+                                                 config=config, return_exceptions=True)
+
+        results:list[dict|Exception] = list(documents)
+        for i, answer in zip(retrieved, answers):
+            results[i] = answer if isinstance(answer, Exception) else {'answer':answer, 'sources':format_sources(documents[i])}
+
+        failed = sum(isinstance(result, Exception) for result in results)
+        logger.info(f"Processed the batch of {len(questions)} questions, {failed} failed")
+
+        return results
+
+    async def aquery_with_evaluator(self, question:str, include_source:bool=True,
+                                    options:SearchOptions|None=None)->dict:
 
         logger.info(f"Processing the query {question[:70]}...")
 
         try:
-            result = await self.aquery_with_source(question)
+            result = await self.aquery_with_source(question, options)
 
             answer = result['answer']
             sources = result['sources']
@@ -188,13 +366,31 @@ class RAGChain:
             logger.error(f"Can not process the query {question[:70]}...")
             raise
 
-    def stream(self,question:str):
+    def stream(self,question:str, options:SearchOptions|None=None):
+
+        logger.info(f"Processing the query {question[:70]}...")
+
+        try:
+            for chunks in self.chain.stream(self._inputs(question, options)):
+                if 'answer' in chunks:
+                    yield chunks['answer']
+        except Exception as e:
+            logger.error(f"Can not process the query due to {e}")
+            raise
+
+    async def astream(self, question:str, options:SearchOptions|None=None):
+
+        """Yields {'sources':[...]} as soon as the retrieval is done,
+        followed by {'token':str} for every chunk of the answer"""
 
         logger.info(f"Processing the query {question[:70]}...")
 
         try:
-            for chunks in self.chain.stream(question):
-                yield chunks
+            async for chunks in self.chain.astream(self._inputs(question, options)):
+                if 'documents' in chunks:
+                    yield {'sources':format_sources(chunks['documents'])}
+                if 'answer' in chunks:
+                    yield {'token':chunks['answer']}
         except Exception as e:
             logger.error(f"Can not process the query due to {e}")
             raise
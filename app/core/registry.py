@@ -0,0 +1,159 @@
+import asyncio
+import threading
+
+from app.config import get_settings
+from app.core.answer_cache import get_answer_cache
+from app.core.context_selection import get_context_selector
+from app.core.embedding_cache import get_embedding_cache, get_query_embedding_cache
+from app.core.embeddings import get_embedding_dimension, get_embeddings
+from app.core.rag_chain import RAGChain
+from app.core.local_vector_store import close_local_collections
+from app.core.micro_batching import reset_micro_batch_stats
+from app.core.parsing import shutdown_parser_pool
+from app.core.sparse import get_bm25_encoder
+from app.core.vector_store import VectorStoreService, create_vector_store, get_async_qdrant_client, get_qdrant_client
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ServiceRegistry:
+
+    """Process wide holder of warm VectorStoreService and RAGChain instances.
+
+    One vector store and one chain are kept per collection, so the collection
+    check in _ensure_collection and the LLM/chain construction happen once
+    (at startup or on first use) instead of on every request.
+    Call invalidate() after the collection changes underneath us
+    (e.g. delete_collection) and areload() after a configuration change,
+    the application calls it on SIGHUP."""
+
+    def __init__(self):
+
+        self.settings = get_settings()
+
+        self._vector_stores:dict[str,VectorStoreService] = {}
+        self._rag_chains:dict[str,RAGChain] = {}
+        self._lock = threading.Lock()
+
+        logger.info(f"Service registry is initiated with default collection {self.settings.collection_name}")
+
+    def _resolve(self, collection_name:str|None)->str:
+        return collection_name or self.settings.collection_name
+
+    def get_vector_store(self, collection_name:str|None=None)->VectorStoreService:
+
+        collection_name = self._resolve(collection_name)
+
+        vector_store = self._vector_stores.get(collection_name)
+        if vector_store is not None:
+            return vector_store
+
+        with self._lock:
+            if collection_name not in self._vector_stores:
+                logger.info(f"Building the vector store for the collection {collection_name}")
+                self._vector_stores[collection_name] = create_vector_store(collection_name=collection_name)
+
+            return self._vector_stores[collection_name]
+
+    def get_rag_chain(self, collection_name:str|None=None)->RAGChain:
+
+        collection_name = self._resolve(collection_name)
+
+        rag_chain = self._rag_chains.get(collection_name)
+        if rag_chain is not None:
+            return rag_chain
+
+        vector_store = self.get_vector_store(collection_name)
+
+        with self._lock:
+            if collection_name not in self._rag_chains:
+                logger.info(f"Building the RAG chain for the collection {collection_name}")
+                self._rag_chains[collection_name] = RAGChain(vector_store=vector_store)
+
+            return self._rag_chains[collection_name]
+
+    async def aget_vector_store(self, collection_name:str|None=None)->VectorStoreService:
+
+        vector_store = self._vector_stores.get(self._resolve(collection_name))
+        if vector_store is not None:
+            return vector_store
+
+        #Building talks to Qdrant with the sync client, keep it off the event loop
+        return await asyncio.to_thread(self.get_vector_store, collection_name)
+
+    async def aget_rag_chain(self, collection_name:str|None=None)->RAGChain:
+
+        rag_chain = self._rag_chains.get(self._resolve(collection_name))
+        if rag_chain is not None:
+            return rag_chain
+
+        return await asyncio.to_thread(self.get_rag_chain, collection_name)
+
+    def warm_up(self)->None:
+
+        logger.info(f"Warming up the services for the collection {self.settings.collection_name}")
+        self.get_rag_chain()
+
+    def invalidate(self, collection_name:str|None=None)->None:
+
+        """Drop the cached services of a collection so they are rebuilt on the next use"""
+
+        collection_name = self._resolve(collection_name)
+
+        with self._lock:
+            self._rag_chains.pop(collection_name, None)
+            self._vector_stores.pop(collection_name, None)
+
+        logger.info(f"Invalidated the cached services for the collection {collection_name}")
+
+    async def areload(self)->None:
+
+        """Re-read the settings and drop every cached service and client.
+        The old clients, embedding cache and local collections are closed, requests
+        still running on them fail, the next ones get new ones built with the new settings"""
+
+        with self._lock:
+            self._rag_chains.clear()
+            self._vector_stores.clear()
+
+            get_settings.cache_clear()
+            get_embeddings.cache_clear()
+            get_embedding_dimension.cache_clear()
+            get_query_embedding_cache.cache_clear()
+            get_answer_cache.cache_clear()
+            get_bm25_encoder.cache_clear()
+            get_context_selector.cache_clear()
+            shutdown_parser_pool(wait=False)
+            reset_micro_batch_stats()
+
+            self.settings = get_settings()
+
+        await self._aclose_clients()
+
+        logger.info(f"Service registry is reloaded with the latest settings")
+
+    async def aclose(self)->None:
+
+        with self._lock:
+            self._rag_chains.clear()
+            self._vector_stores.clear()
+
+        await self._aclose_clients()
+
+        logger.info(f"Service registry is closed")
+
+    async def _aclose_clients(self)->None:
+
+        #Only the clients that were built, calling the getters would build them
+        if get_async_qdrant_client.cache_info().currsize:
+            await get_async_qdrant_client().close()
+        if get_qdrant_client.cache_info().currsize:
+            get_qdrant_client().close()
+        if get_embedding_cache.cache_info().currsize:
+            get_embedding_cache().close()
+
+        get_async_qdrant_client.cache_clear()
+        get_qdrant_client.cache_clear()
+        get_embedding_cache.cache_clear()
+        close_local_collections()
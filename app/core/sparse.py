@@ -0,0 +1,110 @@
+import hashlib
+import math
+import re
+from collections import Counter, defaultdict
+from collections.abc import Hashable, Iterable
+from dataclasses import dataclass
+from functools import lru_cache
+
+from app.config import get_settings
+
+#Words, numbers and codes such as err-4021, v1.2.3 or part_no_77 are single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+CODE_SEPARATORS = re.compile(r"[-_./:]")
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have how i if in into is it its of on or so such that the their then
+there these they this to was we were what when where which who why will with you your
+""".split())
+
+
+@dataclass
+class SparseEmbedding:
+    indices:list[int]
+    values:list[float]
+
+
+def tokenize(text:str)->list[str]:
+
+    """Lower case terms without stop words, a code also yields its parts so err-4021 matches 4021"""
+
+    tokens = []
+
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        tokens.append(token)
+        if CODE_SEPARATORS.search(token):
+            tokens.extend(part for part in CODE_SEPARATORS.split(token) if part and part not in STOP_WORDS)
+
+    return tokens
+
+@lru_cache(maxsize=1 << 16)
+def term_index(term:str)->int:
+
+    #Stable across processes and versions, unlike hash(), the ids are stored with the points
+    return int.from_bytes(hashlib.blake2b(term.encode(), digest_size=4).digest(), "little")
+
+def idf(document_count:int, document_frequency:int)->float:
+
+    #The BM25 idf Qdrant applies with Modifier.IDF
+    return math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+def reciprocal_rank_fusion(rankings:Iterable[list[Hashable]], k:int=60)->list[tuple[Hashable,float]]:
+
+    """Keys of several rankings ordered by sum(1 / (k + rank)), ranks start at 0 as in Qdrant"""
+
+    scores:dict[Hashable,float] = defaultdict(float)
+
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (k + rank)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Encoder:
+
+    """Sparse lexical vectors computed locally, terms are hashed to 32 bit indices.
+
+    A document value is the BM25 term frequency part, tf*(k1+1) / (tf + k1*(1-b+b*length/avg_length)).
+    The idf part depends on the whole collection, the vector store applies it at search time,
+    so a query value is 1 per term"""
+
+    def __init__(self, k1:float=1.2, b:float=0.75, avg_doc_length:float=256.0):
+
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = avg_doc_length
+
+    @staticmethod
+    def _vector(weights:dict[int,float])->SparseEmbedding:
+        return SparseEmbedding(indices=list(weights), values=list(weights.values()))
+
+    def encode_document(self, text:str)->SparseEmbedding:
+
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        norm = self.k1 * (1 - self.b + self.b * length / self.avg_doc_length)
+
+        weights:dict[int,float] = defaultdict(float)
+        for term, tf in counts.items():
+            #Hash collisions are rare, colliding terms share one index
+            weights[term_index(term)] += tf * (self.k1 + 1) / (tf + norm)
+
+        return self._vector(weights)
+
+    def encode_documents(self, texts:list[str])->list[SparseEmbedding]:
+        return [self.encode_document(text) for text in texts]
+
+    def encode_query(self, text:str)->SparseEmbedding:
+
+        return self._vector({term_index(term):1.0 for term in tokenize(text)})
+
+
+@lru_cache
+def get_bm25_encoder()->BM25Encoder:
+
+    settings = get_settings()
+
+    return BM25Encoder(k1=settings.bm25_k1, b=settings.bm25_b, avg_doc_length=settings.bm25_avg_doc_length)
@@ -0,0 +1,126 @@
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterator
+from itertools import accumulate, compress, count, islice
+from operator import sub
+from typing import Any
+
+from langchain_text_splitters import TextSplitter
+
+DEFAULT_SEPARATORS = ['\n\n','\n','.',' ','']
+
+
+class OffsetTextSplitter(TextSplitter):
+
+    """Drop in for RecursiveCharacterTextSplitter(separators, chunk_size, chunk_overlap, length_function=len)
+    that yields the same chunks.
+
+    With the separator kept at the start of every piece, a merged chunk is always a contiguous
+    range of the text, so pieces are tracked as offsets found with str.find and the only string
+    built is the final text[start:end].strip() of each chunk. Like the recursive splitter, a piece
+    that is too long and has no separator left is kept as it is, without stripping."""
+
+    def __init__(self, separators:list[str]|None=None, **kwargs:Any):
+
+        if kwargs.get('length_function', len) is not len:
+            raise ValueError("OffsetTextSplitter measures chunks in characters, length_function must be len")
+
+        super().__init__(keep_separator=True, **kwargs)
+        self._separators = separators or DEFAULT_SEPARATORS
+
+    def split_text(self, text:str)->list[str]:
+
+        if not text:
+            return []
+
+        chunks = []
+
+        for start, end, merged in self._split(text, 0, len(text), self._separators):
+            chunk = text[start:end]
+            if merged and self._strip_whitespace:
+                chunk = chunk.strip()
+            if chunk:
+                chunks.append(chunk)
+
+        return chunks
+
+    def _split(self, text:str, start:int, end:int, separators:list[str])->Iterator[tuple[int,int,bool]]:
+
+        #First separator present in text[start:end], the rest are for the pieces that are still too long
+        separator = separators[-1]
+        remaining:list[str] = []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                remaining = separators[i+1:]
+                break
+
+        cuts = self._cuts(text, start, end, separator)
+
+        #Runs of pieces shorter than chunk_size are merged, longer pieces are split further
+        long_pieces = compress(count(), map(self._chunk_size.__le__, map(sub, islice(cuts, 1, None), cuts)))
+
+        run_start = 0
+        for i in long_pieces:
+            if i > run_start:
+                yield from self._merge(cuts[run_start:i+1])
+
+            if remaining:
+                yield from self._split(text, cuts[i], cuts[i+1], remaining)
+            else:
+                yield cuts[i], cuts[i+1], False
+
+            run_start = i + 1
+
+        if len(cuts) - 1 > run_start:
+            yield from self._merge(cuts[run_start:])
+
+    @staticmethod
+    def _cuts(text:str, start:int, end:int, separator:str)->list[int]:
+
+        """Piece boundaries, piece i is text[cuts[i]:cuts[i+1]] and starts with its separator"""
+
+        if not separator:
+            return list(range(start, end + 1))
+
+        #One split per level and the piece lengths summed up in C, cheaper than a find per separator
+        piece = text if start == 0 and end == len(text) else text[start:end]
+        step = len(separator)
+
+        cuts = list(accumulate(map(step.__add__, map(len, piece.split(separator))), initial=start - step))
+        cuts[0] = start
+
+        if cuts[1] == start:
+            #The text starts with the separator, there is no empty first piece
+            del cuts[0]
+
+        return cuts
+
+    def _merge(self, cuts:list[int])->Iterator[tuple[int,int,bool]]:
+
+        """TextSplitter._merge_splits on consecutive pieces shorter than chunk_size.
+
+        The pieces of a chunk are contiguous, so its length is an offset difference and both the end
+        of a chunk and the start of the next one (the overlap) are found by bisecting the cuts
+        instead of adding and popping one piece at a time"""
+
+        first = 0
+        last = len(cuts) - 1
+
+        while True:
+            #Pieces are added while the chunk fits, piece end-1 is the one that does not fit
+            end = bisect_right(cuts, cuts[first] + self._chunk_size, first) - 1
+            if end >= last:
+                break
+
+            if end > first:
+                yield cuts[first], cuts[end], True
+
+            #Pop pieces from the front until the rest fits in the overlap and leaves room for the next piece
+            first = max(first,
+                        bisect_left(cuts, cuts[end] - self._chunk_overlap, first, end),
+                        bisect_left(cuts, cuts[end+1] - self._chunk_size, first, end))
+
+        yield cuts[first], cuts[last], True
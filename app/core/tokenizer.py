@@ -0,0 +1,53 @@
+import math
+from collections.abc import Callable
+from functools import lru_cache
+
+import tiktoken
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+#Roughly 4 characters per token for English text, used when the tokenizer can not be loaded
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache
+def get_tokenizer(model_name:str)->tiktoken.Encoding|None:
+
+    """Local tokenizer of an OpenAI model, None when the encoding can not be loaded"""
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning(f"Could not load the tokenizer for {model_name}, token counts are estimated: {e}")
+        return None
+
+def count_tokens(texts:list[str], model_name:str)->int:
+
+    tokenizer = get_tokenizer(model_name)
+
+    if tokenizer is None:
+        return sum(len(text) for text in texts) // CHARS_PER_TOKEN
+
+    return sum(len(tokens) for tokens in tokenizer.encode_ordinary_batch(texts))
+
+def token_length(model_name:str, cache_size:int=65536)->Callable[[str],int]:
+
+    """Token count of a single text, for the length_function of a text splitter.
+    The splitter measures the same pieces again while merging them, so counts are cached"""
+
+    tokenizer = get_tokenizer(model_name)
+
+    if tokenizer is None:
+        def length(text:str)->int:
+            return math.ceil(len(text) / CHARS_PER_TOKEN)
+    else:
+        def length(text:str)->int:
+            return len(tokenizer.encode_ordinary(text))
+
+    return lru_cache(maxsize=cache_size)(length)
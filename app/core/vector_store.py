@@ -1,30 +1,65 @@
+import asyncio
+import json
+import re
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import asdict, dataclass
 from functools import lru_cache
-from typing import Any
-from uuid import uuid4
+from typing import Any, Literal
 
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http.exceptions import UnexpectedResponse
-from qdrant_client.http.models import VectorParams, Distance
-from langchain_qdrant import QdrantVectorStore
+from qdrant_client.http.models import (FieldCondition, Filter, MatchAny, MatchValue, Modifier, PayloadSchemaType,
+                                       PointIdsList, PointStruct, Prefetch, QueryRequest, Range, Rrf, RrfQuery,
+                                       ScoredPoint, SearchParams, SparseVector, SparseVectorParams)
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 
 
 
 
 from app.config import get_settings
 from app.utils.logger import get_logger
-from app.core.embeddings import get_embeddings
+from app.core.answer_cache import get_answer_cache
+from app.core.collection_profiles import get_collection_profile
+from app.core.embedding_cache import hash_text
+from app.core.embeddings import aembed_queries, get_embedding_dimension, get_embeddings
+from app.core.ingestion import UPLOADED_AT_KEY, IngestionPipeline, IngestionStats, point_id
+from app.core.sparse import get_bm25_encoder
 
 logger = get_logger(__name__)
-settings=get_settings()
 
-EMBEDDING_DIMENSION = 1536
+#Qdrant retrieve accepts many ids per call, keep the request size reasonable
+RETRIEVE_BATCH_SIZE = 256
 
+#Payload layout of langchain's QdrantVectorStore, points written by earlier versions stay readable
+CONTENT_PAYLOAD_KEY = "page_content"
+METADATA_PAYLOAD_KEY = "metadata"
+SOURCE_PAYLOAD_KEY = f"{METADATA_PAYLOAD_KEY}.source"
+UPLOADED_AT_PAYLOAD_KEY = f"{METADATA_PAYLOAD_KEY}.{UPLOADED_AT_KEY}"
+#Named sparse vector of the BM25 term weights, the dense vector stays the unnamed default one
+SPARSE_VECTOR_NAME = "bm25"
+#Collection metadata key of the content version, a new random value on every change of the collection
+CONTENT_VERSION_KEY = "content_version"
+#query_points arguments under their QueryRequest names, for batch searches
+QUERY_REQUEST_FIELDS = {'query_filter':'filter', 'search_params':'params'}
+
+SearchMode = Literal['dense','sparse','hybrid']
+
+#Metadata keys a filter may use, they become Qdrant payload keys and SQLite JSON paths
+METADATA_KEY_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*")
+
+MetadataValue = str|int|float|bool
 
 
 @lru_cache
 def get_qdrant_client()-> QdrantClient:
 
+    settings = get_settings()
+
     logger.info(f"Initiating the Qdrant client")
 
     client = QdrantClient(url=settings.qdrant_url,
@@ -34,26 +69,381 @@ def get_qdrant_client()-> QdrantClient:
 
     return client
 
-class VectorStoreService:
+@lru_cache
+def get_async_qdrant_client()-> AsyncQdrantClient:
+
+    settings = get_settings()
+
+    logger.info(f"Initiating the async Qdrant client")
+
+    client = AsyncQdrantClient(url=settings.qdrant_url,
+                               api_key=settings.qdrant_api_key)
+
+    logger.info(f"Completed the initialization for AsyncQdrantClient")
+
+    return client
+
+@dataclass
+class StoredPoint:
+    id:str
+    content:str
+    vector:list[float]|None=None
+
+@dataclass
+class SearchFilter:
+
+    """Scope of a search, every condition that is set has to match.
+    A metadata value matches the key exactly, a list matches any of its values"""
+
+    sources:list[str]|None=None
+    uploaded_after:float|None=None
+    uploaded_before:float|None=None
+    metadata:dict[str,MetadataValue|list[MetadataValue]]|None=None
+
+    def __post_init__(self):
+
+        for key in self.metadata or {}:
+            if not METADATA_KEY_PATTERN.fullmatch(key):
+                raise ValueError(f"Invalid metadata key {key!r} in the search filter")
+
+    def matches(self)->dict[str,list[MetadataValue]]:
+
+        """metadata key -> accepted values, sources included"""
+
+        matches = {key:value if isinstance(value, list) else [value] for key, value in (self.metadata or {}).items()}
+        if self.sources:
+            matches['source'] = list(self.sources)
+
+        return matches
+
+    def key(self)->str:
+
+        """Canonical form, searches with equal filters share cached answers"""
+
+        return json.dumps(asdict(self), sort_keys=True)
+
+@dataclass
+class SearchOptions:
+
+    """Per query search settings, None keeps the defaults of the collection profile"""
+
+    hnsw_ef:int|None=None
+    oversampling:float|None=None
+    filter:SearchFilter|None=None
+    #dense, sparse (BM25 only) or hybrid (both fused by rank), None uses RETRIEVAL_MODE
+    mode:SearchMode|None=None
+    #Found documents carry their dense vector in metadata['_vector'], for the context selection
+    with_vectors:bool=False
+
+
+class ServiceRetriever(BaseRetriever):
+
+    """LangChain retriever over any VectorStoreService"""
+
+    vector_store:Any
+    k:int
+    options:Any=None
+
+    def _get_relevant_documents(self, query:str, *, run_manager:CallbackManagerForRetrieverRun)->list[Document]:
+        return self.vector_store.search(query=query, k=self.k, options=self.options)
+
+    async def _aget_relevant_documents(self, query:str, *, run_manager:AsyncCallbackManagerForRetrieverRun)->list[Document]:
+        return await self.vector_store.asearch(query=query, k=self.k, options=self.options)
+
+
+class VectorStoreService(ABC):
+
+    """Vector store used by the routes, the RAG chain and the ingestion pipeline.
+
+    Ingestion, re-indexing and search are shared, backends implement the storage
+    primitives below. Build one with create_vector_store(), VECTOR_BACKEND picks the backend"""
+
     def __init__(self, collection_name:str|None=None):
 
-        self.collection_name = collection_name or settings.collection_name
+        self.settings = get_settings()
+        self.collection_name = collection_name or self.settings.collection_name
         self.embeddings = get_embeddings()
-        self.client=get_qdrant_client()
 
-        self._ensure_collection()
+    #Storage primitives
+
+    @abstractmethod
+    def health_check(self)->bool: ...
+
+    @abstractmethod
+    def get_collection_info(self)->dict: ...
+
+    @abstractmethod
+    def delete_collection(self)->None: ...
+
+    @abstractmethod
+    def existing_ids(self, ids:list[str])->set[str]: ...
+
+    @abstractmethod
+    def upsert_embedded(self, documents:list[Document], vectors:list[list[float]], ids:list[str])->None: ...
+
+    @abstractmethod
+    def search_by_vector(self, vector:list[float]|None, k:int, options:SearchOptions|None=None,
+                         text:str|None=None)->list[tuple[Document,float]]: ...
+
+    @abstractmethod
+    def _write_content_version(self, version:str)->None: ...
+
+    @abstractmethod
+    async def ahealth_check(self)->bool: ...
+
+    @abstractmethod
+    async def aget_collection_info(self)->dict: ...
+
+    @abstractmethod
+    async def adelete_collection(self)->None: ...
+
+    @abstractmethod
+    async def aexisting_ids(self, ids:list[str])->set[str]: ...
+
+    @abstractmethod
+    async def aupsert_embedded(self, documents:list[Document], vectors:list[list[float]], ids:list[str])->None: ...
+
+    @abstractmethod
+    async def adelete_points(self, ids:list[str])->None: ...
+
+    @abstractmethod
+    async def acontent_version(self)->str|None:
+        """Version of the collection content shared by every process, None for a collection never written to"""
+
+    @abstractmethod
+    async def _awrite_content_version(self, version:str)->None: ...
+
+    @abstractmethod
+    async def asource_points(self, source:str, with_vectors:bool=False)->list[StoredPoint]: ...
+
+    @abstractmethod
+    async def asearch_by_vector(self, vector:list[float]|None, k:int, options:SearchOptions|None=None,
+                                text:str|None=None)->list[tuple[Document,float]]: ...
+
+    @property
+    def supports_sparse(self)->bool:
+        """Whether the stored points have sparse vectors, sparse and hybrid searches fall back to dense otherwise"""
+        return False
+
+    def add_documents(self, documents:list[Document], skip_existing:bool|None=None)->list[str]:
+
+        if not documents:
+            logger.warning(f"No documents to add")
+            return []
+        
+        logger.info(f"Adding the documents to the Vector store collection {self.collection_name}")
+
+        ids = [point_id(doc, position) for position, doc in enumerate(documents)]
+
+        if skip_existing is None:
+            skip_existing = self.settings.ingestion_skip_existing
+
+        new_documents, new_ids = documents, ids
+        if skip_existing:
+            existing = self.existing_ids(ids)
+            new_documents = [doc for doc, doc_id in zip(documents, ids) if doc_id not in existing]
+            new_ids = [doc_id for doc_id in ids if doc_id not in existing]
+            logger.info(f"Skipping {len(existing)} chunks that are already stored")
+
+        if new_documents:
+            uploaded_at = time.time()
+            for doc in new_documents:
+                doc.metadata.setdefault(UPLOADED_AT_KEY, uploaded_at)
+            vectors = self.embeddings.embed_documents([doc.page_content for doc in new_documents])
+            self.upsert_embedded(new_documents, vectors, new_ids)
+            self._invalidate_answers()
+        logger.info(f"Added the documents to the Vector store to the collection name {self.collection_name}")
+
+        return ids
+    
+    def search(self, query:str, k:int|None, options:SearchOptions|None=None)->list[Document]:
+
+        return [doc for doc, _ in self.search_with_score(query=query, k=k, options=options)]
+    
+    def search_with_score(self,query:str, k:int|None, options:SearchOptions|None=None)->list[tuple[Document,float]]:
+
+        k=k or self.settings.retieval_k
+
+        logger.info(f"Searching for {query[:50]}...")
+
+        #A sparse search needs no dense query vector
+        query_vector = None if self.search_mode(options, query) == 'sparse' else self.embeddings.embed_query(query)
+
+        result = self.search_by_vector(query_vector, k=k, options=options, text=query)
+
+        logger.info(f"Found {len(result)} result")
+
+        return result
+    
+    def get_retriever(self, k:int|None=None, options:SearchOptions|None=None) -> Any:
+
+        k=k or self.settings.retieval_k
+
+        logger.info(f"Vector store as retriever..")
+
+        return ServiceRetriever(vector_store=self, k=k, options=options)
+
+    async def aadd_documents(self, documents:list[Document], skip_existing:bool|None=None)->list[str]:
+
+        ids, _ = await self.aingest_documents(documents, skip_existing=skip_existing)
+        return ids
+
+    async def aingest_documents(self, documents:Iterable[Document],
+                                skip_existing:bool|None=None,
+                                on_progress:Callable[[IngestionStats],Awaitable[None]]|None=None)->tuple[list[str],IngestionStats]:
+
+        """aadd_documents through the batched IngestionPipeline, also returning its throughput stats.
+        documents can be a lazy iterator of chunks, it is consumed one batch at a time.
+        With skip_existing, chunks whose point id is already stored are not embedded again"""
+
+        logger.info(f"Adding the documents to the Vector store collection {self.collection_name}")
+
+        if skip_existing is None:
+            skip_existing = self.settings.ingestion_skip_existing
+
+        ids, stats = await IngestionPipeline(self, skip_existing=skip_existing, on_progress=on_progress).arun(documents)
+
+        if not stats.created:
+            logger.warning(f"No documents to add")
+
+        if stats.chunks:
+            await self._ainvalidate_answers()
+        logger.info(f"Added the documents to the Vector store to the collection name {self.collection_name}")
+
+        return ids, stats
+
+    async def areindex_source(self, source:str, documents:Iterable[Document],
+                              on_progress:Callable[[IngestionStats],Awaitable[None]]|None=None)->tuple[list[str],IngestionStats]:
+
+        """Incremental update of one source to a new version of its chunks.
+
+        Chunks whose point id is stored already are left alone, chunks whose content is
+        stored under another position reuse the stored vector, only new content is embedded.
+        Stored points of the source that are not part of the new version are deleted"""
+
+        logger.info(f"Re-indexing the source {source} in the collection {self.collection_name}")
+
+        stored = await self.asource_points(source, with_vectors=True)
+        known_vectors = {hash_text(point.content):point.vector for point in stored}
+
+        ids, stats = await IngestionPipeline(self, skip_existing=True, known_vectors=known_vectors,
+                                             on_progress=on_progress).arun(documents)
+
+        if not stats.created:
+            #An empty new version is far more likely a parsing failure than a deleted document
+            logger.warning(f"No chunks for {source}, its stored chunks are kept")
+            return ids, stats
+
+        removed = sorted({point.id for point in stored} - set(ids))
+        await self.adelete_points(removed)
+        stats.deleted = len(removed)
+
+        if stats.chunks:
+            await self._ainvalidate_answers()
+        logger.info(f"Re-indexed {source}: {stats.skipped} unchanged, {stats.reused} moved, "
+                    f"{stats.embedded} embedded, {stats.deleted} deleted")
+
+        return ids, stats
+
+    async def asearch(self, query:str, k:int|None=None, options:SearchOptions|None=None)->list[Document]:
+
+        return [doc for doc, _ in await self.asearch_with_score(query=query, k=k, options=options)]
+
+    async def asearch_with_score(self, query:str, k:int|None=None,
+                                 options:SearchOptions|None=None)->list[tuple[Document,float]]:
+
+        k=k or self.settings.retieval_k
+
+        logger.info(f"Searching for {query[:50]}...")
+
+        query_vector = None
+        if self.search_mode(options, query) != 'sparse':
+            query_vector = await self.embeddings.aembed_query(query)
+
+        result = await self.asearch_by_vector(query_vector, k=k, options=options, text=query)
+
+        logger.info(f"Found {len(result)} result")
+
+        return result
+
+    async def asearch_batch_with_score(self, queries:list[str], k:int|None=None,
+                                       options:list[SearchOptions|None]|None=None)->list[list[tuple[Document,float]]]:
+
+        """asearch_with_score of many queries, in order. The query vectors come from one
+        embedding request and the searches go to the backend as one batch"""
+
+        k=k or self.settings.retieval_k
+        options = options or [None] * len(queries)
+
+        logger.info(f"Searching for a batch of {len(queries)} queries")
+
+        vectors:list[list[float]|None] = [None] * len(queries)
+        dense = [i for i, (query, query_options) in enumerate(zip(queries, options))
+                 if self.search_mode(query_options, query) != 'sparse']
+
+        if dense:
+            for i, vector in zip(dense, await aembed_queries(self.embeddings, [queries[i] for i in dense])):
+                vectors[i] = vector
+
+        return await self.asearch_batch_by_vector(vectors, k=k, options=options, texts=queries)
 
+    async def asearch_batch_by_vector(self, vectors:list[list[float]|None], k:int,
+                                      options:list[SearchOptions|None], texts:list[str])->list[list[tuple[Document,float]]]:
 
-        """We need collection to be present before creating the vector store 
+        #Backends without a batch request run the searches concurrently
+        return list(await asyncio.gather(*(self.asearch_by_vector(vector, k=k, options=query_options, text=text)
+                                           for vector, query_options, text in zip(vectors, options, texts))))
+
+    def search_mode(self, options:SearchOptions|None, text:str|None)->SearchMode:
+
+        mode = (options.mode if options is not None else None) or self.settings.retrieval_mode
+
+        if mode != 'dense' and (text is None or not self.supports_sparse):
+            #Searches by vector only, or a collection created before sparse vectors were stored
+            return 'dense'
+
+        return mode
+
+    def _invalidate_answers(self, shared:bool=True)->None:
+
+        """Drops the cached answers of the collection, they may no longer match its content.
+        shared gives the collection a new content version, the answer caches of other processes
+        (workers, the ingest CLI) drop theirs on their next query. It is written even with the
+        answer cache off here, a deleted collection has none"""
+
+        if shared:
+            self._write_content_version(uuid.uuid4().hex)
+        if self.settings.answer_cache_enabled:
+            get_answer_cache().invalidate(self.collection_name)
+
+    async def _ainvalidate_answers(self)->None:
+
+        await self._awrite_content_version(uuid.uuid4().hex)
+        if self.settings.answer_cache_enabled:
+            get_answer_cache().invalidate(self.collection_name)
+
+
+class QdrantVectorStoreService(VectorStoreService):
+
+    """Qdrant backend, sync calls go through QdrantClient and async ones through AsyncQdrantClient"""
+
+    def __init__(self, collection_name:str|None=None):
+
+        super().__init__(collection_name)
+        self.profile = get_collection_profile()
+        self.client=get_qdrant_client()
+        self.async_client=get_async_qdrant_client()
+        #Payload fields with an index, filters on other fields check the points one by one
+        self._indexed_fields:set[str] = set()
+        #Collections created before sparse vectors were stored have none and are searched dense only
+        self._sparse = False
+
+        """We need collection to be present before it is used 
          so we included the _ensure_collection() as internal method to make sure 
          the given collection exists or create one"""
 
-        self.vector_store = QdrantVectorStore(
-            client=self.client,
-            embedding=self.embeddings,
-            collection_name=self.collection_name,
+        self._ensure_collection()
 
-            )
         logger.info(f"Initialised the Vector Store")
 
 
@@ -66,17 +456,26 @@ class VectorStoreService:
             logger.info(f"Collection {self.collection_name} is available "
                         f" with {collection_info.points_count} counts")
         except UnexpectedResponse:
-            logger.info(f"Creating the collection {self.collection_name}")
-
-            self.client.create_collection(collection_name=self.collection_name,
-                                          vectors_config=VectorParams(
-                                              size=EMBEDDING_DIMENSION,
-                                              distance=Distance.COSINE
-                                          )
-                                                                               
-            )
+            collection_info = None
+
+        if collection_info is not None:
+            #A collection created for another model or EMBEDDING_DIMENSIONS would fail on every upsert and search
+            size = getattr(collection_info.config.params.vectors, 'size', None)
+            if size is not None and size != get_embedding_dimension():
+                raise ValueError(f"The collection {self.collection_name} stores {size} dimensional vectors but the "
+                                 f"embeddings have {get_embedding_dimension()} dimensions, use another collection "
+                                 f"or delete this one")
+            self._indexed_fields.update(collection_info.payload_schema or {})
+            self._sparse = SPARSE_VECTOR_NAME in (collection_info.config.params.sparse_vectors or {})
+        else:
+            logger.info(f"Creating the collection {self.collection_name} with the {self.profile.name} profile")
+
+            self.client.create_collection(collection_name=self.collection_name, **self._create_options())
+            self._sparse = self.settings.sparse_vectors_enabled
 
             logger.info(f"Collection {self.collection_name} is created")
+
+        self._create_payload_indexes(self._missing_payload_indexes())
     
     def health_check(self)->bool:
 
@@ -108,54 +507,311 @@ class VectorStoreService:
     def delete_collection(self)->None:
         logger.warning(f"Deleting the collection {self.collection_name}")
         self.client.delete_collection(self.collection_name)
+        self._indexed_fields.clear()
+        self._invalidate_answers(shared=False)
         logger.info(f"The collection {self.collection_name} is deleted")
 
+    def _write_content_version(self, version:str)->None:
 
-    def add_documents(self, documents:list[Document])->list[str]:
+        try:
+            self.client.update_collection(collection_name=self.collection_name, metadata={CONTENT_VERSION_KEY:version})
+        except Exception as e:
+            logger.warning(f"Could not store the content version of {self.collection_name}, "
+                           f"answers cached by other processes are kept until they expire: {e}")
 
-        if not documents:
-            logger.warning(f"No documents to add")
-            return []
-        
-        logger.info(f"Adding the documents to the Vector store collection {self.collection_name}")
 
-        ids = [str(uuid4()) for _ in documents]
+    def existing_ids(self, ids:list[str])->set[str]:
 
-        self.vector_store.add_documents(documents=documents, ids=ids)
-        logger.info(f"Added the documents to the Vector store to the collection name {self.collection_name}")
+        existing = set()
 
-        return ids
-    
-    def search(self, query:str, k:int|None)->list[Document]:
+        for start in range(0, len(ids), RETRIEVE_BATCH_SIZE):
+            points = self.client.retrieve(collection_name=self.collection_name,
+                                          ids=ids[start:start+RETRIEVE_BATCH_SIZE],
+                                          with_payload=False,
+                                          with_vectors=False)
+            existing.update(str(point.id) for point in points)
 
-        k=k or settings.retieval_k
+        return existing
 
-        logger.info(f"Searching for {query[:50]}...")
+    #Async path: talks to Qdrant through AsyncQdrantClient so routes never block the event loop
+
+    async def ahealth_check(self)->bool:
 
-        retrived_docs = self.vector_store.search(query=query, k=k)
+        try:
+            await self.async_client.get_collections()
+            return True
+        except Exception as e:
+            logger.error(f"Vector store health check has failed with {e}")
+            return False
 
-        logger.info(f"Found {len(retrived_docs)} chunks in result ")
+    async def aget_collection_info(self)->dict:
 
-        return retrived_docs
-    
-    def search_with_score(self,query:str, k:int|None)->list[tuple[Document,float]]:
+        try:
+            collection_info = await self.async_client.get_collection(self.collection_name)
+            return {
+                'Collection_Name':self.collection_name,
+                'points_count':collection_info.points_count,
+                'Indexed Points Count':collection_info.indexed_vectors_count,
+                'status':collection_info.status
+            }
+        except UnexpectedResponse:
+            return {
+                'Collection_Name':self.collection_name,
+                'points_count':0,
+                'Indexed Points Count':0,
+                'status':'Not Found'
+            }
 
-        k=k or settings.retieval_k
+    async def adelete_collection(self)->None:
+        logger.warning(f"Deleting the collection {self.collection_name}")
+        await self.async_client.delete_collection(self.collection_name)
+        self._indexed_fields.clear()
+        self._invalidate_answers(shared=False)
+        logger.info(f"The collection {self.collection_name} is deleted")
 
-        logger.info(f"Searching for {query[:50]}...")
+    def upsert_embedded(self, documents:list[Document], vectors:list[list[float]], ids:list[str])->None:
 
-        result = self.vector_store.similarity_search_with_score(query=query, k=k)
+        self.client.upsert(collection_name=self.collection_name,
+                           points=self._to_points(documents, vectors, ids))
 
-        logger.info(f"Found {len(result)} result")
+    @property
+    def supports_sparse(self)->bool:
+        return self._sparse
 
-        return result
-    
-    def get_retriever(self, k:int|None=None) -> Any:
+    def search_by_vector(self, vector:list[float]|None, k:int, options:SearchOptions|None=None,
+                         text:str|None=None)->list[tuple[Document,float]]:
 
-        k=k or settings.retieval_k
+        response = self.client.query_points(collection_name=self.collection_name,
+                                            with_payload=True,
+                                            with_vectors=options is not None and options.with_vectors,
+                                            **self._query(vector, k, options, text))
 
-        logger.info(f"Vector store as retriever..")
+        return [(self._to_document(point), point.score) for point in response.points]
+
+    async def asearch_by_vector(self, vector:list[float]|None, k:int, options:SearchOptions|None=None,
+                                text:str|None=None)->list[tuple[Document,float]]:
+
+        response = await self.async_client.query_points(collection_name=self.collection_name,
+                                                        with_payload=True,
+                                                        with_vectors=options is not None and options.with_vectors,
+                                                        **self._query(vector, k, options, text))
+
+        return [(self._to_document(point), point.score) for point in response.points]
+
+    async def asearch_batch_by_vector(self, vectors:list[list[float]|None], k:int,
+                                      options:list[SearchOptions|None], texts:list[str])->list[list[tuple[Document,float]]]:
+
+        requests = [QueryRequest(with_payload=True,
+                                 with_vector=query_options is not None and query_options.with_vectors,
+                                 **{QUERY_REQUEST_FIELDS.get(key, key):value
+                                    for key, value in self._query(vector, k, query_options, text).items()})
+                    for vector, query_options, text in zip(vectors, options, texts)]
+
+        responses = await self.async_client.query_batch_points(collection_name=self.collection_name, requests=requests)
+
+        return [[(self._to_document(point), point.score) for point in response.points] for response in responses]
+
+    async def asource_points(self, source:str, with_vectors:bool=False)->list[StoredPoint]:
+
+        points:list[StoredPoint] = []
+        offset = None
+
+        while True:
+            records, offset = await self.async_client.scroll(collection_name=self.collection_name,
+                                                             scroll_filter=Filter(must=[
+                                                                 FieldCondition(key=SOURCE_PAYLOAD_KEY, match=MatchValue(value=source))
+                                                             ]),
+                                                             limit=RETRIEVE_BATCH_SIZE,
+                                                             offset=offset,
+                                                             with_payload=[CONTENT_PAYLOAD_KEY],
+                                                             with_vectors=with_vectors)
+            points.extend(StoredPoint(id=str(record.id),
+                                      content=record.payload[CONTENT_PAYLOAD_KEY],
+                                      vector=_dense_vector(record.vector) if with_vectors else None)
+                          for record in records)
+
+            if offset is None:
+                return points
+
+    async def aexisting_ids(self, ids:list[str])->set[str]:
+
+        existing = set()
+
+        for start in range(0, len(ids), RETRIEVE_BATCH_SIZE):
+            points = await self.async_client.retrieve(collection_name=self.collection_name,
+                                                      ids=ids[start:start+RETRIEVE_BATCH_SIZE],
+                                                      with_payload=False,
+                                                      with_vectors=False)
+            existing.update(str(point.id) for point in points)
+
+        return existing
+
+    async def adelete_points(self, ids:list[str])->None:
+
+        if not ids:
+            return
+
+        await self.async_client.delete(collection_name=self.collection_name,
+                                       points_selector=PointIdsList(points=ids))
+        await self._ainvalidate_answers()
+
+        logger.info(f"Deleted {len(ids)} points from the collection {self.collection_name}")
+
+    async def acontent_version(self)->str|None:
+
+        try:
+            collection_info = await self.async_client.get_collection(self.collection_name)
+        except UnexpectedResponse:
+            return None
+
+        return (collection_info.config.metadata or {}).get(CONTENT_VERSION_KEY)
+
+    async def _awrite_content_version(self, version:str)->None:
+
+        try:
+            await self.async_client.update_collection(collection_name=self.collection_name,
+                                                      metadata={CONTENT_VERSION_KEY:version})
+        except Exception as e:
+            #Qdrant before 1.16 has no collection metadata
+            logger.warning(f"Could not store the content version of {self.collection_name}, "
+                           f"answers cached by other processes are kept until they expire: {e}")
+
+    async def aupsert_embedded(self, documents:list[Document], vectors:list[list[float]], ids:list[str])->None:
+
+        await self.async_client.upsert(collection_name=self.collection_name,
+                                       points=self._to_points(documents, vectors, ids))
+
+    def _create_options(self)->dict:
+
+        options = self.profile.create_options(get_embedding_dimension())
+
+        if self.settings.sparse_vectors_enabled:
+            #Qdrant applies the BM25 idf of the collection to the stored term weights at search time
+            options['sparse_vectors_config'] = {SPARSE_VECTOR_NAME:SparseVectorParams(modifier=Modifier.IDF)}
+
+        return options
+
+    def _query(self, vector:list[float]|None, k:int, options:SearchOptions|None, text:str|None)->dict:
+
+        """query_points arguments of a dense, sparse or hybrid search"""
+
+        mode = self.search_mode(options, text)
+        query_filter = self._to_filter(options)
+        search_params = self._search_params(options)
+
+        if mode == 'dense':
+            return {'query':vector, 'query_filter':query_filter, 'search_params':search_params, 'limit':k}
+
+        encoded = get_bm25_encoder().encode_query(text)
+        sparse = SparseVector(indices=encoded.indices, values=encoded.values)
+
+        if mode == 'sparse':
+            return {'query':sparse, 'using':SPARSE_VECTOR_NAME, 'query_filter':query_filter, 'limit':k}
+
+        #Both candidate lists are fused by reciprocal rank in the same request
+        candidates = max(k, self.settings.hybrid_candidates)
+
+        return {
+            'prefetch':[Prefetch(query=vector, filter=query_filter, params=search_params, limit=candidates),
+                        Prefetch(query=sparse, using=SPARSE_VECTOR_NAME, filter=query_filter, limit=candidates)],
+            'query':RrfQuery(rrf=Rrf(k=self.settings.rrf_k)),
+            'query_filter':query_filter,
+            'limit':k,
+        }
+
+    def _missing_payload_indexes(self)->dict[str,PayloadSchemaType]:
+
+        """Payload indexes to create: the source (per source lookups of re-indexing), the upload time
+        and PAYLOAD_INDEX_FIELDS. Without an index Qdrant checks the filter point by point, with one
+        a small slice of the collection is searched as fast as a small collection"""
+
+        indexes = {SOURCE_PAYLOAD_KEY:PayloadSchemaType.KEYWORD,
+                   UPLOADED_AT_PAYLOAD_KEY:PayloadSchemaType.FLOAT}
+        indexes.update({f"{METADATA_PAYLOAD_KEY}.{field}":PayloadSchemaType.KEYWORD
+                        for field in self.settings.payload_index_fields})
+
+        return {field:schema for field, schema in indexes.items() if field not in self._indexed_fields}
+
+    def _create_payload_indexes(self, indexes:dict[str,PayloadSchemaType])->None:
+
+        for field, schema in indexes.items():
+            logger.info(f"Creating the {schema.value} payload index on {field} in {self.collection_name}")
+            self.client.create_payload_index(collection_name=self.collection_name,
+                                             field_name=field,
+                                             field_schema=schema,
+                                             wait=True)
+            self._indexed_fields.add(field)
+
+    def _to_filter(self, options:SearchOptions|None)->Filter|None:
+
+        if options is None or options.filter is None:
+            return None
+
+        search_filter = options.filter
+        conditions = []
+
+        for key, values in search_filter.matches().items():
+            field = f"{METADATA_PAYLOAD_KEY}.{key}"
+            if len(values) == 1:
+                conditions.append(FieldCondition(key=field, match=MatchValue(value=values[0])))
+            elif all(isinstance(value, (str, int)) and not isinstance(value, bool) for value in values):
+                conditions.append(FieldCondition(key=field, match=MatchAny(any=values)))
+            else:
+                conditions.append(Filter(should=[FieldCondition(key=field, match=MatchValue(value=value)) for value in values]))
+
+        if search_filter.uploaded_after is not None or search_filter.uploaded_before is not None:
+            conditions.append(FieldCondition(key=UPLOADED_AT_PAYLOAD_KEY,
+                                             range=Range(gte=search_filter.uploaded_after,
+                                                         lte=search_filter.uploaded_before)))
+
+        return Filter(must=conditions) if conditions else None
+
+    def _search_params(self, options:SearchOptions|None)->SearchParams|None:
+
+        options = options or SearchOptions()
+
+        return self.profile.search_params(hnsw_ef=options.hnsw_ef, oversampling=options.oversampling)
+
+    def _to_points(self, documents:list[Document], vectors:list[list[float]], ids:list[str])->list[PointStruct]:
+
+        point_vectors:list[Any] = vectors
+        if self._sparse:
+            sparse = get_bm25_encoder().encode_documents([doc.page_content for doc in documents])
+            point_vectors = [{'':vector, SPARSE_VECTOR_NAME:SparseVector(indices=encoded.indices, values=encoded.values)}
+                             for vector, encoded in zip(vectors, sparse)]
+
+        return [PointStruct(id=point_id,
+                            vector=vector,
+                            payload={
+                                CONTENT_PAYLOAD_KEY:doc.page_content,
+                                METADATA_PAYLOAD_KEY:doc.metadata
+                            })
+                for doc, vector, point_id in zip(documents, point_vectors, ids)]
+
+    def _to_document(self, point:ScoredPoint)->Document:
+
+        payload = point.payload or {}
+        metadata = dict(payload.get(METADATA_PAYLOAD_KEY) or {})
+        metadata['_id'] = point.id
+        metadata['_collection_name'] = self.collection_name
+        if point.vector is not None:
+            metadata['_vector'] = _dense_vector(point.vector)
+
+        return Document(page_content=payload.get(CONTENT_PAYLOAD_KEY, ""), metadata=metadata)
+
+
+def _dense_vector(vector:Any)->list[float]|None:
+
+    #Points with a sparse vector come back as {'':dense, 'bm25':sparse}
+    return vector.get('') if isinstance(vector, dict) else vector
+
+def create_vector_store(collection_name:str|None=None)->VectorStoreService:
+
+    settings = get_settings()
+
+    if settings.vector_backend == 'local':
+        #Imported here, the local backend imports this module
+        from app.core.local_vector_store import LocalVectorStoreService
+        return LocalVectorStoreService(collection_name=collection_name)
 
-        return self.vector_store.as_retriever(search_type='similarity',
-                                              search_kwargs={"k":k})
-            
\ No newline at end of file
+    return QdrantVectorStoreService(collection_name=collection_name)
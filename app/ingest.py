@@ -0,0 +1,321 @@
+"""Bulk ingestion of a directory tree into the vector store.
+
+    python -m app.ingest ./data --collection rag_documents
+
+Files are parsed and split with DocumentProcessor.process_file in the parser process pool,
+one file per task. PDFs longer than PDF_PAGES_PER_TASK pages are parsed after the other files
+from this process instead, so their page ranges are spread over the pool. The chunks are
+embedded and upserted in batches by the IngestionPipeline. Every finished file is
+recorded in a checkpoint manifest (path, mtime, size, content hash, point ids), so an
+interrupted run resumes where it stopped and unchanged files are skipped on the next run."""
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from langchain_core.documents import Document
+
+from app.config import get_settings
+from app.core.document_processor import DocumentProcessor
+from app.core.ingestion import IngestionStats
+from app.core.parsing import pdf_page_ranges, run_in_order, shutdown_parser_pool
+from app.core.registry import ServiceRegistry
+from app.utils.logger import get_logger, set_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_MANIFEST_PATH = ".cache/ingest_manifest.sqlite3"
+#Chunks of several files are embedded together, the manifest is updated once per group
+DEFAULT_GROUP_CHUNKS = 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(file_path:Path)->str:
+
+    digest = hashlib.sha256()
+
+    with open(file_path, "rb") as f:
+        while block := f.read(HASH_CHUNK_SIZE):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def _process_file(file_path:str)->tuple[list[Document],str|None]:
+
+    #Runs in a parser pool process, errors are returned so one bad file does not stop the run
+    try:
+        return DocumentProcessor().process_file(file_path), None
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}"
+
+def _is_large_pdf(file_path:Path)->bool:
+
+    #Inside a pool process a PDF is parsed inline, one with several page ranges is parsed from the parent
+    if file_path.suffix.lower() != ".pdf":
+        return False
+
+    try:
+        return len(pdf_page_ranges(file_path)) > 1
+    except Exception:
+        #The pool task reports the error of an unreadable file
+        return False
+
+
+class IngestManifest:
+
+    """SQLite checkpoint of the files that are fully ingested into a collection"""
+
+    def __init__(self, path:str|Path, collection_name:str):
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.collection_name = collection_name
+
+        #Used from the thread that pulls the next parsed file, never from two threads at once
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                collection TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                point_ids TEXT NOT NULL,
+                ingested_at REAL NOT NULL,
+                PRIMARY KEY (collection, path)
+            )""")
+        self._conn.commit()
+
+    def get(self, path:str)->dict|None:
+
+        row = self._conn.execute("SELECT * FROM files WHERE collection = ? AND path = ?",
+                                 (self.collection_name, path)).fetchone()
+
+        if row is None:
+            return None
+
+        entry = dict(row)
+        entry['point_ids'] = json.loads(entry['point_ids'])
+
+        return entry
+
+    def record(self, path:str, mtime:float, size:int, content_hash:str, point_ids:list[str])->None:
+
+        self._conn.execute("INSERT OR REPLACE INTO files (collection, path, mtime, size, content_hash, point_ids, ingested_at) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (self.collection_name, path, mtime, size, content_hash, json.dumps(point_ids), time.time()))
+        self._conn.commit()
+
+    def touch(self, path:str, mtime:float, size:int)->None:
+
+        """The file was rewritten with the same content, only its mtime changed"""
+
+        self._conn.execute("UPDATE files SET mtime = ?, size = ? WHERE collection = ? AND path = ?",
+                           (mtime, size, self.collection_name, path))
+        self._conn.commit()
+
+    def close(self)->None:
+        self._conn.close()
+
+
+@dataclass
+class _QueuedFile:
+    path:Path
+    mtime:float
+    size:int
+    content_hash:str
+
+
+@dataclass
+class IngestReport:
+    files:int=0
+    unchanged:int=0
+    ingested:int=0
+    failed:int=0
+    parse_wait_seconds:float=0.0
+    total_seconds:float=0.0
+    stats:IngestionStats=field(default_factory=IngestionStats)
+
+    def summary(self)->str:
+
+        seconds = self.total_seconds or 1e-9
+
+        return "\n".join([
+            f"Files     : {self.files} found, {self.ingested} ingested, {self.unchanged} unchanged, {self.failed} failed",
+            f"Chunks    : {self.stats.created} created, {self.stats.embedded} embedded, {self.stats.skipped} already stored",
+            f"Tokens    : {self.stats.tokens} embedded",
+            f"Time      : {self.total_seconds:.2f}s total, {self.parse_wait_seconds:.2f}s waiting on parsing, "
+            f"{self.stats.embed_seconds:.2f}s embedding, {self.stats.upsert_seconds:.2f}s upserting (summed over batches)",
+            f"Throughput: {self.ingested/seconds:.2f} files/s, {self.stats.created/seconds:.1f} chunks/s, "
+            f"{self.stats.tokens/seconds:.1f} tokens/s",
+        ])
+
+
+async def ingest_directory(directory:str|Path,
+                           collection_name:str|None=None,
+                           manifest_path:str|Path=DEFAULT_MANIFEST_PATH,
+                           force:bool=False,
+                           skip_existing:bool|None=None,
+                           group_chunks:int=DEFAULT_GROUP_CHUNKS)->IngestReport:
+
+    start_time = time.perf_counter()
+    report = IngestReport()
+
+    registry = ServiceRegistry()
+    vector_store = await registry.aget_vector_store(collection_name)
+    manifest = IngestManifest(manifest_path, vector_store.collection_name)
+
+    files = sorted(path for path in Path(directory).rglob("*")
+                   if path.is_file() and path.suffix.lower() in DocumentProcessor.SUPPORTED_EXTENSIONS)
+    report.files = len(files)
+
+    logger.info(f"Found {len(files)} files in {directory} for the collection {vector_store.collection_name}")
+
+    queued:deque[_QueuedFile] = deque()
+    large_pdfs:list[_QueuedFile] = []
+
+    def tasks():
+        #Pulled lazily by run_in_order, so hashing overlaps the parsing of earlier files
+        for path in files:
+            stat = path.stat()
+            entry = None if force else manifest.get(str(path))
+
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                report.unchanged += 1
+                continue
+
+            content_hash = file_hash(path)
+            if entry and entry['content_hash'] == content_hash:
+                manifest.touch(str(path), stat.st_mtime, stat.st_size)
+                report.unchanged += 1
+                continue
+
+            queued_file = _QueuedFile(path=path, mtime=stat.st_mtime, size=stat.st_size, content_hash=content_hash)
+            if _is_large_pdf(path):
+                large_pdfs.append(queued_file)
+                continue
+
+            queued.append(queued_file)
+            yield (str(path),)
+
+    async def flush(group:list[tuple[_QueuedFile,list[Document]]]):
+
+        chunks = [chunk for _, file_chunks in group for chunk in file_chunks]
+        ids:list[str] = []
+
+        if chunks:
+            ids, stats = await vector_store.aingest_documents(chunks, skip_existing=skip_existing)
+            report.stats.merge(stats)
+
+        offset = 0
+        for queued_file, file_chunks in group:
+            file_ids = ids[offset:offset+len(file_chunks)]
+            offset += len(file_chunks)
+
+            #Chunks of an earlier version of the file that are gone now
+            previous = manifest.get(str(queued_file.path))
+            if previous:
+                await vector_store.adelete_points(sorted(set(previous['point_ids']) - set(file_ids)))
+
+            manifest.record(str(queued_file.path), queued_file.mtime, queued_file.size,
+                            queued_file.content_hash, file_ids)
+            report.ingested += 1
+
+        logger.info(f"Checkpoint: {report.ingested} files ingested, {report.failed} failed, {report.unchanged} unchanged")
+
+    group:list[tuple[_QueuedFile,list[Document]]] = []
+    group_size = 0
+
+    async def add(queued_file:_QueuedFile, result:tuple[list[Document],str|None]):
+        nonlocal group, group_size
+
+        file_chunks, error = result
+
+        if error is not None:
+            report.failed += 1
+            logger.error(f"Could not process {queued_file.path}: {error}")
+            return
+
+        group.append((queued_file, file_chunks))
+        group_size += len(file_chunks)
+
+        if group_size >= group_chunks:
+            await flush(group)
+            group, group_size = [], 0
+
+    results = run_in_order(_process_file, tasks())
+
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            result = await asyncio.to_thread(next, results, None)
+            report.parse_wait_seconds += time.perf_counter() - wait_start
+
+            if result is None:
+                break
+
+            await add(queued.popleft(), result)
+
+        #Parsed from this process, iter_pdf_pages spreads their page ranges over the pool
+        for queued_file in large_pdfs:
+            wait_start = time.perf_counter()
+            result = await asyncio.to_thread(_process_file, str(queued_file.path))
+            report.parse_wait_seconds += time.perf_counter() - wait_start
+
+            await add(queued_file, result)
+
+        if group:
+            await flush(group)
+    finally:
+        results.close()
+        manifest.close()
+        await registry.aclose()
+
+    report.total_seconds = time.perf_counter() - start_time
+
+    return report
+
+
+def main(argv:list[str]|None=None)->None:
+
+    parser = argparse.ArgumentParser(prog="python -m app.ingest",
+                                     description="Bulk ingest a directory tree into the vector store")
+    parser.add_argument("directory", help="Directory to walk for .pdf, .txt and .csv files")
+    parser.add_argument("--collection", default=None, help="Collection name, defaults to COLLECTION_NAME")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, help="Checkpoint manifest path")
+    parser.add_argument("--force", action="store_true", help="Ingest every file again, ignoring the manifest")
+    parser.add_argument("--no-skip-existing", action="store_true",
+                        help="Embed chunks again even when their point id is already stored")
+    parser.add_argument("--group-chunks", type=int, default=DEFAULT_GROUP_CHUNKS,
+                        help="Chunks embedded together before the manifest is checkpointed")
+    args = parser.parse_args(argv)
+
+    set_logger(log_level=get_settings().log_level)
+
+    try:
+        report = asyncio.run(ingest_directory(args.directory,
+                                              collection_name=args.collection,
+                                              manifest_path=args.manifest,
+                                              force=args.force,
+                                              skip_existing=False if args.no_skip_existing else None,
+                                              group_chunks=args.group_chunks))
+    finally:
+        shutdown_parser_pool()
+
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
-from dotenv import load_dotenv
+import os
 
+from dotenv import dotenv_values, load_dotenv
+
+#Variables of the process environment win over .env, on start and on reload
+ENVIRONMENT_KEYS = set(os.environ)
 load_dotenv()
 
+import asyncio
+import signal
 from contextlib import asynccontextmanager 
 
 from fastapi import FastAPI, Request
@@ -11,7 +17,11 @@ from fastapi.staticfiles import StaticFiles
 
 from app import __version__
 from app.config import get_settings
+from app.api.middleware import UploadSizeLimitMiddleware
 from app.api.routes import health, query, documents
+from app.core.jobs import IngestionJobQueue
+from app.core.parsing import shutdown_parser_pool
+from app.core.registry import ServiceRegistry
 from app.utils.logger import get_logger, set_logger
 
 settings = get_settings()
@@ -25,8 +35,52 @@ async def lifespan(app:FastAPI):
     logger.info(f"Starting the application {settings.app_name} v{__version__}"
                 f"Log Level : {settings.log_level}")
     
+    registry = ServiceRegistry()
+    app.state.registry = registry
+
+    try:
+        await asyncio.to_thread(registry.warm_up)
+    except Exception as e:
+        logger.warning(f"Could not warm up the services, they will be built on first use: {e}")
+
+    job_queue = IngestionJobQueue(registry)
+    app.state.job_queue = job_queue
+    await job_queue.start()
+
+    #kill -HUP re-reads the settings (.env and environment) and rebuilds the services
+    reloads:set[asyncio.Task] = set()
+
+    def on_sighup():
+        for key, value in dotenv_values().items():
+            if key not in ENVIRONMENT_KEYS and value is not None:
+                os.environ[key] = value
+        task = asyncio.create_task(registry.areload())
+        reloads.add(task)
+        task.add_done_callback(reloaded)
+
+    def reloaded(task:asyncio.Task):
+        reloads.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Reloading the settings failed: {task.exception()}")
+
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, on_sighup)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        #No SIGHUP on Windows, no signal handlers outside the main thread
+        logger.info(f"Settings reload on SIGHUP is not available")
+
     yield
 
+    try:
+        loop.remove_signal_handler(signal.SIGHUP)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        pass
+
+    await job_queue.stop()
+    await registry.aclose()
+    shutdown_parser_pool()
+
     logger.info(f"Shutting down the application")
 
 app=FastAPI(title=settings.app_name,
@@ -57,6 +111,8 @@ openapi_url="/openapi.json",
 lifespan=lifespan,
 )
 
+#The last added middleware runs first, CORS stays outermost so a 413 reaches browsers with its CORS headers
+app.add_middleware(UploadSizeLimitMiddleware)
 app.add_middleware(CORSMiddleware,
                    allow_origins=["*"],
                    allow_credentials=True,
@@ -0,0 +1,74 @@
+"""Throughput of POST /query/batch against one POST /query per question.
+
+    python -m benchmarks.bench_batch_query --url http://localhost:8000 --questions data/questions.txt
+    python -m benchmarks.bench_batch_query --questions data/questions.txt --concurrency 8 --batch-size 100
+
+Needs the API running with documents uploaded, every line of --questions is a question.
+The questions are sent one request at a time (--concurrency of them in flight), then in
+batches of --batch-size. Both runs call the LLM for every question, so it costs tokens twice.
+Answers are not served from the answer cache in a batch, disable it for a fair comparison."""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def single(client:httpx.AsyncClient, questions:list[str], concurrency:int)->tuple[float,int]:
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def ask(question:str)->bool:
+        async with semaphore:
+            response = await client.post("/query", json={"question":question, "include_source":False})
+            return response.status_code == 200
+
+    start = time.perf_counter()
+    answered = await asyncio.gather(*(ask(question) for question in questions))
+
+    return time.perf_counter() - start, sum(answered)
+
+async def batched(client:httpx.AsyncClient, questions:list[str], batch_size:int)->tuple[float,int]:
+
+    answered = 0
+    start = time.perf_counter()
+
+    for offset in range(0, len(questions), batch_size):
+        response = await client.post("/query/batch", json={"questions":[{"question":question, "include_source":False}
+                                                                         for question in questions[offset:offset+batch_size]]})
+        response.raise_for_status()
+        answered += response.json()["succeeded"]
+
+    return time.perf_counter() - start, answered
+
+async def run(args:argparse.Namespace)->None:
+
+    with open(args.questions, encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()][:args.limit]
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=600) as client:
+        print(f"{len(questions)} questions")
+        print(f"{'requests':<22}{'seconds':>9}{'questions/s':>13}{'answered':>10}")
+
+        seconds, answered = await single(client, questions, args.concurrency)
+        print(f"{f'POST /query x{args.concurrency}':<22}{seconds:>9.1f}{len(questions)/seconds:>13.2f}{answered:>10}")
+
+        seconds, answered = await batched(client, questions, args.batch_size)
+        print(f"{f'POST /query/batch {args.batch_size}':<22}{seconds:>9.1f}{len(questions)/seconds:>13.2f}{answered:>10}")
+
+def main()->None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--questions", required=True, help="File with one question per line")
+    parser.add_argument("--limit", type=int, default=200, help="Questions used at most")
+    parser.add_argument("--concurrency", type=int, default=1, help="POST /query requests in flight")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Recall, latency and memory of the Qdrant collection profiles.
+
+    python -m benchmarks.bench_collection_profiles --url http://localhost:6333 --points 100000
+
+Needs a Qdrant server, the local mode of qdrant-client ignores quantization and HNSW settings.
+Clustered random vectors are written to one bench_<profile> collection per profile, the exact
+top k of the default collection is the ground truth. Every profile is searched with its own
+defaults and with every --ef value. RAM is the estimate of CollectionProfile.ram_bytes, the
+collections are deleted at the end unless --keep is given."""
+
+import argparse
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointStruct, SearchParams
+
+from app.core.collection_profiles import COLLECTION_PROFILES, CollectionProfile
+
+
+def clustered_vectors(count:int, dimension:int, clusters:int, rng:np.random.Generator)->np.ndarray:
+
+    #Embeddings are far from uniform, clusters make the recall numbers closer to real collections
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dimension), dtype=np.float32)
+
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def create(client:QdrantClient, name:str, profile:CollectionProfile, vectors:np.ndarray, batch_size:int)->None:
+
+    if client.collection_exists(name):
+        client.delete_collection(name)
+
+    client.create_collection(collection_name=name, **profile.create_options(vectors.shape[1]))
+
+    for start in range(0, len(vectors), batch_size):
+        client.upsert(collection_name=name,
+                      points=[PointStruct(id=start + i, vector=vector.tolist())
+                              for i, vector in enumerate(vectors[start:start+batch_size])],
+                      wait=False)
+
+    #Searches are only representative once the optimizer has built the index
+    while client.get_collection(name).status != "green":
+        time.sleep(1)
+
+def run_queries(client:QdrantClient, name:str, queries:np.ndarray, k:int,
+                search_params:SearchParams|None)->tuple[float,list[set[int]]]:
+
+    results = []
+    start = time.perf_counter()
+
+    for query in queries:
+        response = client.query_points(collection_name=name, query=query.tolist(), limit=k, search_params=search_params)
+        results.append({int(point.id) for point in response.points})
+
+    return (time.perf_counter() - start) / len(queries), results
+
+def main()->None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:6333")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--profile", action="append", choices=list(COLLECTION_PROFILES),
+                        help="Profiles to compare, all of them by default")
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef", type=int, action="append", default=[], help="hnsw_ef values searched on top of the defaults")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark collections")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = clustered_vectors(args.points, args.dimension, args.clusters, rng)
+    queries = clustered_vectors(args.queries, args.dimension, args.clusters, rng)
+
+    client = QdrantClient(url=args.url, api_key=args.api_key, timeout=120)
+    profiles = [COLLECTION_PROFILES[name] for name in args.profile or COLLECTION_PROFILES]
+
+    names = []
+    try:
+        for profile in profiles:
+            name = f"bench_{profile.name}"
+            names.append(name)
+            start = time.perf_counter()
+            create(client, name, profile, vectors, args.batch_size)
+            print(f"Indexed {name} in {time.perf_counter()-start:.1f}s")
+
+        _, exact = run_queries(client, names[0], queries, args.k, SearchParams(exact=True))
+
+        print(f"{'profile':<14}{'hnsw_ef':>8}{'oversampling':>14}{'RAM MiB':>10}{'ms/query':>10}{f'recall@{args.k}':>11}")
+
+        for profile, name in zip(profiles, names):
+            for ef in [None, *args.ef]:
+                search_params = profile.search_params(hnsw_ef=ef)
+                seconds, found = run_queries(client, name, queries, args.k, search_params)
+                recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+                oversampling = search_params.quantization.oversampling if search_params and search_params.quantization else None
+
+                print(f"{profile.name:<14}{str((search_params and search_params.hnsw_ef) or '-'):>8}"
+                      f"{str(oversampling or '-'):>14}{profile.ram_bytes(args.points, args.dimension)/2**20:>10.1f}"
+                      f"{seconds*1000:>10.2f}{recall:>11.3f}")
+    finally:
+        if not args.keep:
+            for name in names:
+                client.delete_collection(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Prompt size and coverage of the context selection against the plain top k.
+
+    python -m benchmarks.bench_context_selection --documents 200 --k 4 --max-tokens 2000
+
+Synthetic documents are split like the ingestion does (CHUNK_SIZE and CHUNK_OVERLAP
+characters), every question is a sentence of one document. The top k of a search and the
+ContextSelector over --candidates results are compared on context tokens, distinct text in the
+context (word 8-grams), share of repeated text and whether the question's sentence is in the context.
+
+Vectors are hashed bags of words, offline and free, a chunk is close to the chunks that share
+its words, so overlapping neighbours of one document score alike as they do with real embeddings."""
+
+import argparse
+import hashlib
+import random
+import re
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.core.context_selection import ContextSelector
+from app.core.text_splitter import DEFAULT_SEPARATORS
+from app.core.tokenizer import token_length
+
+SENTENCE_PATTERN = re.compile(r"[^.]+\.")
+SHINGLE_WORDS = 8
+
+
+def embed(texts:list[str], dimension:int)->np.ndarray:
+
+    vectors = np.zeros((len(texts), dimension), dtype=np.float32)
+
+    for i, text in enumerate(texts):
+        for word in text.lower().split():
+            digest = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            vectors[i, digest % dimension] += 1.0 if digest >> 63 else -1.0
+
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+
+def documents(count:int, rng:random.Random)->list[Document]:
+
+    result = []
+
+    for i in range(count):
+        #Every document has its own vocabulary, with some words shared across documents
+        vocabulary = [f"w{rng.randint(0, 5000)}" for _ in range(60)]
+        lines = [" ".join(rng.choices(vocabulary, k=rng.randint(8, 25))).capitalize() + "."
+                 for _ in range(rng.randint(40, 120))]
+        #Short paragraphs, the splitter only repeats whole pieces that fit into the overlap
+        paragraphs = []
+        while lines:
+            size = rng.randint(1, 3)
+            paragraphs.append(" ".join(lines[:size]))
+            lines = lines[size:]
+        result.append(Document(page_content="\n\n".join(paragraphs), metadata={'source':f"doc{i}"}))
+
+    return result
+
+def sentences(docs:list[Document])->list[str]:
+    return [sentence.strip() for doc in docs for sentence in SENTENCE_PATTERN.findall(doc.page_content)]
+
+def shingles(text:str)->list[tuple[str,...]]:
+
+    words = text.split()
+
+    return [tuple(words[i:i+SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+
+def main()->None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--chunk-overlap", type=int, default=300)
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--mmr-lambda", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=2000)
+    parser.add_argument("--model", default="gpt-4o-mini", help="Tokenizer of the context tokens")
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    splitter = RecursiveCharacterTextSplitter(separators=DEFAULT_SEPARATORS, chunk_size=args.chunk_size,
+                                              chunk_overlap=args.chunk_overlap)
+
+    chunks = []
+    for doc in documents(args.documents, rng):
+        for index, chunk in enumerate(splitter.split_documents([doc])):
+            chunk.metadata['chunk_index'] = index
+            chunks.append(chunk)
+
+    vectors = embed([chunk.page_content for chunk in chunks], args.dimension)
+    print(f"{len(chunks)} chunks of {args.documents} documents")
+
+    questions = [question.rstrip(".") for question in rng.sample(sentences(chunks), args.questions)]
+    length = token_length(args.model)
+    selectors = {
+        'top k':None,
+        'mmr':ContextSelector(args.candidates, args.mmr_lambda, merge=False, max_tokens=0, model_name=args.model),
+        'mmr+merge':ContextSelector(args.candidates, args.mmr_lambda, merge=True, max_tokens=0, model_name=args.model),
+        'selection':ContextSelector(args.candidates, args.mmr_lambda, merge=True, max_tokens=args.max_tokens,
+                                    model_name=args.model),
+    }
+
+    print(f"{'context':<11}{'tokens':>8}{'distinct':>10}{'repeated':>10}{'hit rate':>10}{'ms/query':>10}")
+
+    for name, selector in selectors.items():
+        tokens, distinct, repeated, hits, seconds = 0, 0, 0.0, 0, 0.0
+
+        for question in questions:
+            scores = vectors @ embed([question], args.dimension)[0]
+            top = np.argsort(-scores)[:max(args.candidates, args.k)]
+
+            start = time.perf_counter()
+            if selector is None:
+                context = [chunks[i] for i in top[:args.k]]
+            else:
+                results = [(Document(page_content=chunks[i].page_content,
+                                     metadata={**chunks[i].metadata, '_vector':vectors[i]}), float(scores[i])) for i in top]
+                context = selector.select(results, k=args.k)
+            seconds += time.perf_counter() - start
+
+            found = [shingle for doc in context for shingle in shingles(doc.page_content)]
+            tokens += sum(length(doc.page_content) for doc in context)
+            distinct += len(set(found))
+            repeated += 1 - len(set(found)) / max(len(found), 1)
+            hits += any(question in doc.page_content for doc in context)
+
+        n = len(questions)
+        print(f"{name:<11}{tokens/n:>8.0f}{distinct/n:>10.0f}{repeated/n:>10.1%}{hits/n:>10.1%}{seconds/n*1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
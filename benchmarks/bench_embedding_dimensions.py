@@ -0,0 +1,109 @@
+"""Recall of shortened (Matryoshka) text-embedding-3 vectors against the full size ones.
+
+    python -m benchmarks.bench_embedding_dimensions --dimensions 256 --dimensions 512
+    python -m benchmarks.bench_embedding_dimensions --texts data/passages.txt --model text-embedding-3-large
+
+By default the full size vectors already stored in the embedding cache are used, so no API
+call is made. With --texts every line of the file is embedded at full size instead.
+
+Shortening a text-embedding-3 vector to its first d values and normalizing it again gives the
+vector the API returns with dimensions=d, so every size is measured from the same embeddings.
+--queries of the vectors are held out and searched against the rest, the exact top k at full
+size is the ground truth."""
+
+import argparse
+import sqlite3
+import time
+
+import numpy as np
+
+from app.config import get_settings
+
+
+def cached_vectors(path:str, model:str, limit:int)->np.ndarray:
+
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT vector FROM embeddings WHERE model = ? LIMIT ?", (model, limit)).fetchall()
+    conn.close()
+
+    if not rows:
+        raise SystemExit(f"No {model} vectors in the embedding cache {path}, ingest some documents or use --texts")
+
+    return np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+
+def embedded_vectors(path:str, model:str, limit:int)->np.ndarray:
+
+    from langchain_openai import OpenAIEmbeddings
+
+    with open(path, encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()][:limit]
+
+    embeddings = OpenAIEmbeddings(model=model, openai_api_key=get_settings().openai_api_key)
+
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+def shorten(vectors:np.ndarray, dimensions:int)->np.ndarray:
+
+    short = vectors[:, :dimensions]
+
+    return short / np.linalg.norm(short, axis=1, keepdims=True)
+
+def top_k(corpus:np.ndarray, queries:np.ndarray, k:int)->tuple[np.ndarray,float]:
+
+    start = time.perf_counter()
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+    return top, (time.perf_counter() - start) / len(queries)
+
+def main()->None:
+
+    settings = get_settings()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=settings.embedding_model)
+    parser.add_argument("--cache", default=settings.embedding_cache_path, help="Embedding cache to read vectors from")
+    parser.add_argument("--texts", default=None, help="Embed the lines of this file instead of reading the cache")
+    parser.add_argument("--limit", type=int, default=100000, help="Vectors used at most")
+    parser.add_argument("--dimensions", type=int, action="append", default=[],
+                        help="Shortened sizes to compare, 256, 512 and 1024 by default")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.texts:
+        vectors = embedded_vectors(args.texts, args.model, args.limit)
+    else:
+        vectors = cached_vectors(args.cache, args.model, args.limit)
+
+    full_size = vectors.shape[1]
+    vectors = shorten(vectors, full_size)
+
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(vectors))
+    query_count = min(args.queries, len(vectors) // 10)
+    queries, corpus = vectors[order[:query_count]], vectors[order[query_count:]]
+    k = min(args.k, len(corpus))
+
+    print(f"{len(corpus)} vectors of {args.model} at {full_size} dimensions, {query_count} queries")
+
+    exact, full_seconds = top_k(corpus, queries, k)
+
+    print(f"{'dimensions':>10}{'index MiB':>11}{'ms/query':>10}{'speedup':>9}{f'recall@{k}':>11}")
+    print(f"{full_size:>10}{corpus.nbytes/2**20:>11.1f}{full_seconds*1000:>10.3f}{1.0:>8.1f}x{1.0:>11.3f}")
+
+    for dimensions in sorted(args.dimensions or [256, 512, 1024]):
+        if dimensions >= full_size:
+            continue
+
+        short_corpus = np.ascontiguousarray(shorten(corpus, dimensions))
+        found, seconds = top_k(short_corpus, shorten(queries, dimensions), k)
+        recall = np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact)])
+
+        print(f"{dimensions:>10}{short_corpus.nbytes/2**20:>11.1f}{seconds*1000:>10.3f}"
+              f"{full_seconds/seconds:>8.1f}x{recall:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
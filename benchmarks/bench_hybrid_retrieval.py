@@ -0,0 +1,167 @@
+"""Recall and latency of dense, sparse (BM25) and hybrid retrieval, offline.
+
+    python -m benchmarks.bench_hybrid_retrieval --documents 20000
+    python -m benchmarks.bench_hybrid_retrieval --documents 2000 --openai
+
+A synthetic corpus of topical passages is written to a local collection, some passages mention
+an identifier (error code, part number). Two kinds of questions look for one passage each:
+paraphrases that reuse some of its words, and exact-term questions that only name its identifier.
+
+Passages of one topic share its common words and draw the rest from its made up vocabulary.
+The dense model is a stand-in by default: a text is the mean of random word vectors, with
+identifiers weighted down the way dense embedding models blur rare tokens. --openai embeds
+everything with the configured embedding model instead (needs the API key, costs tokens)."""
+
+import argparse
+import hashlib
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.core.local_vector_store import LocalCollection
+from app.core.sparse import TOKEN_PATTERN, BM25Encoder, reciprocal_rank_fusion
+
+TOPICS = {
+    'billing':"invoice payment refund charge subscription plan card receipt tax discount",
+    'network':"router latency packet firewall dns gateway bandwidth vpn subnet timeout",
+    'hardware':"fan sensor voltage board controller firmware temperature power supply chassis",
+    'accounts':"password login user role permission token session profile email reset",
+    'storage':"disk volume backup snapshot replica quota bucket archive restore partition",
+}
+FILLER = "the a system when after before during with without should will can may this that".split()
+CODE_PREFIXES = ["ERR", "PN", "SKU", "KB"]
+SYLLABLES = "ka lo mi ne ru sa ti vo ze ba de fi gu ha jo".split()
+
+
+class StandInEmbeddings:
+
+    def __init__(self, dimension:int, identifier_weight:float):
+
+        self.dimension = dimension
+        self.identifier_weight = identifier_weight
+        self._words:dict[str,np.ndarray] = {}
+
+    def _word(self, word:str)->np.ndarray:
+
+        if word not in self._words:
+            seed = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            self._words[word] = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return self._words[word]
+
+    def embed(self, texts:list[str])->np.ndarray:
+
+        vectors = []
+        for text in texts:
+            words = TOKEN_PATTERN.findall(text.lower()) or ["empty"]
+            weights = [self.identifier_weight if any(c.isdigit() for c in word) else 1.0 for word in words]
+            vectors.append(np.average([self._word(word) for word in words], axis=0, weights=weights))
+
+        return np.asarray(vectors)
+
+def vocabularies(size:int, rng:random.Random)->dict[str,list[str]]:
+
+    #Every topic gets made up words on top of its common ones, so passages of one topic differ
+    return {topic:words.split() + ["".join(rng.choices(SYLLABLES, k=3)) + topic[:2] for _ in range(size)]
+            for topic, words in TOPICS.items()}
+
+def corpus(count:int, vocabulary_size:int, code_share:float, rng:random.Random)->tuple[list[str],dict[int,str]]:
+
+    topics = vocabularies(vocabulary_size, rng)
+    texts = []
+    codes = {}
+
+    for i in range(count):
+        topic = rng.choice(list(topics))
+        words = rng.choices(topics[topic], k=40) + rng.choices(FILLER, k=30)
+        rng.shuffle(words)
+        text = " ".join(words)
+
+        if rng.random() < code_share:
+            codes[i] = f"{rng.choice(CODE_PREFIXES)}-{rng.randint(1000, 99999)}"
+            text += f" see {codes[i]} for details"
+
+        texts.append(text)
+
+    return texts, codes
+
+def questions(texts:list[str], codes:dict[int,str], count:int, rng:random.Random)->dict[str,list[tuple[str,int]]]:
+
+    paraphrases = []
+    for target in rng.sample(range(len(texts)), count):
+        words = texts[target].split()
+        paraphrases.append((" ".join(rng.sample(words, 12)), target))
+
+    exact = [(f"what does {codes[target]} mean", target) for target in rng.sample(list(codes), min(count, len(codes)))]
+
+    return {'paraphrase':paraphrases, 'exact term':exact}
+
+def main()->None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--questions", type=int, default=200, help="Questions of every kind")
+    parser.add_argument("--vocabulary", type=int, default=500, help="Made up words of every topic")
+    parser.add_argument("--code-share", type=float, default=0.2, help="Share of passages with an identifier")
+    parser.add_argument("--dimension", type=int, default=384, help="Size of the stand-in dense vectors")
+    parser.add_argument("--identifier-weight", type=float, default=0.2)
+    parser.add_argument("--openai", action="store_true", help="Use the configured embedding model")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=50, help="Candidates of each list fused in hybrid mode")
+    parser.add_argument("--rrf-k", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts, codes = corpus(args.documents, args.vocabulary, args.code_share, rng)
+    kinds = questions(texts, codes, args.questions, rng)
+
+    if args.openai:
+        from app.core.embeddings import get_embeddings
+        embeddings = get_embeddings()
+        embed = lambda batch: np.asarray(embeddings.embed_documents(batch))
+    else:
+        embed = StandInEmbeddings(args.dimension, args.identifier_weight).embed
+
+    encoder = BM25Encoder()
+
+    with tempfile.TemporaryDirectory() as directory:
+        collection = LocalCollection(Path(directory), ann_threshold=0, ann_ef=64)
+
+        start = time.perf_counter()
+        for offset in range(0, len(texts), 1000):
+            batch = texts[offset:offset+1000]
+            collection.upsert([str(offset + i) for i in range(len(batch))], embed(batch),
+                              [Document(page_content=text, metadata={'source':'bench'}) for text in batch],
+                              encoder.encode_documents(batch))
+        print(f"Indexed {len(texts)} passages ({len(codes)} with an identifier) in {time.perf_counter()-start:.1f}s")
+
+        def dense(question:str, k:int)->list[int]:
+            return [row for row, _ in collection.search(embed([question])[0], k)]
+
+        def sparse(question:str, k:int)->list[int]:
+            return [row for row, _ in collection.sparse_search(encoder.encode_query(question), k)]
+
+        def hybrid(question:str, k:int)->list[int]:
+            fused = reciprocal_rank_fusion([dense(question, args.candidates), sparse(question, args.candidates)],
+                                           k=args.rrf_k)
+            return [row for row, _ in fused[:k]]
+
+        #Rows are assigned in insertion order in a new collection, row i is passage i
+        print(f"{'questions':<12}{'mode':<8}{f'recall@{args.k}':>10}{'ms/query':>10}")
+
+        for kind, items in kinds.items():
+            for name, search in [('dense', dense), ('sparse', sparse), ('hybrid', hybrid)]:
+                start = time.perf_counter()
+                hits = sum(target in search(question, args.k) for question, target in items)
+                seconds = (time.perf_counter() - start) / len(items)
+                print(f"{kind:<12}{name:<8}{hits/len(items):>10.3f}{seconds*1000:>10.2f}")
+
+        collection.close()
+
+
+if __name__ == "__main__":
+    main()
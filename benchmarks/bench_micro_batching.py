@@ -0,0 +1,86 @@
+"""Upstream calls and latency of the MicroBatcher under concurrent traffic, offline.
+
+    python -m benchmarks.bench_micro_batching --qps 50 --qps 200 --qps 1000
+    python -m benchmarks.bench_micro_batching --max-size 64 --max-wait-ms 10 --call-ms 80
+
+Queries arrive at random (Poisson) times at every --qps rate and go to a simulated upstream,
+an embedding or search call that takes --call-ms plus --item-ms per item of the call, with at
+most --upstream-concurrency calls at a time as a rate limit would allow. Every rate is run
+once with one call per query and once through a MicroBatcher."""
+
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from app.core.micro_batching import MicroBatcher
+
+
+class Upstream:
+
+    def __init__(self, call_ms:float, item_ms:float, concurrency:int):
+
+        self.call_ms = call_ms
+        self.item_ms = item_ms
+        self.calls = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def call(self, items:list[str])->list[str]:
+
+        async with self._slots:
+            self.calls += 1
+            await asyncio.sleep((self.call_ms + self.item_ms * len(items)) / 1000)
+
+        return items
+
+async def run(qps:float, queries:int, batcher_options:dict|None, args:argparse.Namespace)->tuple[int,np.ndarray,dict]:
+
+    upstream = Upstream(args.call_ms, args.item_ms, args.upstream_concurrency)
+    batcher = MicroBatcher(upstream.call, **batcher_options) if batcher_options else None
+    rng = random.Random(args.seed)
+    latencies = []
+
+    async def query(i:int)->None:
+        start = time.perf_counter()
+        if batcher is None:
+            await upstream.call([f"q{i}"])
+        else:
+            await batcher.submit(f"q{i}")
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    for i in range(queries):
+        tasks.append(asyncio.create_task(query(i)))
+        await asyncio.sleep(rng.expovariate(qps))
+    await asyncio.gather(*tasks)
+
+    return upstream.calls, np.array(latencies) * 1000, batcher.stats.stats() if batcher else {}
+
+def main()->None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qps", type=float, action="append", default=[], help="Arrival rates, 20, 100 and 500 by default")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Traffic simulated at every rate")
+    parser.add_argument("--max-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--call-ms", type=float, default=60.0, help="Fixed time of an upstream call")
+    parser.add_argument("--item-ms", type=float, default=0.5, help="Extra time per item of a call")
+    parser.add_argument("--upstream-concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'qps':>6}{'batching':>10}{'calls':>8}{'p50 ms':>9}{'p99 ms':>9}{'avg batch':>11}{'fill':>7}")
+
+    for qps in args.qps or [20, 100, 500]:
+        queries = max(1, int(qps * args.seconds))
+        for batcher_options in [None, {'max_size':args.max_size, 'max_wait_ms':args.max_wait_ms}]:
+            calls, latencies, stats = asyncio.run(run(qps, queries, batcher_options, args))
+            print(f"{qps:>6.0f}{'on' if batcher_options else 'off':>10}{calls:>8}"
+                  f"{np.percentile(latencies, 50):>9.1f}{np.percentile(latencies, 99):>9.1f}"
+                  f"{stats.get('average_batch_size', '-'):>11}{stats.get('fill_ratio', '-'):>7}")
+
+
+if __name__ == "__main__":
+    main()
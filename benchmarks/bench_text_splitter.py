@@ -0,0 +1,133 @@
+"""Equivalence check and throughput benchmark of OffsetTextSplitter against RecursiveCharacterTextSplitter.
+
+    python -m benchmarks.bench_text_splitter --size-mb 20
+    python -m benchmarks.bench_text_splitter --file data/big.txt --file data/big.csv
+
+Every corpus (and a set of random fuzz inputs) is first split by both splitters and the
+chunks must be identical, the run stops with an error otherwise."""
+
+import argparse
+import random
+import time
+from pathlib import Path
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.core.text_splitter import DEFAULT_SEPARATORS, OffsetTextSplitter
+
+WORDS = ("retrieval augmented generation answers questions from documents with sources "
+         "the vector store keeps embeddings of every chunk and returns the closest ones").split()
+
+
+def prose(size:int, rng:random.Random)->str:
+
+    paragraphs = []
+    total = 0
+
+    while total < size:
+        sentences = [" ".join(rng.choices(WORDS, k=rng.randint(5, 25))).capitalize() + "."
+                     for _ in range(rng.randint(1, 12))]
+        paragraph = " ".join(sentences)
+        if rng.random() < 0.3:
+            paragraph = "\n".join(paragraph[i:i+80] for i in range(0, len(paragraph), 80))
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+
+    return "\n\n".join(paragraphs)
+
+def csv_rows(size:int, rng:random.Random)->str:
+
+    rows = []
+    total = 0
+
+    while total < size:
+        row = ",".join([str(rng.randint(0, 10**6)), *rng.choices(WORDS, k=6), f"{rng.random():.4f}"])
+        rows.append(row)
+        total += len(row) + 1
+
+    return "\n".join(rows)
+
+def long_lines(size:int, rng:random.Random)->str:
+
+    #No paragraph or line breaks, the splitter falls through to sentences and words
+    return " ".join(rng.choices(WORDS, k=size // 7))
+
+def fuzz_inputs(count:int, rng:random.Random):
+
+    alphabet = ["\n\n", "\n", ".", " ", "a", "bb", "ccc", " . ", "\n \n", "  ", "x" * 20, "\t"]
+
+    for _ in range(count):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 400)))
+        chunk_size = rng.randint(1, 80)
+        yield text, chunk_size, rng.randint(0, chunk_size)
+
+def check_equivalence(name:str, text:str, chunk_size:int, chunk_overlap:int)->None:
+
+    expected = RecursiveCharacterTextSplitter(separators=DEFAULT_SEPARATORS, chunk_size=chunk_size,
+                                              chunk_overlap=chunk_overlap, length_function=len).split_text(text)
+    actual = OffsetTextSplitter(separators=DEFAULT_SEPARATORS, chunk_size=chunk_size,
+                                chunk_overlap=chunk_overlap).split_text(text)
+
+    if actual != expected:
+        first = next((i for i, (a, b) in enumerate(zip(actual, expected)) if a != b), min(len(actual), len(expected)))
+        raise SystemExit(f"{name}: chunks differ (size {chunk_size}, overlap {chunk_overlap}), "
+                         f"{len(actual)} vs {len(expected)} chunks, first difference at chunk {first}")
+
+def best_time(splitter, text:str, repeat:int)->tuple[float,int]:
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = splitter.split_text(text)
+        best = min(best, time.perf_counter() - start)
+
+    return best, len(chunks)
+
+def main()->None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=10.0, help="Size of every generated corpus")
+    parser.add_argument("--file", action="append", default=[], help="Benchmark a file instead of the generated corpora")
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--chunk-overlap", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many runs is reported")
+    parser.add_argument("--fuzz", type=int, default=2000, help="Random small inputs checked for equivalence")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    for i, (text, chunk_size, chunk_overlap) in enumerate(fuzz_inputs(args.fuzz, rng)):
+        check_equivalence(f"fuzz input {i}", text, chunk_size, chunk_overlap)
+    print(f"{args.fuzz} fuzz inputs split identically")
+
+    if args.file:
+        corpora = {path:Path(path).read_text(encoding="utf-8") for path in args.file}
+    else:
+        size = int(args.size_mb * 1_000_000)
+        corpora = {"prose":prose(size, rng), "csv":csv_rows(size, rng), "long lines":long_lines(size, rng)}
+
+    splitters = {
+        "recursive":RecursiveCharacterTextSplitter(separators=DEFAULT_SEPARATORS, chunk_size=args.chunk_size,
+                                                   chunk_overlap=args.chunk_overlap, length_function=len),
+        "offset":OffsetTextSplitter(separators=DEFAULT_SEPARATORS, chunk_size=args.chunk_size,
+                                    chunk_overlap=args.chunk_overlap),
+    }
+
+    print(f"{'corpus':<12}{'MB':>8}{'splitter':>12}{'chunks':>10}{'seconds':>10}{'MB/s':>10}{'speedup':>10}")
+
+    for name, text in corpora.items():
+        check_equivalence(name, text, args.chunk_size, args.chunk_overlap)
+
+        megabytes = len(text) / 1e6
+        times = {}
+        for splitter_name, splitter in splitters.items():
+            seconds, chunk_count = best_time(splitter, text, args.repeat)
+            times[splitter_name] = seconds
+            print(f"{name:<12}{megabytes:>8.1f}{splitter_name:>12}{chunk_count:>10}{seconds:>10.3f}"
+                  f"{megabytes/seconds:>10.1f}{times['recursive']/seconds:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
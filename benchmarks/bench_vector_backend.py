@@ -0,0 +1,88 @@
+"""Search latency of the local vector backend, exact and (with hnswlib installed) approximate.
+
+    python -m benchmarks.bench_vector_backend --points 100000 --dimension 1536
+
+Random unit vectors are written to a LocalCollection in a temporary directory, then the
+same queries are searched by the exact matrix product and by the HNSW index. The recall
+of the HNSW results is measured against the exact top k. The points belong to --sources
+sources, a search filtered to one of them shows the cost of a scoped query."""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.core import local_vector_store
+from app.core.local_vector_store import LocalCollection
+from app.core.vector_store import SearchFilter
+
+
+def timed_search(collection:LocalCollection, queries:np.ndarray, k:int,
+                 search_filter:SearchFilter|None=None)->tuple[float,list[set[int]]]:
+
+    start = time.perf_counter()
+    results = []
+    for query in queries:
+        rows = collection.filter_rows(search_filter) if search_filter is not None else None
+        results.append({row for row, _ in collection.search(query.tolist(), k, rows=rows)})
+
+    return (time.perf_counter() - start) / len(queries), results
+
+def main()->None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=5000, help="Points written per upsert")
+    parser.add_argument("--ef", type=int, default=64)
+    parser.add_argument("--sources", type=int, default=100, help="A filtered search covers 1/sources of the points")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    queries = rng.standard_normal((args.queries, args.dimension), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as directory:
+        collection = LocalCollection(Path(directory), ann_threshold=0, ann_ef=args.ef)
+
+        start = time.perf_counter()
+        for offset in range(0, args.points, args.batch_size):
+            size = min(args.batch_size, args.points - offset)
+            collection.upsert([str(offset + i) for i in range(size)],
+                              rng.standard_normal((size, args.dimension), dtype=np.float32),
+                              [Document(page_content="", metadata={'source':f"source_{(offset + i) % args.sources}"})
+                               for i in range(size)])
+        print(f"Wrote {args.points} points of dimension {args.dimension} in {time.perf_counter()-start:.2f}s")
+
+        exact_seconds, exact = timed_search(collection, queries, args.k)
+        print(f"{'exact':<8}{exact_seconds*1000:>10.2f} ms/query")
+
+        filtered_seconds, _ = timed_search(collection, queries, args.k, SearchFilter(sources=["source_0"]))
+        print(f"{'1 source':<8}{filtered_seconds*1000:>10.2f} ms/query  ({args.points // args.sources} points, "
+              f"filter included)")
+
+        if local_vector_store.hnswlib is None:
+            print("hnswlib is not installed, the approximate search is skipped")
+            collection.close()
+            return
+
+        collection.ann_threshold = 1
+        start = time.perf_counter()
+        collection._build_index()
+        print(f"Built the HNSW index in {time.perf_counter()-start:.2f}s")
+
+        ann_seconds, approximate = timed_search(collection, queries, args.k)
+        recall = np.mean([len(a & e) / len(e) for a, e in zip(approximate, exact)])
+        print(f"{'hnsw':<8}{ann_seconds*1000:>10.2f} ms/query  recall@{args.k} {recall:.3f}  "
+              f"speedup {exact_seconds/ann_seconds:.1f}x")
+
+        collection.close()
+
+
+if __name__ == "__main__":
+    main()
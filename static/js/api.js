@@ -79,11 +79,12 @@ class APIClient {
                 });
             }
 
-            xhr.addEventListener('load', () => {
+            xhr.addEventListener('load', async () => {
                 try {
                     if (xhr.status >= 200 && xhr.status < 300) {
-                        const data = JSON.parse(xhr.responseText);
-                        resolve({ data, error: null });
+                        // The upload is ingested by a background job, wait for it to finish
+                        const job = JSON.parse(xhr.responseText);
+                        resolve(await this.waitForJob(job.job_id));
                     } else {
                         const errorData = JSON.parse(xhr.responseText);
                         resolve({
@@ -109,6 +110,41 @@ class APIClient {
         });
     }
 
+    /**
+     * Get ingestion job status
+     * @param {string} jobId - Job id returned by the upload
+     * @returns {Promise<{data: any, error: any}>} Job status
+     */
+    async getJobStatus(jobId) {
+        return this.request(`/documents/jobs/${jobId}`, {
+            method: 'GET'
+        });
+    }
+
+    /**
+     * Poll an ingestion job until it completes or fails
+     * @param {string} jobId - Job id returned by the upload
+     * @param {number} intervalMs - Polling interval
+     * @returns {Promise<{data: any, error: any}>} Upload result or error
+     */
+    async waitForJob(jobId, intervalMs = 1000) {
+        while (true) {
+            const { data, error } = await this.getJobStatus(jobId);
+
+            if (error) {
+                return { data: null, error };
+            }
+            if (data.status === 'completed') {
+                return { data: data.result, error: null };
+            }
+            if (data.status === 'failed') {
+                return { data: null, error: data.error || 'Ingestion failed' };
+            }
+
+            await new Promise((resolve) => setTimeout(resolve, intervalMs));
+        }
+    }
+
     /**
      * Get collection information
      * @returns {Promise<{data: any, error: any}>} Collection info
@@ -151,9 +187,9 @@ class APIClient {
     }
 
     /**
-     * Submit streaming query
+     * Submit streaming query (Server-Sent Events: sources, token..., done | error)
      * @param {string} question - Question text
-     * @param {Function} onChunk - Callback for each chunk
+     * @param {Function} onChunk - Callback for each answer chunk
      * @returns {Promise<{data: string, error: any}>} Complete streamed response or error
      */
     async queryStream(question, onChunk) {
@@ -165,7 +201,7 @@ class APIClient {
                 },
                 body: JSON.stringify({
                     question,
-                    include_sources: false,
+                    include_source: false,
                     enable_evaluation: false
                 })
             });
@@ -181,16 +217,36 @@ class APIClient {
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
             let fullText = '';
+            let buffer = '';
 
             while (true) {
                 const { done, value } = await reader.read();
                 if (done) break;
 
-                const chunk = decoder.decode(value, { stream: true });
-                fullText += chunk;
+                buffer += decoder.decode(value, { stream: true });
+
+                // Events are separated by a blank line
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
 
-                if (onChunk) {
-                    onChunk(chunk);
+                    let event = 'message';
+                    let data = '';
+                    for (const line of frame.split('\n')) {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    const payload = data ? JSON.parse(data) : null;
+
+                    if (event === 'token') {
+                        fullText += payload.text;
+                        if (onChunk) {
+                            onChunk(payload.text);
+                        }
+                    } else if (event === 'error') {
+                        return { data: null, error: payload.message };
+                    }
                 }
             }
 
@@ -197,7 +197,7 @@ const Components = {
                 <div class="result-details">
                     <span class="badge bg-primary">Filename: ${escapeHtml(result.filename)}</span>
                     <span class="badge bg-info">Chunks: ${result.chunks_created}</span>
-                    <span class="badge bg-secondary">Documents: ${result.document_ids?.length || 0}</span>
+                    <span class="badge bg-secondary">Documents: ${result.document_count ?? result.document_ids?.length ?? 0}</span>
                 </div>
             </div>
         `;
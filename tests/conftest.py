@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+#Settings are read on import of the app modules, the tests never reach OpenAI or Qdrant
+CACHE_DIR = tempfile.mkdtemp(prefix="rag_qa_tests_")
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ["JOB_STORE_PATH"] = os.path.join(CACHE_DIR, "jobs.sqlite3")
+os.environ["JOB_SPOOL_DIR"] = os.path.join(CACHE_DIR, "uploads")
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+os.environ["LOCAL_VECTOR_STORE_PATH"] = os.path.join(CACHE_DIR, "vectors")
@@ -0,0 +1,53 @@
+import numpy as np
+
+from app.core.embedding_cache import EmbeddingCache
+
+MODEL = "text-embedding-3-small"
+
+
+def stored_bytes(cache:EmbeddingCache)->int:
+    return cache._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+
+def test_size_counts_replaced_and_repeated_texts_once(tmp_path):
+
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite3", max_bytes=10**9)
+
+    cache.put_many(MODEL, ["a", "b"], [[0.1] * 8, [0.2] * 8])
+    cache.put_many(MODEL, ["a", "c"], [[0.3] * 8, [0.4] * 8])
+    cache.put_many(MODEL, ["d", "d"], [[0.5] * 8, [0.6] * 8])
+
+    assert cache._size_bytes == stored_bytes(cache) == 4 * 8 * 4
+    #The last vector of a text repeated in a batch is kept
+    a, d, missing = cache.get_many(MODEL, ["a", "d", "missing"])
+    assert np.allclose(a, [0.3] * 8) and np.allclose(d, [0.6] * 8) and missing is None
+
+    cache.close()
+
+def test_size_is_read_back_on_open(tmp_path):
+
+    path = tmp_path / "embeddings.sqlite3"
+    cache = EmbeddingCache(path, max_bytes=10**9)
+    cache.put_many(MODEL, ["a", "b", "a"], [[0.1] * 4, [0.2] * 4, [0.3] * 4])
+    cache.close()
+
+    reopened = EmbeddingCache(path, max_bytes=10**9)
+
+    assert reopened._size_bytes == stored_bytes(reopened) == 2 * 4 * 4
+
+    reopened.close()
+
+def test_eviction_keeps_the_size_under_the_budget(tmp_path):
+
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite3", max_bytes=100 * 16)
+
+    for start in range(0, 300, 30):
+        texts = [f"text {i}" for i in range(start, start + 30)]
+        cache.put_many(MODEL, texts, [[float(i)] * 4 for i in range(30)])
+        #Vectors already stored are replaced, not counted again
+        cache.put_many(MODEL, texts[:10], [[1.0] * 4] * 10)
+
+    assert cache.evictions > 0
+    assert cache._size_bytes == stored_bytes(cache) <= cache.max_bytes
+
+    cache.close()
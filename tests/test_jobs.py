@@ -0,0 +1,95 @@
+import socket
+import sqlite3
+import time
+
+from app.core.jobs import QUEUED, RUNNING, JobStore, new_owner, owner_alive
+
+
+def make_store(tmp_path, *job_ids:str)->JobStore:
+
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    for job_id in job_ids:
+        store.create(job_id, f"{job_id}.txt", tmp_path / f"{job_id}.txt", {})
+
+    return store
+
+
+def test_a_job_is_claimed_once(tmp_path):
+
+    store = make_store(tmp_path, "a")
+    owner = new_owner()
+
+    assert store.claim("a", owner)
+    assert not store.claim("a", new_owner())
+
+    job = store.get("a")
+    assert job['status'] == RUNNING and job['owner'] == owner
+    assert store.queued() == []
+
+    store.close()
+
+def test_jobs_of_a_stopped_owner_are_queued_again(tmp_path):
+
+    store = make_store(tmp_path, "alive", "dead_process", "other_host", "stale")
+    host = socket.gethostname()
+
+    store.claim("alive", new_owner())
+    store.claim("dead_process", f"{host}:999999999:00000000")
+    store.claim("other_host", "other-host:1:00000000")
+    store.claim("stale", "other-host:2:00000000")
+    store._conn.execute("UPDATE jobs SET heartbeat_at = 0 WHERE id = 'stale'")
+    store._conn.commit()
+
+    assert sorted(store.requeue_orphaned(stale_seconds=60)) == ["dead_process", "stale"]
+    assert store.queued() == ["dead_process", "stale"]
+    assert store.get("dead_process")['owner'] is None
+    assert store.get("other_host")['status'] == RUNNING
+
+    store.close()
+
+def test_heartbeat_keeps_the_jobs_of_its_owner(tmp_path):
+
+    store = make_store(tmp_path, "a", "b")
+    owner = new_owner()
+    store.claim("a", owner)
+    store.claim("b", "other-host:1:00000000")
+    store._conn.execute("UPDATE jobs SET heartbeat_at = 0")
+    store._conn.commit()
+
+    store.heartbeat(owner)
+
+    assert store.get("a")['heartbeat_at'] > time.time() - 5
+    assert store.requeue_orphaned(stale_seconds=60) == ["b"]
+
+    store.close()
+
+def test_owner_alive():
+
+    host = socket.gethostname()
+
+    assert owner_alive(new_owner())
+    assert not owner_alive(f"{host}:999999999:00000000")
+    #Processes of other hosts are judged by their heartbeat
+    assert owner_alive("other-host:999999999:00000000")
+
+def test_store_without_owners_is_migrated(tmp_path):
+
+    path = tmp_path / "jobs.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, filename TEXT NOT NULL, file_path TEXT NOT NULL, "
+                 "status TEXT NOT NULL, stage TEXT NOT NULL, options TEXT NOT NULL DEFAULT '{}', "
+                 "progress TEXT NOT NULL DEFAULT '{}', timings TEXT NOT NULL DEFAULT '{}', result TEXT, error TEXT, "
+                 "created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO jobs (id, filename, file_path, status, stage, created_at, updated_at) "
+                 "VALUES ('old', 'old.txt', 'old.txt', 'running', 'ingesting', 1, 1)")
+    conn.commit()
+    conn.close()
+
+    store = JobStore(path)
+
+    #A running job without an owner was interrupted by the old version
+    assert store.requeue_orphaned(stale_seconds=60) == ["old"]
+    assert store.get("old")['status'] == QUEUED
+    assert store.claim("old", new_owner())
+
+    store.close()
@@ -0,0 +1,34 @@
+import random
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.core.text_splitter import DEFAULT_SEPARATORS, OffsetTextSplitter
+from benchmarks.bench_text_splitter import csv_rows, fuzz_inputs, long_lines, prose
+
+
+def assert_same_chunks(text:str, chunk_size:int, chunk_overlap:int)->None:
+
+    expected = RecursiveCharacterTextSplitter(separators=DEFAULT_SEPARATORS, chunk_size=chunk_size,
+                                              chunk_overlap=chunk_overlap, length_function=len).split_text(text)
+    actual = OffsetTextSplitter(separators=DEFAULT_SEPARATORS, chunk_size=chunk_size,
+                                chunk_overlap=chunk_overlap).split_text(text)
+
+    assert actual == expected
+
+
+def test_fuzz_inputs_split_like_the_recursive_splitter():
+
+    for text, chunk_size, chunk_overlap in fuzz_inputs(2000, random.Random(0)):
+        assert_same_chunks(text, chunk_size, chunk_overlap)
+
+@pytest.mark.parametrize("corpus", [prose, csv_rows, long_lines])
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(1500, 300), (200, 0), (50, 49)])
+def test_corpora_split_like_the_recursive_splitter(corpus, chunk_size:int, chunk_overlap:int):
+
+    assert_same_chunks(corpus(200_000, random.Random(1)), chunk_size, chunk_overlap)
+
+def test_length_function_must_be_len():
+
+    with pytest.raises(ValueError):
+        OffsetTextSplitter(chunk_size=100, chunk_overlap=0, length_function=lambda text: len(text.split()))
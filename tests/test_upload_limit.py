@@ -0,0 +1,93 @@
+import io
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi import FastAPI, UploadFile
+from fastapi.testclient import TestClient
+
+from app.api.middleware import UploadSizeLimitMiddleware
+from app.config import get_settings
+
+ORIGIN = "http://example.com"
+#Over the limit of 1 MB, multipart overhead included
+LARGE_FILE = b"word " * 300_000
+
+
+@pytest.fixture(autouse=True)
+def max_upload_mb(monkeypatch):
+
+    monkeypatch.setenv("MAX_UPLOAD_MB", "1")
+    get_settings.cache_clear()
+    yield
+    get_settings.cache_clear()
+
+@pytest.fixture
+def client(monkeypatch):
+
+    #The app mounts ./static, the lifespan is not run so no service is started
+    monkeypatch.chdir(Path(__file__).resolve().parents[1])
+    from app.main import app
+
+    return TestClient(app)
+
+def chunked(body:bytes, size:int=64 * 1024):
+    #An iterator body is sent without a Content-Length
+    for start in range(0, len(body), size):
+        yield body[start:start+size]
+
+def multipart(content:bytes)->tuple[bytes,str]:
+
+    request = httpx.Request("POST", "http://testserver/documents/upload", files={'file':("a.txt", content, "text/plain")})
+
+    return request.read(), request.headers['content-type']
+
+
+def test_upload_over_the_content_length_limit(client):
+
+    response = client.post("/documents/upload", files={'file':("a.txt", io.BytesIO(LARGE_FILE), "text/plain")},
+                           headers={'origin':ORIGIN})
+
+    assert response.status_code == 413
+    assert response.json() == {'detail':"Upload is larger than the maximum of 1 MB"}
+    #CORS is the outermost middleware, so browsers can read the 413
+    assert response.headers['access-control-allow-origin'] == ORIGIN
+
+def test_chunked_upload_over_the_limit(client):
+
+    body, content_type = multipart(LARGE_FILE)
+
+    response = client.post("/documents/upload", content=chunked(body),
+                           headers={'content-type':content_type, 'origin':ORIGIN})
+
+    assert response.status_code == 413
+    assert response.json() == {'detail':"Upload is larger than the maximum of 1 MB"}
+    assert response.headers['access-control-allow-origin'] == ORIGIN
+
+
+#Reads a multipart upload like the upload route
+echo_app = FastAPI()
+
+@echo_app.post("/documents/upload")
+@echo_app.post("/other")
+async def echo(file:UploadFile)->int:
+    return len(await file.read())
+
+echo_client = TestClient(UploadSizeLimitMiddleware(echo_app))
+
+
+def test_upload_under_the_limit_reaches_the_app():
+
+    body, content_type = multipart(b"x" * 900_000)
+
+    assert echo_client.post("/documents/upload", content=body, headers={'content-type':content_type}).json() == 900_000
+    assert echo_client.post("/documents/upload", content=chunked(body),
+                            headers={'content-type':content_type}).json() == 900_000
+
+def test_other_paths_are_not_limited():
+
+    body, content_type = multipart(b"x" * 2_000_000)
+
+    assert echo_client.post("/other", content=chunked(body), headers={'content-type':content_type}).json() == 2_000_000
+    assert echo_client.post("/documents/upload", content=chunked(body),
+                            headers={'content-type':content_type}).status_code == 413